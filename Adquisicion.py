@@ -0,0 +1,717 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+
+import numpy as np
+from Alarmas import REGLAS, MotorAlarmas, cargar_reglas
+from Bitacora import configurar_registro
+from Conexion import SesionModbus
+from Metricas import REGISTRO, agregar_argumentos, iniciar_exportacion
+from Protocolo import (MAX_REGISTROS_LECTURA, REGISTRO_TICK, TOLERANCIA_HUECO, ClienteModbusAsync, ErrorModbus,
+                       leer_definiciones)
+from Salidas import crear_salida
+from Tendencias import CAPACIDAD_HISTORIAL, MAX_SILENCIO, BufferTendencias, DetectorCambios
+
+
+# Nombre interno del tick (REGISTRO_TICK) entre los valores de un barrido
+ETIQUETA_TICK = '_tick'
+
+
+class LecturaInconsistente(Exception):
+    pass
+
+
+class Etiqueta:
+    def __init__(self, nombre, direccion, escala=100.0, unidad='', banda_muerta=0.0):
+        self.nombre = nombre
+        self.direccion = direccion
+        self.escala = escala
+        self.unidad = unidad
+        self.banda_muerta = banda_muerta
+
+
+    def decodificar(self, registro):
+        return registro / self.escala
+
+
+# Mapa de etiquetas publicado por Server.py
+ETIQUETAS = [
+    Etiqueta('temperatura', 0, 100.0, '°C'),
+    Etiqueta('presion', 1, 100.0, 'bar'),
+    Etiqueta('nivel', 2, 100.0, '%'),
+]
+
+
+def cargar_etiquetas(ruta):
+    # Formato: [{"nombre": "temperatura", "direccion": 0, "escala": 100, "unidad": "°C"}, ...]
+    # Es el mismo archivo que acepta el simulador de Server.py (ignora sus campos propios)
+    definiciones = leer_definiciones(ruta)
+    return [Etiqueta(d['nombre'], int(d['direccion']),
+                     float(d.get('escala', 1.0)), d.get('unidad', ''),
+                     float(d.get('banda_muerta', 0.0)))
+            for d in definiciones]
+
+
+class BloqueLectura:
+    def __init__(self, inicio, etiqueta):
+        self.inicio = inicio
+        self.cantidad = 1
+        self.etiquetas = [etiqueta]
+
+
+    def decodificar(self, registros):
+        return {etiqueta.nombre: etiqueta.decodificar(registros[etiqueta.direccion - self.inicio])
+                for etiqueta in self.etiquetas}
+
+
+    def __repr__(self):
+        return f"BloqueLectura({self.inicio}, {self.cantidad}, {len(self.etiquetas)} etiquetas)"
+
+
+class PlanificadorLecturas:
+    def __init__(self, etiquetas, tolerancia_hueco=TOLERANCIA_HUECO,
+                 max_registros=MAX_REGISTROS_LECTURA, registro_tick=None):
+        if not 1 <= max_registros <= MAX_REGISTROS_LECTURA:
+            raise ValueError(f"max_registros debe estar entre 1 y {MAX_REGISTROS_LECTURA}")
+
+
+        self.tolerancia_hueco = tolerancia_hueco
+        self.max_registros = max_registros
+        self.registro_tick = registro_tick
+        self.ultimo_tick = 0
+        # Captura opcional (Captura.EscritorCaptura) de los registros recibidos en cada bloque
+        self.captura = None
+        if registro_tick is None:
+            self.bloques = self.planificar(etiquetas)
+            return
+
+
+        if any(etiqueta.direccion == registro_tick for etiqueta in etiquetas):
+            raise ValueError(f"La dirección {registro_tick} del tick está ocupada por una etiqueta")
+
+
+        # El tick viaja en el primer bloque que se lee: si no cambia al final del barrido,
+        # ningún otro bloque mezcla datos de dos publicaciones del servidor
+        self.bloques = self.planificar(etiquetas + [Etiqueta(ETIQUETA_TICK, registro_tick, 1.0)])
+        self.bloques.sort(key=lambda bloque: all(e.nombre != ETIQUETA_TICK for e in bloque.etiquetas))
+
+
+    def planificar(self, etiquetas):
+        bloques = []
+        for etiqueta in sorted(etiquetas, key=lambda e: e.direccion):
+            if bloques:
+                bloque = bloques[-1]
+                hueco = etiqueta.direccion - (bloque.inicio + bloque.cantidad)
+                cantidad = etiqueta.direccion + 1 - bloque.inicio
+
+
+                # Unir si el hueco es tolerable y el bloque no supera el límite del protocolo
+                if hueco <= self.tolerancia_hueco and cantidad <= self.max_registros:
+                    bloque.cantidad = max(bloque.cantidad, cantidad)
+                    bloque.etiquetas.append(etiqueta)
+                    continue
+
+
+            bloques.append(BloqueLectura(etiqueta.direccion, etiqueta))
+
+
+        logging.debug("Plan de lectura: %s", bloques)
+        return bloques
+
+
+    def leer(self, cliente, unidad=1):
+        # cliente es un ModbusTcpClient, así que pymodbus ya está cargado
+        from pymodbus.pdu import ExceptionResponse
+        valores = {}
+        for bloque in self.bloques:
+            respuesta = cliente.read_holding_registers(bloque.inicio, bloque.cantidad, unit=unidad)
+            if isinstance(respuesta, ExceptionResponse):
+                # El equipo respondió con una excepción: la conexión sigue siendo válida
+                raise ErrorModbus(respuesta.original_code, respuesta.exception_code)
+            if respuesta.isError():
+                raise IOError(f"Error leyendo registros {bloque.inicio}-"
+                              f"{bloque.inicio + bloque.cantidad - 1}: {respuesta}")
+
+
+            valores.update(bloque.decodificar(respuesta.registers))
+            if self.captura is not None:
+                self.captura.imagen(unidad, bloque.inicio, respuesta.registers)
+
+
+        # Con un solo bloque la lectura ya es atómica; con varios se relee el tick
+        tick_final = None
+        if self.registro_tick is not None and len(self.bloques) > 1:
+            respuesta = cliente.read_holding_registers(self.registro_tick, 1, unit=unidad)
+            if isinstance(respuesta, ExceptionResponse):
+                raise ErrorModbus(respuesta.original_code, respuesta.exception_code)
+            if respuesta.isError():
+                raise IOError(f"Error leyendo el tick en {self.registro_tick}: {respuesta}")
+            tick_final = respuesta.registers[0]
+            if self.captura is not None:
+                self.captura.imagen(unidad, self.registro_tick, respuesta.registers)
+
+
+        self.comprobar_tick(valores, tick_final)
+        return valores
+
+
+    def comprobar_tick(self, valores, tick_final):
+        # Un barrido que cruza una publicación del servidor mezclaría dos instantes
+        if tick_final is not None and tick_final != valores[ETIQUETA_TICK]:
+            raise LecturaInconsistente(f"El servidor publicó durante la lectura "
+                                       f"(tick {valores[ETIQUETA_TICK]:.0f} -> {tick_final})")
+
+
+    def es_repetida(self, valores):
+        # Quita el tick de los valores; sin publicación nueva no hay nada que procesar
+        tick = valores.pop(ETIQUETA_TICK, 0)
+        repetida = tick != 0 and tick == self.ultimo_tick
+        self.ultimo_tick = tick
+        return repetida
+
+
+class MonitorModbus:
+    # Lectura, alarmas e historial sin dependencias gráficas (base de ClienteModbus)
+    def __init__(self, host='localhost', port=502, unidad=1, etiquetas=None, salidas=None,
+                 historiador=None, registro_tick=REGISTRO_TICK, timeout=1.0, reglas=None,
+                 max_silencio=MAX_SILENCIO, captura=None, gateway=None, asincrono=False,
+                 capacidad_historial=CAPACIDAD_HISTORIAL):
+        # Sesión compartida con reconexión automática (backoff con jitter)
+        self.sesion = SesionModbus.compartida(host, port, timeout)
+        self.host = host
+        self.port = port
+        self.unidad = unidad
+        self.timeout = timeout
+
+
+        # Mapa de etiquetas y plan de lectura por bloques
+        self.etiquetas = etiquetas if etiquetas is not None else ETIQUETAS
+        self.planificador = PlanificadorLecturas(self.etiquetas, registro_tick=registro_tick)
+        self.captura = captura
+        self.planificador.captura = captura
+
+
+        # Con un gateway (Gateway.SuscriptorGateway) las muestras llegan ya sondeadas y filtradas
+        # por banda muerta: el equipo no recibe peticiones de este proceso
+        self.gateway = gateway
+
+
+        # Con asincrono el sondeo lo hace MotorAdquisicion (cliente asyncio) en lugar de la
+        # sesión síncrona; sus muestras llegan a los mismos buffers por muestra_motor
+        if asincrono and (gateway is not None or captura is not None):
+            raise ValueError("El modo asíncrono no admite gateway ni captura")
+        self.asincrono = asincrono
+
+
+        # Historial de tendencias y salidas de streaming. La capacidad debe cubrir con margen
+        # la ventana más amplia que se quiera ver sin leer del historiador
+        if capacidad_historial < 1:
+            raise ValueError("La capacidad del historial debe ser positiva")
+        self.capacidad_historial = capacidad_historial
+        self.historial = BufferTendencias([etiqueta.nombre for etiqueta in self.etiquetas],
+                                          self.capacidad_historial)
+        self.salidas = salidas if salidas is not None else []
+
+
+        # Informe por excepción: una muestra sin cambios fuera de la banda muerta no llega
+        # al historial, a las salidas ni al panel
+        self.columnas = [etiqueta.nombre for etiqueta in self.etiquetas]
+        self.detector = DetectorCambios([etiqueta.banda_muerta for etiqueta in self.etiquetas],
+                                        max_silencio)
+
+
+        # Estados y alarmas: todas las reglas se evalúan en cada muestra nueva
+        self.estado_sistema = "Normal"
+        self.alarmas = MotorAlarmas(reglas if reglas is not None else REGLAS,
+                                    [etiqueta.nombre for etiqueta in self.etiquetas])
+        self.contador_lecturas = 0
+        self.tiempo_inicio = datetime.now()
+
+
+        # Productor: la adquisición escribe en el historial con plazos fijos
+        self.periodo_muestreo = 1.0
+        self.bloqueo = threading.Lock()
+        self.detener = threading.Event()
+        self.version_datos = 0
+        self.contadores = {
+            'muestras': 0,
+            'lecturas_fallidas': 0,
+            'lecturas_repetidas': 0,
+            'lecturas_inconsistentes': 0,
+            'lecturas_sin_cambios': 0,
+            'ciclos_atrasados': 0,
+            'retraso_adquisicion': 0.0,
+            'retraso_maximo': 0.0,
+        }
+
+
+        # Métricas: la duración de cada barrido y los contadores anteriores, leídos al exportar
+        self.metrica_lectura = REGISTRO.histograma('scada_lectura_segundos',
+                                                   "Duración de cada barrido de lectura")
+        REGISTRO.exponer('scada_muestras_total', "Muestras registradas",
+                         lambda: self.contadores['muestras'], tipo='counter')
+        for resultado in ('fallidas', 'repetidas', 'inconsistentes', 'sin_cambios'):
+            REGISTRO.exponer('scada_lecturas_descartadas_total', "Lecturas sin muestra nueva",
+                             lambda clave=f"lecturas_{resultado}": self.contadores[clave],
+                             etiquetas={'motivo': resultado}, tipo='counter')
+        REGISTRO.exponer('scada_ciclos_atrasados_total', "Ciclos de adquisición fuera de plazo",
+                         lambda: self.contadores['ciclos_atrasados'], tipo='counter')
+        REGISTRO.exponer('scada_retraso_maximo_segundos', "Mayor retraso de adquisición observado",
+                         lambda: self.contadores['retraso_maximo'])
+        REGISTRO.exponer('scada_alarmas_activas', "Alarmas activas",
+                         lambda: int(self.alarmas.activa.sum()))
+
+
+        # Historiador en disco: rellena las tendencias al arrancar y guarda cada muestra
+        self.historiador = None
+        if historiador:
+            from Historiador import Historiador
+            columnas = [etiqueta.nombre for etiqueta in self.etiquetas]
+            self.rellenar_desde_historico(historiador, columnas)
+            self.historiador = Historiador(historiador, columnas)
+            self.salidas.append(self.historiador)
+
+
+    def leer_datos(self):
+        inicio = time.perf_counter()
+        try:
+            # Un solo barrido por bloques: todas las etiquetas del mismo instante
+            valores = self.sesion.ejecutar(lambda cliente: self.planificador.leer(cliente, unidad=self.unidad))
+            if self.planificador.es_repetida(valores):
+                self.contadores['lecturas_repetidas'] += 1
+                return None
+
+
+            self.contador_lecturas += 1
+            marca_tiempo = time.time()
+            self.alarmas.evaluar(valores, marca_tiempo)
+            vector = np.fromiter(map(valores.__getitem__, self.columnas), float, len(self.columnas))
+            if not self.detector.hay_cambios(vector, marca_tiempo):
+                self.contadores['lecturas_sin_cambios'] += 1
+                return None
+
+
+            return valores
+        except LecturaInconsistente as e:
+            logging.debug("Lectura descartada: %s", e)
+            self.contadores['lecturas_inconsistentes'] += 1
+            return None
+        except ConnectionError as e:
+            # La sesión ya registró el corte; no se repite el error en cada ciclo
+            logging.debug("Lectura omitida: %s", e)
+            self.contadores['lecturas_fallidas'] += 1
+            return None
+        except Exception as e:
+            logging.error("Error en lectura: %s", e)
+            self.contadores['lecturas_fallidas'] += 1
+            return None
+        finally:
+            self.metrica_lectura.observar(time.perf_counter() - inicio)
+
+
+    def registrar_muestra(self, valores, marca_tiempo):
+        # Punto de entrada común para leer_datos y para MotorAdquisicion
+        with self.bloqueo:
+            self.historial.agregar(marca_tiempo, valores)
+            self.version_datos += 1
+            self.contadores['muestras'] += 1
+
+
+        for salida in self.salidas:
+            salida.escribir(marca_tiempo, valores)
+
+
+    def muestra_motor(self, dispositivo, valores, marca_tiempo):
+        # Adaptador del destino de MotorAdquisicion (dispositivo, valores, marca_tiempo): el
+        # mismo filtrado que leer_datos antes de registrar la muestra
+        self.contador_lecturas += 1
+        self.alarmas.evaluar(valores, marca_tiempo)
+        vector = np.fromiter(map(valores.__getitem__, self.columnas), float, len(self.columnas))
+        if not self.detector.hay_cambios(vector, marca_tiempo):
+            self.contadores['lecturas_sin_cambios'] += 1
+            return
+        self.registrar_muestra(valores, marca_tiempo)
+
+
+    def bucle_motor(self):
+        import asyncio
+        dispositivo = Dispositivo(f"{self.host}:{self.port}/{self.unidad}", self.host, self.port,
+                                  self.unidad, self.etiquetas, self.periodo_muestreo)
+        motor = MotorAdquisicion([dispositivo], self.muestra_motor, timeout=self.timeout,
+                                 registro_tick=self.planificador.registro_tick, contadores=self.contadores)
+
+
+        async def ejecutar():
+            # detener es un threading.Event: se consulta sin bloquear el bucle
+            tarea = asyncio.ensure_future(motor.ejecutar())
+            while not self.detener.is_set() and not tarea.done():
+                await asyncio.sleep(0.1)
+            tarea.cancel()
+            await asyncio.gather(tarea, return_exceptions=True)
+
+
+        asyncio.run(ejecutar())
+
+
+    def bucle_gateway(self):
+        for marca_tiempo, valores in self.gateway.muestras(self.detener):
+            valores = {columna: valores.get(columna, np.nan) for columna in self.columnas}
+            self.contador_lecturas += 1
+            self.alarmas.evaluar(valores, marca_tiempo)
+            self.registrar_muestra(valores, marca_tiempo)
+
+
+    def bucle_adquisicion(self):
+        if self.gateway is not None:
+            self.bucle_gateway()
+            return
+        if self.asincrono:
+            self.bucle_motor()
+            return
+
+
+        # Muestreo con plazos fijos: el render nunca retrasa la siguiente lectura
+        siguiente = time.monotonic()
+        while not self.detener.is_set():
+            valores = self.leer_datos()
+            if valores is not None:
+                self.registrar_muestra(valores, time.time())
+
+
+            retraso = time.monotonic() - siguiente
+            self.contadores['retraso_adquisicion'] = retraso
+            self.contadores['retraso_maximo'] = max(self.contadores['retraso_maximo'], retraso)
+
+
+            siguiente += self.periodo_muestreo
+            espera = siguiente - time.monotonic()
+            if espera < 0:
+                self.contadores['ciclos_atrasados'] += 1
+                siguiente = time.monotonic()
+                espera = 0
+            self.detener.wait(espera)
+
+
+
+    def rellenar_desde_historico(self, directorio, columnas):
+        if not os.path.isdir(directorio):
+            return
+
+
+        from Historiador import LectorHistorico
+        lector = LectorHistorico(directorio)
+        ahora = time.time()
+        datos = lector.leer(ahora - self.capacidad_historial * self.periodo_muestreo, ahora, columnas)
+        self.historial.extender(datos['t'], datos)
+        lector.cerrar()
+        logging.info("Historial recuperado: %d muestras de %s", len(datos['t']), directorio)
+
+
+    def cerrar(self):
+        for salida in self.salidas:
+            salida.cerrar()
+        if self.captura is not None:
+            self.captura.cerrar()
+        self.sesion.liberar()
+
+
+    def conectar(self):
+        # Sin servidor no se aborta: el bucle sigue y la sesión reintenta con backoff
+        if self.gateway is not None:
+            logging.info("Muestras del gateway %s", self.gateway.especificacion)
+            return
+        if self.asincrono:
+            # El cliente asyncio se conecta (y reconecta con backoff) dentro del motor
+            logging.info("Sondeo asíncrono de %s:%d", self.host, self.port)
+            return
+        if self.sesion.conectar():
+            logging.info("Conexión establecida con el servidor Modbus")
+        else:
+            logging.error("Error de conexión con el servidor Modbus; se reintentará en segundo plano")
+
+
+    def iniciar(self):
+        self.conectar()
+        try:
+            self.bucle_adquisicion()
+        except KeyboardInterrupt:
+            logging.info("Finalizando monitoreo...")
+        finally:
+            logging.info("Contadores: %s", self.contadores)
+            self.cerrar()
+
+
+class Dispositivo:
+    def __init__(self, nombre, host='localhost', port=502, unidad=1, etiquetas=None, periodo=1.0):
+        self.nombre = nombre
+        self.host = host
+        self.port = port
+        self.unidad = unidad
+        self.etiquetas = etiquetas if etiquetas is not None else ETIQUETAS
+        self.periodo = periodo
+
+
+    @classmethod
+    def desde_texto(cls, texto, **kwargs):
+        # Formato: nombre=host:puerto/unidad (puerto y unidad opcionales)
+        nombre, _, destino = texto.rpartition('=')
+        destino, _, unidad = destino.partition('/')
+        host, _, port = destino.partition(':')
+        return cls(nombre or texto, host, int(port or 502), int(unidad or 1), **kwargs)
+
+
+# Como ClienteModbusAsync, el motor importa asyncio en sus métodos: el sondeo síncrono
+# y el panel no lo cargan al arrancar
+class MotorAdquisicion:
+    def __init__(self, dispositivos, destino=None, timeout=1.0, max_en_vuelo=1,
+                 tolerancia_hueco=TOLERANCIA_HUECO, registro_tick=REGISTRO_TICK, contadores=None):
+        self.dispositivos = dispositivos
+        self.destino = destino or self.registrar
+        self.timeout = timeout
+        self.max_en_vuelo = max_en_vuelo
+        self.tolerancia_hueco = tolerancia_hueco
+        self.registro_tick = registro_tick
+
+
+        # Retraso de cada ciclo respecto a su plazo; MonitorModbus pasa sus propios contadores
+        # para que las métricas de adquisición sean las mismas en los dos modos de sondeo
+        if contadores is None:
+            contadores = {'ciclos_atrasados': 0, 'retraso_adquisicion': 0.0, 'retraso_maximo': 0.0}
+            REGISTRO.exponer('scada_ciclos_atrasados_total', "Ciclos de adquisición fuera de plazo",
+                             lambda: contadores['ciclos_atrasados'], tipo='counter')
+            REGISTRO.exponer('scada_retraso_maximo_segundos', "Mayor retraso de adquisición observado",
+                             lambda: contadores['retraso_maximo'])
+        self.contadores = contadores
+
+
+        # Una sesión por equipo (host, puerto), compartida entre sus unidades
+        self.clientes = {}
+        self.fallos = {dispositivo.nombre: 0 for dispositivo in dispositivos}
+
+
+    def registrar(self, dispositivo, valores, marca_tiempo):
+        logging.info("%s - %s", dispositivo.nombre,
+                     ", ".join(f"{nombre}: {valor:.2f}" for nombre, valor in valores.items()))
+
+
+    def cliente_para(self, dispositivo):
+        clave = (dispositivo.host, dispositivo.port)
+        if clave not in self.clientes:
+            self.clientes[clave] = ClienteModbusAsync(dispositivo.host, dispositivo.port,
+                                                      self.timeout, self.max_en_vuelo)
+        return self.clientes[clave]
+
+
+    async def escanear(self, dispositivo, planificador, cliente):
+        import asyncio
+        def leer(bloque):
+            return cliente.leer_registros(dispositivo.unidad, bloque.inicio, bloque.cantidad)
+
+
+        # Con tick, el bloque que lo contiene se lee antes que el resto en paralelo
+        bloques = planificador.bloques
+        if planificador.registro_tick is None:
+            respuestas = await asyncio.gather(*(leer(bloque) for bloque in bloques))
+        else:
+            respuestas = [await leer(bloques[0])]
+            respuestas += await asyncio.gather(*(leer(bloque) for bloque in bloques[1:]))
+
+
+        valores = {}
+        for bloque, registros in zip(bloques, respuestas):
+            valores.update(bloque.decodificar(registros))
+
+
+        if planificador.registro_tick is not None:
+            tick_final = None
+            if len(bloques) > 1:
+                tick_final = (await cliente.leer_registros(dispositivo.unidad,
+                                                           planificador.registro_tick, 1))[0]
+            planificador.comprobar_tick(valores, tick_final)
+        return valores
+
+
+    async def sondear(self, dispositivo):
+        import asyncio
+        planificador = PlanificadorLecturas(dispositivo.etiquetas, self.tolerancia_hueco,
+                                            registro_tick=self.registro_tick)
+        cliente = self.cliente_para(dispositivo)
+        loop = asyncio.get_running_loop()
+        siguiente = loop.time()
+        etiquetas = {'dispositivo': dispositivo.nombre}
+        metrica_escaneo = REGISTRO.histograma('scada_escaneo_segundos',
+                                              "Duración de cada barrido por equipo", etiquetas)
+        metrica_fallos = REGISTRO.contador('scada_escaneos_fallidos_total',
+                                           "Barridos fallidos por equipo", etiquetas)
+
+
+        while True:
+            inicio = time.perf_counter()
+            try:
+                valores = await self.escanear(dispositivo, planificador, cliente)
+                metrica_escaneo.observar(time.perf_counter() - inicio)
+                if not planificador.es_repetida(valores):
+                    self.destino(dispositivo, valores, time.time())
+                if self.fallos[dispositivo.nombre]:
+                    logging.info("Lectura de %s restablecida", dispositivo.nombre)
+                self.fallos[dispositivo.nombre] = 0
+            except asyncio.CancelledError:
+                raise
+            except LecturaInconsistente as e:
+                logging.debug("Lectura de %s descartada: %s", dispositivo.nombre, e)
+            except Exception as e:
+                # Un equipo caído solo afecta a su propia tarea
+                metrica_fallos.incrementar()
+                self.fallos[dispositivo.nombre] += 1
+                if self.fallos[dispositivo.nombre] == 1:
+                    logging.error("Error en lectura de %s: %r", dispositivo.nombre, e)
+
+
+            retraso = loop.time() - siguiente
+            self.contadores['retraso_adquisicion'] = retraso
+            self.contadores['retraso_maximo'] = max(self.contadores['retraso_maximo'], retraso)
+
+
+            siguiente += dispositivo.periodo
+            espera = siguiente - loop.time()
+            if espera < 0:
+                self.contadores['ciclos_atrasados'] += 1
+                siguiente = loop.time()
+                espera = 0
+            await asyncio.sleep(espera)
+
+
+    async def ejecutar(self):
+        import asyncio
+        try:
+            await asyncio.gather(*(self.sondear(dispositivo) for dispositivo in self.dispositivos))
+        finally:
+            for cliente in self.clientes.values():
+                await cliente.cerrar()
+
+
+    def iniciar(self):
+        import asyncio
+        try:
+            asyncio.run(self.ejecutar())
+        except KeyboardInterrupt:
+            logging.info("Finalizando adquisición...")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Adquisición Modbus TCP sin interfaz gráfica")
+    parser.add_argument('--host', default='localhost', help="servidor Modbus (modo de un equipo)")
+    parser.add_argument('--port', type=int, default=502, help="puerto Modbus (modo de un equipo)")
+    parser.add_argument('--unidad', type=int, default=1, help="unidad Modbus (modo de un equipo)")
+    parser.add_argument('--dispositivo', action='append', default=[],
+                        help="nombre=host:puerto/unidad; activa el motor asyncio (se puede repetir)")
+    parser.add_argument('--etiquetas', help="archivo JSON con el mapa de etiquetas")
+    parser.add_argument('--salida', action='append', default=[],
+                        help="jsonl[:archivo], csv:archivo o unix:/ruta/socket (se puede repetir)")
+    parser.add_argument('--historiador', help="directorio del historiador en disco")
+    parser.add_argument('--alarmas', help="archivo JSON con las reglas de alarma")
+    parser.add_argument('--max-silencio', type=float, default=MAX_SILENCIO,
+                        help="segundos máximos sin registrar una muestra dentro de la banda muerta "
+                             "(0 = registrar todas)")
+    parser.add_argument('--captura', help="archivo donde grabar los registros recibidos (modo de un equipo)")
+    parser.add_argument('--asincrono', action='store_true',
+                        help="sondear el equipo con el motor asyncio (modo de un equipo)")
+    parser.add_argument('--capacidad-historial', type=int, default=CAPACIDAD_HISTORIAL,
+                        help="muestras del historial de tendencias en memoria (modo de un equipo)")
+    parser.add_argument('--periodo', type=float, default=1.0, help="periodo de sondeo en segundos")
+    parser.add_argument('--timeout', type=float, default=1.0, help="timeout por petición en segundos")
+    parser.add_argument('--max-en-vuelo', type=int, default=1,
+                        help="peticiones simultáneas por equipo")
+    parser.add_argument('--registro-tick', type=int, default=REGISTRO_TICK,
+                        help="registro con el contador de ticks del servidor")
+    parser.add_argument('--sin-tick', action='store_true',
+                        help="no leer el tick (servidores que no lo publican)")
+    agregar_argumentos(parser)
+    args = parser.parse_args(argv)
+    if args.capacidad_historial < 1:
+        parser.error("--capacidad-historial debe ser positiva")
+
+
+    # Las combinaciones inválidas se rechazan antes de abrir salidas, capturas o métricas
+    if args.captura and args.dispositivo:
+        parser.error("--captura solo está disponible en el modo de un equipo")
+    if args.asincrono and args.captura:
+        parser.error("--asincrono no se combina con --captura")
+    iniciar_exportacion(args)
+
+
+    etiquetas = cargar_etiquetas(args.etiquetas) if args.etiquetas else ETIQUETAS
+    salidas = [crear_salida(especificacion) for especificacion in args.salida]
+    registro_tick = None if args.sin_tick else args.registro_tick
+    reglas = cargar_reglas(args.alarmas) if args.alarmas else REGLAS
+
+
+    if not args.dispositivo:
+        captura = None
+        if args.captura:
+            from Captura import EscritorCaptura
+            captura = EscritorCaptura(args.captura)
+        monitor = MonitorModbus(args.host, args.port, args.unidad, etiquetas, salidas,
+                                historiador=args.historiador, registro_tick=registro_tick,
+                                timeout=args.timeout, reglas=reglas, max_silencio=args.max_silencio,
+                                captura=captura, asincrono=args.asincrono,
+                                capacidad_historial=args.capacidad_historial)
+        monitor.periodo_muestreo = args.periodo
+        monitor.iniciar()
+        return
+
+
+    dispositivos = [Dispositivo.desde_texto(texto, etiquetas=etiquetas, periodo=args.periodo)
+                    for texto in args.dispositivo]
+
+
+    # Un directorio del historiador por equipo
+    historiadores = {}
+    if args.historiador:
+        from Historiador import Historiador
+        historiadores = {dispositivo.nombre: Historiador(
+                             os.path.join(args.historiador, dispositivo.nombre),
+                             [etiqueta.nombre for etiqueta in dispositivo.etiquetas])
+                         for dispositivo in dispositivos}
+
+
+    # Un motor de alarmas y un detector de cambios por equipo
+    alarmas = {dispositivo.nombre: MotorAlarmas(reglas, [etiqueta.nombre for etiqueta in dispositivo.etiquetas],
+                                                origen=dispositivo.nombre)
+               for dispositivo in dispositivos}
+    detectores = {dispositivo.nombre: DetectorCambios([etiqueta.banda_muerta for etiqueta in dispositivo.etiquetas],
+                                                      args.max_silencio)
+                  for dispositivo in dispositivos}
+
+
+    def destino(dispositivo, valores, marca_tiempo):
+        alarmas[dispositivo.nombre].evaluar(valores, marca_tiempo)
+        vector = np.fromiter((valores[etiqueta.nombre] for etiqueta in dispositivo.etiquetas), float,
+                             len(dispositivo.etiquetas))
+        if not detectores[dispositivo.nombre].hay_cambios(vector, marca_tiempo):
+            return
+        for salida in salidas:
+            salida.escribir(marca_tiempo, {'dispositivo': dispositivo.nombre, **valores})
+        if historiadores:
+            historiadores[dispositivo.nombre].escribir(marca_tiempo, valores)
+        if not salidas and not historiadores:
+            motor.registrar(dispositivo, valores, marca_tiempo)
+
+
+    motor = MotorAdquisicion(dispositivos, destino,
+                             timeout=args.timeout, max_en_vuelo=args.max_en_vuelo,
+                             registro_tick=registro_tick)
+    try:
+        motor.iniciar()
+    finally:
+        for salida in salidas + list(historiadores.values()):
+            salida.cerrar()
+
+
+if __name__ == "__main__":
+    configurar_registro()
+    main()
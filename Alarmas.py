@@ -0,0 +1,272 @@
+import fnmatch
+import json
+import logging
+import threading
+from datetime import datetime
+
+
+import numpy as np
+
+
+# Eventos del diario
+ACTIVADA = 1
+NORMALIZADA = 2
+RECONOCIDA = 3
+NOMBRES_EVENTO = {ACTIVADA: 'activa', NORMALIZADA: 'normalizada', RECONOCIDA: 'reconocida'}
+
+
+class ReglaAlarma:
+    def __init__(self, etiqueta, tipo='alto', limite=0.0, histeresis=0.0, retardo_activacion=0.0,
+                 retardo_normalizacion=0.0, mensaje=None, unidad=''):
+        if tipo not in ('alto', 'bajo'):
+            raise ValueError(f"Tipo de alarma desconocido: {tipo}")
+        self.etiqueta = etiqueta
+        self.tipo = tipo
+        self.limite = limite
+        self.histeresis = histeresis
+        self.retardo_activacion = retardo_activacion
+        self.retardo_normalizacion = retardo_normalizacion
+        self.mensaje_propio = mensaje
+        self.mensaje = mensaje or f"{etiqueta} {'alta' if tipo == 'alto' else 'baja'}"
+        self.unidad = unidad
+
+
+    def __repr__(self):
+        signo = '>' if self.tipo == 'alto' else '<'
+        return f"ReglaAlarma({self.etiqueta} {signo} {self.limite})"
+
+
+# Reglas del proceso simulado por Server.py
+REGLAS = [
+    ReglaAlarma('temperatura', 'alto', 90.0, histeresis=2.0, mensaje="¡Temperatura crítica!", unidad='°C'),
+    ReglaAlarma('presion', 'alto', 8.0, histeresis=0.2, mensaje="¡Presión elevada!", unidad=' bar'),
+    ReglaAlarma('nivel', 'bajo', 10.0, histeresis=2.0, mensaje="¡Nivel bajo!", unidad='%'),
+]
+
+
+def cargar_reglas(ruta):
+    # Formato: [{"etiqueta": "temperatura", "tipo": "alto", "limite": 90, "histeresis": 2,
+    #            "retardo_activacion": 5, "retardo_normalizacion": 10, "mensaje": "...", "unidad": "°C"}]
+    # La etiqueta admite comodines (p. ej. "vibracion_*") para una regla por cada etiqueta que coincida
+    with open(ruta, encoding='utf-8') as archivo:
+        return [ReglaAlarma(**entrada) for entrada in json.load(archivo)]
+
+
+class DiarioAlarmas:
+    # Registro circular acotado de eventos de alarma, con índice del último evento por regla
+    def __init__(self, reglas, capacidad=10000):
+        self.capacidad = capacidad
+        self.eventos = np.zeros(capacidad, dtype=[('t', 'f8'), ('regla', 'i4'), ('evento', 'i1'),
+                                                  ('valor', 'f8')])
+        self.total = 0
+        self.ultimo_evento = np.full(reglas, -1, dtype=np.int64)
+
+
+    def __len__(self):
+        return min(self.total, self.capacidad)
+
+
+    def agregar(self, marca_tiempo, reglas, evento, valores):
+        cantidad = len(reglas)
+        if cantidad == 0:
+            return
+        if cantidad > self.capacidad:
+            reglas, valores = reglas[-self.capacidad:], valores[-self.capacidad:]
+            self.total += cantidad - self.capacidad
+            cantidad = self.capacidad
+
+
+        numeros = self.total + np.arange(cantidad)
+        posiciones = numeros % self.capacidad
+        self.eventos['t'][posiciones] = marca_tiempo
+        self.eventos['regla'][posiciones] = reglas
+        self.eventos['evento'][posiciones] = evento
+        self.eventos['valor'][posiciones] = valores
+        self.ultimo_evento[reglas] = numeros
+        self.total += cantidad
+
+
+    def recientes(self, cantidad):
+        # Copia de los últimos eventos, del más nuevo al más antiguo
+        cantidad = min(cantidad, len(self))
+        numeros = np.arange(self.total - 1, self.total - 1 - cantidad, -1)
+        return self.eventos[numeros % self.capacidad]
+
+
+    def de_regla(self, regla):
+        # Eventos de una regla todavía en el diario, del más antiguo al más nuevo
+        numeros = np.arange(self.total - len(self), self.total)
+        eventos = self.eventos[numeros % self.capacidad]
+        return eventos[eventos['regla'] == regla]
+
+
+    def ultimo(self, regla):
+        numero = self.ultimo_evento[regla]
+        if numero < max(self.total - self.capacidad, 0):
+            return None
+        return self.eventos[numero % self.capacidad]
+
+
+class MotorAlarmas:
+    # Todas las reglas se evalúan a la vez con NumPy: cada campo de regla y de estado es un
+    # vector con una posición por regla. Solo las transiciones pasan al diario, así una
+    # excursión larga genera un evento al activarse y otro al normalizarse
+    def __init__(self, reglas, etiquetas, capacidad_diario=10000, origen=None):
+        self.origen = f"{origen}: " if origen else ''
+        etiquetas = list(etiquetas)
+        self.reglas = []
+        for regla in reglas:
+            coincidencias = fnmatch.filter(etiquetas, regla.etiqueta)
+            if not coincidencias:
+                logging.warning("%sRegla sin etiqueta: %r", self.origen, regla)
+            for nombre in coincidencias:
+                self.reglas.append(regla if nombre == regla.etiqueta else ReglaAlarma(
+                    nombre, regla.tipo, regla.limite, regla.histeresis, regla.retardo_activacion,
+                    regla.retardo_normalizacion,
+                    f"{regla.mensaje_propio} [{nombre}]" if regla.mensaje_propio else None, regla.unidad))
+
+
+        # Solo se leen las etiquetas que tienen alguna regla
+        self.etiquetas = list(dict.fromkeys(regla.etiqueta for regla in self.reglas))
+        posicion = {nombre: i for i, nombre in enumerate(self.etiquetas)}
+        self.columna = np.array([posicion[regla.etiqueta] for regla in self.reglas], dtype=np.int64)
+        if np.array_equal(self.columna, np.arange(len(self.etiquetas))):
+            self.columna = None
+
+
+        # Con el signo, "alto" y "bajo" se evalúan igual: alarma si signo * valor > signo * límite
+        self.signo = np.array([1.0 if regla.tipo == 'alto' else -1.0 for regla in self.reglas])
+        self.limite = self.signo * [regla.limite for regla in self.reglas]
+        self.retorno = self.limite - [regla.histeresis for regla in self.reglas]
+        self.retardo_activacion = np.array([regla.retardo_activacion for regla in self.reglas])
+        self.retardo_normalizacion = np.array([regla.retardo_normalizacion for regla in self.reglas])
+
+
+        # Estado por regla
+        cantidad = len(self.reglas)
+        self.condicion = np.zeros(cantidad, dtype=bool)
+        self.activa = np.zeros(cantidad, dtype=bool)
+        self.reconocida = np.ones(cantidad, dtype=bool)
+        self.pendiente_desde = np.full(cantidad, np.nan)
+        self.activa_desde = np.full(cantidad, np.nan)
+        self.valor = np.full(cantidad, np.nan)
+
+
+        self.diario = DiarioAlarmas(cantidad, capacidad_diario)
+        self.version = 0
+        self.bloqueo = threading.Lock()
+
+
+    def __len__(self):
+        return len(self.reglas)
+
+
+    def evaluar(self, valores, marca_tiempo):
+        # valores: diccionario etiqueta -> valor de una muestra completa
+        if not self.reglas:
+            return
+        self.evaluar_vector(np.fromiter(map(valores.__getitem__, self.etiquetas), float,
+                                        len(self.etiquetas)), marca_tiempo)
+
+
+    def evaluar_vector(self, valores, marca_tiempo):
+        # valores: un valor por etiqueta, en el orden de self.etiquetas
+        with self.bloqueo:
+            valor = valores if self.columna is None else valores[self.columna]
+            medido = self.signo * valor
+            np.copyto(self.valor, valor, where=~np.isnan(valor))
+
+
+            # Histéresis: se entra por encima del límite y se sale por debajo del retorno.
+            # Con un valor ausente (NaN) ambas comparaciones son falsas y la condición se conserva
+            condicion = (self.condicion | (medido > self.limite)) & ~(medido < self.retorno)
+            self.condicion = condicion
+
+
+            # Retardos: la condición tiene que sostenerse antes de cambiar el estado
+            pendiente = condicion != self.activa
+            if not pendiente.any():
+                self.pendiente_desde.fill(np.nan)
+                return
+            self.pendiente_desde = np.where(pendiente, np.fmin(self.pendiente_desde, marca_tiempo), np.nan)
+            retardo = np.where(condicion, self.retardo_activacion, self.retardo_normalizacion)
+            cambian = np.flatnonzero(marca_tiempo - self.pendiente_desde >= retardo)
+            if not len(cambian):
+                return
+
+
+            activadas = cambian[condicion[cambian]]
+            normalizadas = cambian[~condicion[cambian]]
+            self.activa[cambian] = condicion[cambian]
+            self.pendiente_desde[cambian] = np.nan
+            self.reconocida[activadas] = False
+            self.activa_desde[activadas] = marca_tiempo
+            self.diario.agregar(marca_tiempo, activadas, ACTIVADA, valor[activadas])
+            self.diario.agregar(marca_tiempo, normalizadas, NORMALIZADA, valor[normalizadas])
+            self.version += 1
+
+
+        for i in activadas[:10]:
+            logging.warning("Alarma: %s%s (%.1f%s)", self.origen, self.reglas[i].mensaje, valor[i], self.reglas[i].unidad)
+        if len(activadas) > 10:
+            logging.warning("%s%d alarmas más activadas en el mismo barrido", self.origen, len(activadas) - 10)
+
+
+    def reconocer(self, regla=None, marca_tiempo=None):
+        # Sin regla se reconocen todas las alarmas pendientes de reconocimiento
+        with self.bloqueo:
+            seleccion = ~self.reconocida
+            if regla is not None:
+                seleccion &= np.arange(len(self.reglas)) == regla
+            reglas = np.flatnonzero(seleccion)
+            if not len(reglas):
+                return 0
+
+
+            self.reconocida[reglas] = True
+            self.diario.agregar(marca_tiempo or datetime.now().timestamp(), reglas, RECONOCIDA,
+                                self.valor[reglas])
+            self.version += 1
+            return len(reglas)
+
+
+    def activas(self):
+        # Índices de las alarmas activas, la más reciente primero
+        with self.bloqueo:
+            return self.ordenar(np.flatnonzero(self.activa))
+
+
+    def visibles(self):
+        # Las activas y las normalizadas que nadie reconoció: una excursión que terminó antes
+        # de que el operador mirara el panel sigue a la vista hasta reconocerla
+        with self.bloqueo:
+            return self.ordenar(np.flatnonzero(self.activa | ~self.reconocida))
+
+
+    def ordenar(self, indices):
+        return indices[np.argsort(-self.activa_desde[indices], kind='stable')]
+
+
+    def estado(self, regla):
+        # activa y reconocida mientras dura la condición; normalizada si terminó sin reconocerse
+        if self.activa[regla]:
+            return 'reconocida' if self.reconocida[regla] else 'activa'
+        return 'normal' if self.reconocida[regla] else 'normalizada'
+
+
+    def formatear(self, regla, marca_tiempo, valor):
+        hora = datetime.fromtimestamp(marca_tiempo).strftime('%H:%M:%S')
+        return f"{hora} - {self.reglas[regla].mensaje} ({valor:.1f}{self.reglas[regla].unidad})"
+
+
+    def lineas(self, cantidad=3):
+        # Texto de las alarmas visibles más recientes para el panel; se formatea solo al mostrarlas.
+        # ● activa sin reconocer, ○ normalizada sin reconocer
+        lineas = []
+        for regla in self.visibles()[:cantidad]:
+            linea = self.formatear(regla, self.activa_desde[regla], self.valor[regla])
+            if not self.activa[regla]:
+                lineas.append(f"○ {linea} - normalizada")
+            else:
+                lineas.append(linea if self.reconocida[regla] else f"● {linea}")
+        return lineas
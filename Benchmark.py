@@ -0,0 +1,369 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+
+import numpy as np
+
+
+from Protocolo import ClienteModbusAsync, pdu_lectura
+
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+def parsear_mezcla(texto):
+    # Formato: funcion:direccion:cantidad=peso, separados por comas (p. ej. 3:0:4=9,3:100:125=1)
+    mezcla = []
+    for parte in texto.split(','):
+        peticion, _, peso = parte.partition('=')
+        funcion, direccion, cantidad = (int(valor) for valor in peticion.split(':'))
+        mezcla.append((funcion, direccion, cantidad, float(peso or 1)))
+    return mezcla
+
+
+def resumir(latencias, duracion):
+    # Latencias en segundos -> resumen en milisegundos
+    if not len(latencias):
+        return {'cantidad': 0, 'por_segundo': 0.0}
+
+
+    p50, p95, p99 = np.percentile(latencias, [50, 95, 99]) * 1000
+    return {
+        'cantidad': int(len(latencias)),
+        'por_segundo': round(len(latencias) / duracion, 1),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'max_ms': round(float(latencias.max()) * 1000, 3),
+    }
+
+
+def version_git():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=DIRECTORIO,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def esperar_puerto(host, port, timeout=10.0):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"El servidor no respondió en {host}:{port}")
+
+
+@contextmanager
+def servidor_local(port, modo, periodo, simulador=None, semilla=0, procesos=1, unidades=1, captura=None,
+                   velocidad='max'):
+    # Server.py en un proceso aparte, para que el generador de carga no le quite CPU.
+    # Con una captura se reproduce en bucle un registro real en lugar del simulador
+    if captura:
+        comando = [sys.executable, os.path.join(DIRECTORIO, 'Captura.py'), 'reproducir', captura,
+                   '--port', str(port), '--velocidad', str(velocidad), '--bucle']
+    else:
+        comando = [sys.executable, os.path.join(DIRECTORIO, 'Server.py'), '--port', str(port),
+                   '--modo', modo, '--periodo', str(periodo), '--semilla', str(semilla),
+                   '--procesos', str(procesos), '--unidades', str(unidades)]
+        if simulador:
+            comando += ['--simulador', simulador]
+
+
+    proceso = subprocess.Popen(comando, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        esperar_puerto('localhost', port)
+        yield proceso
+    finally:
+        proceso.terminate()
+        proceso.wait(timeout=5)
+
+
+async def cliente_carga(host, port, unidad, mezcla, pesos, fin, rng, latencias, errores):
+    # Bucle cerrado: cada cliente envía la siguiente petición al recibir la anterior
+    cliente = ClienteModbusAsync(host, port, timeout=5.0)
+    pdus = [pdu_lectura(funcion, direccion, cantidad) for funcion, direccion, cantidad, _ in mezcla]
+    try:
+        while time.monotonic() < fin:
+            pdu = pdus[rng.choice(len(pdus), p=pesos)]
+            inicio = time.perf_counter()
+            try:
+                respuesta = await cliente.ejecutar(unidad, pdu)
+            except (asyncio.TimeoutError, ConnectionError, OSError):
+                errores[0] += 1
+                continue
+            latencias.append(time.perf_counter() - inicio)
+            if respuesta[0] & 0x80:
+                errores[0] += 1
+    finally:
+        await cliente.cerrar()
+
+
+async def generar_carga(host, port, unidad, clientes, mezcla, duracion, semilla):
+    pesos = np.array([peso for *_, peso in mezcla])
+    pesos = pesos / pesos.sum()
+    rng = np.random.default_rng(semilla)
+    latencias = []
+    errores = [0]
+
+
+    fin = time.monotonic() + duracion
+    await asyncio.gather(*(cliente_carga(host, port, unidad, mezcla, pesos, fin, rng, latencias, errores)
+                           for _ in range(clientes)))
+    return np.array(latencias), errores[0]
+
+
+def proceso_carga(argumentos):
+    # Un bucle asyncio por proceso: el generador no debe ser el cuello de botella
+    return asyncio.run(generar_carga(*argumentos))
+
+
+def benchmark_servidor(args):
+    mezcla = parsear_mezcla(args.mezcla)
+    procesos = max(1, min(args.procesos, args.clientes))
+    reparto = [args.clientes // procesos + (i < args.clientes % procesos) for i in range(procesos)]
+    tareas = [(args.host, args.port, args.unidad, clientes, mezcla, args.duracion, args.semilla + i)
+              for i, clientes in enumerate(reparto)]
+
+
+    inicio = time.perf_counter()
+    with multiprocessing.Pool(procesos) as pool:
+        resultados = pool.map(proceso_carga, tareas)
+    duracion = time.perf_counter() - inicio
+
+
+    latencias = np.concatenate([latencias for latencias, _ in resultados])
+    resultado = resumir(latencias, args.duracion)
+    resultado['errores'] = sum(errores for _, errores in resultados)
+    resultado['duracion_s'] = round(duracion, 2)
+    return resultado
+
+
+def benchmark_cliente(args):
+    # El panel completo con el backend Agg: mide la lectura y el cuadro sin ventana
+    import matplotlib
+    matplotlib.use('Agg')
+    from Cliente import ClienteModbus
+
+
+    cliente = ClienteModbus(args.host, args.port)
+    if not cliente.sesion.conectar():
+        raise ConnectionError(f"No se pudo conectar con {args.host}:{args.port}")
+
+
+    lecturas = []
+    cuadros = []
+    try:
+        for _ in range(args.cuadros):
+            inicio = time.perf_counter()
+            valores = cliente.leer_datos()
+            lecturas.append(time.perf_counter() - inicio)
+            if valores is not None:
+                cliente.registrar_muestra(valores, time.time())
+
+
+            inicio = time.perf_counter()
+            cliente.actualizar_graficos()
+            cuadros.append(time.perf_counter() - inicio)
+            time.sleep(args.pausa)
+    finally:
+        cliente.cerrar()
+
+
+    total = sum(lecturas) + sum(cuadros)
+    return {
+        'leer_datos': resumir(np.array(lecturas), total),
+        'actualizar_graficos': resumir(np.array(cuadros), total),
+        'contadores': cliente.contadores,
+    }
+
+
+def memoria_residente():
+    # RSS actual en MB (Linux); en otros sistemas, el máximo alcanzado si está disponible
+    try:
+        with open('/proc/self/statm') as archivo:
+            return round(int(archivo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20, 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maximo / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def benchmark_resistencia(args):
+    # Prueba de resistencia del panel sin servidor ni reloj de pared: horas de muestras del
+    # simulador pasan por registrar_muestra, las alarmas y actualizar_graficos (Agg) lo más
+    # rápido posible. Por tramo se informa la memoria, el tiempo de cuadro y los artistas de
+    # la figura, que deben mantenerse planos
+    import matplotlib
+    matplotlib.use('Agg')
+    from Cliente import ClienteModbus
+    from Server import SimuladorProceso
+
+
+    simulador = SimuladorProceso(semilla=args.semilla)
+    muestras = int(args.horas * 3600 / args.periodo_muestra)
+    por_tramo = max(1, muestras // args.tramos)
+    inicio = time.time() - muestras * args.periodo_muestra
+
+
+    cliente = ClienteModbus(args.host, args.port)
+    cliente.periodo_muestreo = args.periodo_muestra
+    cliente.tiempo_inicio = datetime.fromtimestamp(inicio)
+    tramos = []
+    cuadros = []
+    redibujados = 0
+    comienzo = time.perf_counter()
+    try:
+        for i in range(muestras):
+            marca_tiempo = inicio + i * args.periodo_muestra
+            registros = simulador.simular_cambios(args.periodo_muestra)
+            valores = dict(zip(simulador.nombres, (registros / simulador.escala).round(2).tolist()))
+            cliente.alarmas.evaluar(valores, marca_tiempo)
+            cliente.registrar_muestra(valores, marca_tiempo)
+
+
+            if i % args.muestras_por_cuadro == 0:
+                antes = time.perf_counter()
+                cliente.actualizar_graficos()
+                cuadros.append(time.perf_counter() - antes)
+
+
+            if (i + 1) % por_tramo == 0 or i + 1 == muestras:
+                cuadro = resumir(np.array(cuadros), 1.0)
+                tramos.append({
+                    'horas_simuladas': round((i + 1) * args.periodo_muestra / 3600, 2),
+                    'rss_mb': memoria_residente(),
+                    'cuadros': cuadro['cantidad'],
+                    'cuadro_p50_ms': cuadro.get('p50_ms'),
+                    'cuadro_p99_ms': cuadro.get('p99_ms'),
+                    'redibujados_completos': cliente.contadores['redibujados_completos'] - redibujados,
+                    'artistas': len(cliente.fig.findobj()),
+                })
+                cuadros = []
+                redibujados = cliente.contadores['redibujados_completos']
+                logging.info("Resistencia: %s", tramos[-1])
+    finally:
+        cliente.cerrar()
+
+
+    # Crecimiento entre el primer tramo (ya con la figura y los buffers calientes) y el último
+    primero, ultimo = tramos[0], tramos[-1]
+    relacion = None
+    if primero['cuadro_p50_ms'] and ultimo['cuadro_p50_ms'] is not None:
+        relacion = round(ultimo['cuadro_p50_ms'] / primero['cuadro_p50_ms'], 2)
+    return {
+        'muestras': muestras,
+        'duracion_s': round(time.perf_counter() - comienzo, 1),
+        'tramos': tramos,
+        'crecimiento_rss_mb': (round(ultimo['rss_mb'] - primero['rss_mb'], 1)
+                               if primero['rss_mb'] is not None else None),
+        'crecimiento_artistas': ultimo['artistas'] - primero['artistas'],
+        'relacion_cuadro_p50': relacion,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de carga y latencia del servidor y el cliente Modbus")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5020)
+    parser.add_argument('--unidad', type=int, default=1)
+    parser.add_argument('--externo', action='store_true',
+                        help="usar un servidor ya en marcha en lugar de iniciar Server.py")
+    parser.add_argument('--modo', choices=['hilos', 'asyncio'], default='asyncio',
+                        help="modo del servidor que se inicia")
+    parser.add_argument('--periodo', type=float, default=0.01,
+                        help="periodo del simulador; corto para que cada lectura del cliente traiga datos nuevos")
+    parser.add_argument('--simulador', help="archivo JSON de etiquetas para el servidor")
+    parser.add_argument('--procesos-servidor', type=int, default=1,
+                        help="procesos trabajadores del servidor (comparten el puerto)")
+    parser.add_argument('--unidades', type=int, default=1, help="unidades simuladas por el servidor")
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--captura', help="reproducir esta captura (Captura.py) en lugar de simular el proceso")
+    parser.add_argument('--velocidad', default='max', help="velocidad de reproducción de --captura")
+    parser.add_argument('--json', help="guardar el resultado en este archivo")
+    sub = parser.add_subparsers(dest='prueba', required=True)
+
+
+    carga = sub.add_parser('servidor', help="N clientes concurrentes contra el servidor")
+    carga.add_argument('--clientes', type=int, default=100)
+    carga.add_argument('--procesos', type=int, default=os.cpu_count() or 1,
+                       help="procesos generadores de carga")
+    carga.add_argument('--duracion', type=float, default=10.0, help="segundos de carga")
+    carga.add_argument('--mezcla', default='3:0:4=1',
+                       help="peticiones funcion:direccion:cantidad=peso separadas por comas")
+
+
+    cliente = sub.add_parser('cliente', help="tiempo de leer_datos y actualizar_graficos (Agg)")
+    cliente.add_argument('--cuadros', type=int, default=200)
+    cliente.add_argument('--pausa', type=float, default=0.0,
+                         help="segundos entre iteraciones (0 = lo más rápido posible)")
+    resistencia = sub.add_parser('resistencia',
+                                 help="horas de muestras simuladas por el panel (Agg): memoria y tiempo de cuadro")
+    resistencia.add_argument('--horas', type=float, default=4.0, help="horas de proceso simuladas")
+    resistencia.add_argument('--periodo-muestra', type=float, default=1.0,
+                             help="segundos simulados entre muestras")
+    resistencia.add_argument('--muestras-por-cuadro', type=int, default=1,
+                             help="muestras registradas por cada cuadro dibujado")
+    resistencia.add_argument('--tramos', type=int, default=12, help="tramos del informe")
+    args = parser.parse_args(argv)
+    if args.prueba == 'resistencia':
+        # Validado antes de simular: un tramo sin cuadros no tendría tiempos que comparar
+        if args.horas <= 0 or args.periodo_muestra <= 0 or args.tramos < 1 or args.muestras_por_cuadro < 1:
+            parser.error("--horas y --periodo-muestra deben ser positivos, --tramos y "
+                         "--muestras-por-cuadro al menos 1")
+        por_tramo = max(1, int(args.horas * 3600 / args.periodo_muestra) // args.tramos)
+        if args.muestras_por_cuadro > por_tramo:
+            parser.error(f"--muestras-por-cuadro ({args.muestras_por_cuadro}) supera las muestras "
+                         f"de cada tramo ({por_tramo})")
+
+
+    if args.externo or args.prueba == 'resistencia':
+        servidor = nullcontext()
+    else:
+        args.host = 'localhost'
+        servidor = servidor_local(args.port, args.modo, args.periodo, args.simulador, args.semilla,
+                                  args.procesos_servidor, args.unidades, args.captura, args.velocidad)
+
+
+    with servidor:
+        if args.prueba == 'servidor':
+            resultado = benchmark_servidor(args)
+        elif args.prueba == 'resistencia':
+            resultado = benchmark_resistencia(args)
+        else:
+            resultado = benchmark_cliente(args)
+
+
+    informe = {
+        'prueba': args.prueba,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': version_git(),
+        'parametros': {clave: valor for clave, valor in vars(args).items() if clave != 'json'},
+        'resultado': resultado,
+    }
+    print(json.dumps(informe, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as archivo:
+            json.dump(informe, archivo, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] - %(message)s')
+    main()
@@ -0,0 +1,147 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+
+
+import numpy as np
+
+
+from Metricas import REGISTRO
+
+
+class ManejadorCola(logging.handlers.QueueHandler):
+    # Solo encola el registro: el mensaje se formatea en el hilo escritor, no en el que lo emite.
+    # Quien registre datos mutables (arrays) debe pasar una copia como argumento
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+
+
+    def prepare(self, record):
+        return record
+
+
+    def enqueue(self, record):
+        # Con la cola llena el registro se descarta sin bloquear, pero queda contado
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+def configurar_registro(nivel=logging.INFO, formato='%(asctime)s [%(levelname)s] - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S', capacidad=10000):
+    # El hilo que llama a logging solo encola; la escritura a la terminal o al disco la hace
+    # un hilo de fondo. Con la cola llena se descartan registros en lugar de bloquear
+    cola = queue.Queue(capacidad)
+    manejador = logging.StreamHandler()
+    manejador.setFormatter(logging.Formatter(formato, datefmt))
+    escritor = logging.handlers.QueueListener(cola, manejador, respect_handler_level=True)
+
+
+    raiz = logging.getLogger()
+    for anterior in list(raiz.handlers):
+        raiz.removeHandler(anterior)
+    encolador = ManejadorCola(cola)
+    raiz.addHandler(encolador)
+    REGISTRO.exponer('log_registros_descartados_total', "Registros de log descartados con la cola llena",
+                     lambda: encolador.descartados, tipo='counter')
+    raiz.setLevel(nivel)
+
+
+    escritor.start()
+    atexit.register(escritor.stop)
+    return escritor
+
+
+class LimitadorLog:
+    # Como mucho un mensaje por clave cada intervalo; los suprimidos se cuentan y se
+    # informan junto con el siguiente mensaje que pase
+    def __init__(self, intervalo=10.0):
+        self.intervalo = intervalo
+        self.ultimo = {}
+        self.suprimidos = {}
+
+
+    def permitir(self, clave):
+        ahora = time.monotonic()
+        if ahora - self.ultimo.get(clave, -self.intervalo) < self.intervalo:
+            self.suprimidos[clave] = self.suprimidos.get(clave, 0) + 1
+            return None
+        self.ultimo[clave] = ahora
+        return self.suprimidos.pop(clave, 0)
+
+
+    def registrar(self, nivel, clave, mensaje, *args):
+        suprimidos = self.permitir(clave)
+        if suprimidos is None:
+            return
+        if suprimidos:
+            mensaje += " (%d repetidos omitidos)"
+            args += (suprimidos,)
+        logging.log(nivel, mensaje, *args)
+
+
+class TextoResumen:
+    # El resumen se arma al formatear el registro, es decir, en el hilo escritor
+    def __init__(self, nombres, unidades, minimos, maximos, medias, ocultas):
+        self.nombres = nombres
+        self.unidades = unidades
+        self.minimos = minimos
+        self.maximos = maximos
+        self.medias = medias
+        self.ocultas = ocultas
+
+
+    def __str__(self):
+        texto = ", ".join(f"{nombre}: {media:.2f} [{minimo:.2f}..{maximo:.2f}] {unidad}".rstrip()
+                          for nombre, unidad, minimo, maximo, media in zip(
+                              self.nombres, self.unidades, self.minimos, self.maximos, self.medias))
+        if self.ocultas:
+            texto += f" (+{self.ocultas} etiquetas)"
+        return texto
+
+
+class ResumenPeriodico:
+    # Mínimo, máximo y media por etiqueta acumulados en arrays; una línea por intervalo
+    # sustituye a una línea por tick
+    def __init__(self, nombres, unidades, intervalo=10.0, mostradas=3):
+        self.nombres = list(nombres)
+        self.unidades = list(unidades)
+        self.intervalo = intervalo
+        self.mostradas = mostradas
+        self.reiniciar()
+
+
+    def reiniciar(self):
+        cantidad = min(len(self.nombres), self.mostradas)
+        self.minimos = np.full(cantidad, np.inf)
+        self.maximos = np.full(cantidad, -np.inf)
+        self.sumas = np.zeros(cantidad)
+        self.muestras = 0
+        self.inicio = time.monotonic()
+
+
+    def agregar(self, valores):
+        valores = valores[:len(self.sumas)]
+        np.minimum(self.minimos, valores, out=self.minimos)
+        np.maximum(self.maximos, valores, out=self.maximos)
+        self.sumas += valores
+        self.muestras += 1
+
+
+    def vencido(self):
+        return time.monotonic() - self.inicio >= self.intervalo
+
+
+    def emitir(self, prefijo):
+        # Sin muestras en el intervalo no se escribe nada
+        if self.muestras and logging.getLogger().isEnabledFor(logging.INFO):
+            cantidad = len(self.sumas)
+            texto = TextoResumen(self.nombres[:cantidad], self.unidades[:cantidad], self.minimos,
+                                 self.maximos, self.sumas / self.muestras, len(self.nombres) - cantidad)
+            logging.info("%s (%d muestras en %.0f s) - %s", prefijo, self.muestras,
+                         time.monotonic() - self.inicio, texto)
+        self.reiniciar()
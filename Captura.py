@@ -0,0 +1,334 @@
+import argparse
+import logging
+import mmap
+import struct
+import threading
+import time
+from datetime import datetime
+
+
+import numpy as np
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
+from Bitacora import configurar_registro
+from Metricas import REGISTRO, agregar_argumentos, iniciar_exportacion
+from Protocolo import CABECERA
+from Server import ServidorModbus, SimuladorProceso
+
+
+# Cabecera del archivo y de cada registro: marca de tiempo, tipo, unidad, dirección de inicio
+# (solo imágenes) y longitud del contenido que sigue
+MAGICO = b'SCAP'
+VERSION = 1
+CABECERA_ARCHIVO = struct.Struct('<4sHHd')
+CABECERA_REGISTRO = struct.Struct('<dBBHI')
+
+
+# Tipos de registro: tramas Modbus TCP completas (MBAP + PDU) o registros de 16 bits
+PETICION = 1
+RESPUESTA = 2
+IMAGEN = 3
+NOMBRES_TIPO = {PETICION: 'peticiones', RESPUESTA: 'respuestas', IMAGEN: 'imágenes'}
+
+
+# Unidad de las imágenes de un servidor que responde igual a todas las unidades
+TODAS_UNIDADES = 0
+
+
+# Funciones cuyas tramas se convierten en imágenes al reproducir
+LECTURA_HOLDING = 3
+ESCRITURA_REGISTRO = 6
+ESCRITURA_REGISTROS = 16
+
+
+class EscritorCaptura:
+    # Solo añade al final del archivo: los registros se acumulan en el buffer del archivo y
+    # llegan al disco al llenarse o cada intervalo. Una captura cortada por un fallo se
+    # puede leer hasta el último registro completo
+    def __init__(self, ruta, tam_buffer=1 << 20, intervalo=1.0):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.archivo = open(ruta, 'ab', buffering=tam_buffer)
+        if self.archivo.tell() == 0:
+            self.archivo.write(CABECERA_ARCHIVO.pack(MAGICO, VERSION, 0, time.time()))
+        self.bloqueo = threading.Lock()
+        self.ultimo_vaciado = time.monotonic()
+        self.registros = 0
+        self.bytes = 0
+
+
+        REGISTRO.exponer('captura_registros_total', "Registros escritos en la captura",
+                         lambda: self.registros, tipo='counter')
+        REGISTRO.exponer('captura_bytes_total', "Bytes escritos en la captura",
+                         lambda: self.bytes, tipo='counter')
+
+
+    def agregar(self, tipo, unidad, inicio, contenido, marca_tiempo=None):
+        cabecera = CABECERA_REGISTRO.pack(marca_tiempo or time.time(), tipo, unidad, inicio, len(contenido))
+        with self.bloqueo:
+            if self.archivo is None:
+                return
+            self.archivo.write(cabecera)
+            self.archivo.write(contenido)
+            self.registros += 1
+            self.bytes += len(cabecera) + len(contenido)
+            if time.monotonic() - self.ultimo_vaciado >= self.intervalo:
+                self.vaciar()
+
+
+    def peticion(self, trama, marca_tiempo=None):
+        self.agregar(PETICION, trama[6], 0, trama, marca_tiempo)
+
+
+    def respuesta(self, trama, marca_tiempo=None):
+        self.agregar(RESPUESTA, trama[6], 0, trama, marca_tiempo)
+
+
+    def imagen(self, unidad, inicio, registros, marca_tiempo=None):
+        self.agregar(IMAGEN, unidad, inicio, np.asarray(registros, dtype='<u2').tobytes(), marca_tiempo)
+
+
+    def vaciar(self):
+        # Quien llama tiene el bloqueo
+        self.ultimo_vaciado = time.monotonic()
+        self.archivo.flush()
+
+
+    def cerrar(self):
+        with self.bloqueo:
+            if self.archivo is not None:
+                self.archivo.close()
+                self.archivo = None
+        logging.info("Captura %s: %d registros, %.1f MB", self.ruta, self.registros, self.bytes / 1e6)
+
+
+class LectorCaptura:
+    # Índice de los registros (posición, tipo, unidad, tiempo) sobre el archivo mapeado;
+    # el contenido de cada uno se lee solo al recorrerlo
+    def __init__(self, ruta):
+        self.ruta = ruta
+        with open(ruta, 'rb') as archivo:
+            self.mapa = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mapa) < CABECERA_ARCHIVO.size:
+            raise ValueError(f"{ruta} no es una captura")
+        magico, version, _, self.t_inicio = CABECERA_ARCHIVO.unpack_from(self.mapa, 0)
+        if magico != MAGICO or version != VERSION:
+            raise ValueError(f"{ruta} no es una captura (versión {VERSION})")
+
+
+        posiciones, tipos, unidades, tiempos = [], [], [], []
+        posicion = CABECERA_ARCHIVO.size
+        total = len(self.mapa)
+        while posicion + CABECERA_REGISTRO.size <= total:
+            marca_tiempo, tipo, unidad, _, longitud = CABECERA_REGISTRO.unpack_from(self.mapa, posicion)
+            if posicion + CABECERA_REGISTRO.size + longitud > total:
+                break
+            posiciones.append(posicion)
+            tipos.append(tipo)
+            unidades.append(unidad)
+            tiempos.append(marca_tiempo)
+            posicion += CABECERA_REGISTRO.size + longitud
+        if posicion < total:
+            logging.warning("%s: %d bytes al final sin un registro completo", ruta, total - posicion)
+
+
+        self.posiciones = np.array(posiciones, dtype=np.int64)
+        self.tipos = np.array(tipos, dtype=np.uint8)
+        self.unidades = np.array(unidades, dtype=np.uint8)
+        self.tiempos = np.array(tiempos, dtype=np.float64)
+
+
+    def __len__(self):
+        return len(self.posiciones)
+
+
+    def registro(self, indice):
+        posicion = int(self.posiciones[indice])
+        marca_tiempo, tipo, unidad, inicio, longitud = CABECERA_REGISTRO.unpack_from(self.mapa, posicion)
+        desde = posicion + CABECERA_REGISTRO.size
+        return marca_tiempo, tipo, unidad, inicio, self.mapa[desde:desde + longitud]
+
+
+    def imagenes(self, desde_tramas=None):
+        # (tiempo, unidad, inicio, registros) en orden: las imágenes capturadas y, si la captura
+        # no tiene imágenes (o desde_tramas), las lecturas y escrituras de holding registers
+        # reconstruidas a partir de cada petición y su respuesta
+        if desde_tramas is None:
+            desde_tramas = not (self.tipos == IMAGEN).any()
+        pendientes = {}
+        for indice in range(len(self)):
+            marca_tiempo, tipo, unidad, inicio, contenido = self.registro(indice)
+            if tipo == IMAGEN:
+                yield marca_tiempo, unidad, inicio, np.frombuffer(contenido, dtype='<u2')
+                continue
+            if not desde_tramas or len(contenido) < CABECERA.size + 1:
+                continue
+
+
+            transaccion = CABECERA.unpack_from(contenido)[0]
+            pdu = contenido[CABECERA.size:]
+            if tipo == PETICION:
+                pendientes[(unidad, transaccion)] = pdu
+                continue
+            peticion = pendientes.pop((unidad, transaccion), None)
+            if peticion is not None and peticion[0] == pdu[0]:
+                imagen = imagen_de_tramas(peticion, pdu)
+                if imagen is not None:
+                    yield (marca_tiempo, unidad) + imagen
+
+
+    def cerrar(self):
+        self.mapa.close()
+
+
+def imagen_de_tramas(peticion, respuesta):
+    # (inicio, registros) que una petición y su respuesta correcta dejan ver del equipo
+    funcion = peticion[0]
+    if funcion == LECTURA_HOLDING and len(peticion) >= 5 and len(respuesta) >= 2:
+        inicio, cantidad = struct.unpack_from('>HH', peticion, 1)
+        registros = np.frombuffer(respuesta, dtype='>u2', count=respuesta[1] // 2, offset=2)
+        return inicio, registros[:cantidad].astype(np.uint16)
+    if funcion == ESCRITURA_REGISTRO and len(peticion) >= 5:
+        inicio, valor = struct.unpack_from('>HH', peticion, 1)
+        return inicio, np.array([valor], dtype=np.uint16)
+    if funcion == ESCRITURA_REGISTROS and len(peticion) >= 6:
+        inicio, cantidad = struct.unpack_from('>HH', peticion, 1)
+        registros = np.frombuffer(peticion, dtype='>u2', count=cantidad, offset=6)
+        return inicio, registros.astype(np.uint16)
+    return None
+
+
+class ServidorReproduccion(ServidorModbus):
+    # Sirve las imágenes de una captura en su línea de tiempo original, acelerada por un
+    # factor o sin esperas (velocidad 0). Atiende peticiones igual que el servidor asyncio,
+    # con la misma caché invalidada en cada publicación
+    def __init__(self, lector, host='localhost', port=502, velocidad=1.0, bucle=False,
+                 max_conexiones=10000, desde_tramas=None):
+        super().__init__(host, port, 'asyncio', max_conexiones, SimuladorProceso([]), intervalo_log=10.0)
+        self.lector = lector
+        self.velocidad = velocidad
+        self.bucle = bucle
+        self.desde_tramas = desde_tramas
+        self.publicaciones = 0
+        REGISTRO.exponer('reproduccion_publicaciones_total', "Imágenes de la captura publicadas",
+                         lambda: self.publicaciones, tipo='counter')
+
+
+        # Primer recorrido: unidades y tamaño de imagen necesarios
+        unidades = set()
+        tamano = 1
+        for _, unidad, inicio, registros in lector.imagenes(desde_tramas):
+            unidades.add(unidad)
+            tamano = max(tamano, inicio + len(registros))
+        self.tamano = tamano
+        if not unidades:
+            raise ValueError(f"{lector.ruta} no tiene imágenes ni lecturas que reproducir")
+
+
+        # Con imágenes de una sola unidad (o de todas) se responde igual a cualquier unidad
+        def almacen():
+            return ModbusSlaveContext(hr=ModbusSequentialDataBlock(0, [0] * (tamano + 1)),
+                                      di=ModbusSequentialDataBlock(0, [0]),
+                                      co=ModbusSequentialDataBlock(0, [0]),
+                                      ir=ModbusSequentialDataBlock(0, [0]))
+
+
+        unidades.discard(TODAS_UNIDADES)
+        if len(unidades) <= 1:
+            self.store = almacen()
+            self.almacenes = {}
+            self.context = ModbusServerContext(slaves=self.store, single=True)
+        else:
+            self.almacenes = {unidad: almacen() for unidad in sorted(unidades)}
+            self.context = ModbusServerContext(slaves=self.almacenes, single=False)
+
+
+    def aplicar(self, unidad, inicio, registros):
+        valores = registros.tolist()
+        if not self.almacenes:
+            self.store.setValues(3, inicio, valores)
+        elif unidad == TODAS_UNIDADES:
+            for almacen in self.almacenes.values():
+                almacen.setValues(3, inicio, valores)
+        else:
+            self.almacenes[unidad].setValues(3, inicio, valores)
+        self.publicaciones += 1
+        self.tick_publicado = self.publicaciones
+
+
+    def actualizar_datos(self):
+        while not self.detener.is_set():
+            comienzo = time.monotonic()
+            t0 = None
+            for marca_tiempo, unidad, inicio, registros in self.lector.imagenes(self.desde_tramas):
+                if self.detener.is_set():
+                    return
+                t0 = marca_tiempo if t0 is None else t0
+                if self.velocidad > 0:
+                    espera = comienzo + (marca_tiempo - t0) / self.velocidad - time.monotonic()
+                    if espera > 0:
+                        self.detener.wait(espera)
+                self.aplicar(unidad, inicio, registros)
+
+
+            # En bucle a velocidad máxima una captura corta da muchas vueltas por segundo
+            self.limitador.registrar(logging.INFO, 'vuelta', "Captura reproducida: %d imágenes en %.1f s",
+                                     self.publicaciones, time.monotonic() - comienzo)
+            if not self.bucle:
+                # El servidor sigue atendiendo con la última imagen
+                return
+
+
+def resumir(lector):
+    print(f"{lector.ruta}: {len(lector)} registros desde "
+          f"{datetime.fromtimestamp(lector.t_inicio).isoformat(sep=' ', timespec='seconds')}")
+    if not len(lector):
+        return
+    duracion = lector.tiempos[-1] - lector.tiempos[0]
+    print(f"Duración: {duracion:.1f} s")
+    for tipo, nombre in NOMBRES_TIPO.items():
+        cantidad = int((lector.tipos == tipo).sum())
+        if cantidad:
+            unidades = sorted(set(lector.unidades[lector.tipos == tipo].tolist()))
+            print(f"  {nombre}: {cantidad} ({cantidad / max(duracion, 1e-9):.1f}/s), unidades {unidades}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resumen y reproducción de capturas Modbus")
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+    resumen = subcomandos.add_parser('resumen', help="contenido de una captura")
+    resumen.add_argument('captura')
+    reproducir = subcomandos.add_parser('reproducir', help="servir una captura como servidor Modbus TCP")
+    reproducir.add_argument('captura')
+    reproducir.add_argument('--host', default='localhost', help="dirección de escucha")
+    reproducir.add_argument('--port', type=int, default=502, help="puerto de escucha")
+    reproducir.add_argument('--velocidad', default='1',
+                            help="factor sobre el tiempo real (1, 10, 0.5...) o max para no esperar")
+    reproducir.add_argument('--bucle', action='store_true', help="volver a empezar al terminar la captura")
+    reproducir.add_argument('--desde-tramas', action='store_true',
+                            help="reconstruir los registros a partir de las tramas aunque haya imágenes")
+    reproducir.add_argument('--max-conexiones', type=int, default=10000,
+                            help="conexiones simultáneas admitidas")
+    agregar_argumentos(reproducir)
+    args = parser.parse_args(argv)
+
+
+    lector = LectorCaptura(args.captura)
+    if args.comando == 'resumen':
+        resumir(lector)
+        lector.cerrar()
+        return
+
+
+    velocidad = 0.0 if args.velocidad == 'max' else float(args.velocidad)
+    if velocidad < 0:
+        parser.error("--velocidad debe ser positiva o max")
+    servidor = ServidorReproduccion(lector, args.host, args.port, velocidad, args.bucle,
+                                    args.max_conexiones, args.desde_tramas or None)
+    logging.info("Reproduciendo %s (%d registros) a velocidad %s", args.captura, len(lector), args.velocidad)
+    iniciar_exportacion(args)
+    servidor.iniciar()
+
+
+if __name__ == "__main__":
+    configurar_registro(formato='%(asctime)s - %(message)s', datefmt=None)
+    main()
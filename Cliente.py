@@ -1,22 +1,58 @@
-from pymodbus.client.sync import ModbusTcpClient
-import matplotlib.pyplot as plt
+import argparse
 import numpy as np
+import os
+import sys
 import time
 import logging
+import threading
 from datetime import datetime
-import matplotlib.dates as mdates
-from matplotlib.gridspec import GridSpec
-import seaborn as sns
-from matplotlib.patches import Rectangle, Circle, FancyBboxPatch, Arc, RegularPolygon
-from matplotlib.path import Path
-import matplotlib.patches as patches
-import matplotlib.patheffects as PathEffects
-from matplotlib.colors import LinearSegmentedColormap
+from Adquisicion import MonitorModbus
+from Alarmas import REGLAS, cargar_reglas
+from Bitacora import configurar_registro
+from Metricas import REGISTRO, agregar_argumentos, iniciar_exportacion
+from Tendencias import CAPACIDAD_HISTORIAL, MAX_SILENCIO, ReductorTendencias
+
+
+# matplotlib se importa al crear el panel (cargar_graficos), no al importar este módulo:
+# --help, --headless y quien solo use MonitorModbus arrancan sin la pila gráfica
+plt = GridSpec = patches = PathEffects = LinearSegmentedColormap = Circle = FancyBboxPatch = IdentityTransform = None
+
+
+# Estilo "darkgrid" con fondo de ejes oscuro sobre dark_background, sin depender de seaborn
+ESTILO_PANEL = {
+    'axes.axisbelow': True,
+    'axes.facecolor': '.15',
+    'axes.grid': True,
+    'axes.labelcolor': '.15',
+    'figure.facecolor': 'white',
+    'font.sans-serif': ['Arial', 'DejaVu Sans', 'Liberation Sans', 'Bitstream Vera Sans', 'sans-serif'],
+    'lines.solid_capstyle': 'round',
+    'patch.edgecolor': 'w',
+    'patch.force_edgecolor': True,
+    'text.color': '.15',
+    'xtick.bottom': False,
+    'xtick.color': '.15',
+    'ytick.color': '.15',
+    'ytick.left': False,
+}
+
+
+def cargar_graficos():
+    global plt, GridSpec, patches, PathEffects, LinearSegmentedColormap, Circle, FancyBboxPatch, IdentityTransform
+    if plt is not None:
+        return
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
+    import matplotlib.patheffects as PathEffects
+    from matplotlib.colors import LinearSegmentedColormap
+    from matplotlib.gridspec import GridSpec
+    from matplotlib.patches import Circle, FancyBboxPatch
+    from matplotlib.transforms import IdentityTransform
 
 
-# Configurar estilo visual industrial
-plt.style.use('dark_background')
-sns.set_style("darkgrid", {"axes.facecolor": ".15"})
+    # Configurar estilo visual industrial
+    plt.style.use('dark_background')
+    plt.rcParams.update(ESTILO_PANEL)
 
 
 # Colores industriales
@@ -36,12 +72,16 @@ INDUSTRIAL_COLORS = {
 }
 
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+# Niveles de zoom de las tendencias (teclas + y -)
+ZOOMS = [
+    (60, '1 min'),
+    (300, '5 min'),
+    (900, '15 min'),
+    (3600, '1 h'),
+    (6 * 3600, '6 h'),
+    (86400, '1 día'),
+    (7 * 86400, '1 semana'),
+]
 
 
 class IndustrialSymbols:
@@ -84,6 +124,15 @@ class IndustrialSymbols:
                    '--', color=color, alpha=0.3, linewidth=1)
 
 
+        # Solo el líquido cambia después de crearse
+        return liquid
+
+
+    @staticmethod
+    def update_tank(liquid, height, level_percent):
+        liquid.set_height(height * (level_percent / 100))
+
+
     @staticmethod
     def draw_thermometer(ax, x, y, temp, max_temp=100):
         height = 0.15
@@ -117,18 +166,24 @@ class IndustrialSymbols:
 
 
         # Nivel
-        level = (temp/max_temp) * height
-        ax.add_patch(patches.Rectangle(
-            (x, y), width, level,
+        level = patches.Rectangle(
+            (x, y), width, 0,
             facecolor='red',
             alpha=0.6
-        ))
+        )
+        ax.add_patch(level)
+        IndustrialSymbols.update_thermometer(level, temp, max_temp)
+        return level
+
+
+    @staticmethod
+    def update_thermometer(level, temp, max_temp=100):
+        level.set_height((temp/max_temp) * 0.15)
 
 
     @staticmethod
     def draw_pressure_gauge(ax, x, y, pressure, max_pressure=10):
         radius = 0.08
-        angle = (pressure/max_pressure) * 180
 
 
         # Marco circular
@@ -152,10 +207,8 @@ class IndustrialSymbols:
 
 
         # Aguja
-        angle_rad = np.radians(180 - angle)
-        dx = radius * 0.8 * np.cos(angle_rad)
-        dy = radius * 0.8 * np.sin(angle_rad)
-        ax.plot([x, x + dx], [y, y + dy], 'r-', linewidth=2)
+        needle, = ax.plot([x, x], [y, y], 'r-', linewidth=2)
+        IndustrialSymbols.update_pressure_gauge(needle, x, y, pressure, max_pressure)
 
 
         # Centro de la aguja
@@ -165,6 +218,17 @@ class IndustrialSymbols:
             edgecolor='white',
             linewidth=1
         ))
+        return needle
+
+
+    @staticmethod
+    def update_pressure_gauge(needle, x, y, pressure, max_pressure=10):
+        radius = 0.08
+        angle = (pressure/max_pressure) * 180
+        angle_rad = np.radians(180 - angle)
+        dx = radius * 0.8 * np.cos(angle_rad)
+        dy = radius * 0.8 * np.sin(angle_rad)
+        needle.set_data([x, x + dx], [y, y + dy])
 
 
 class ModernIndicator:
@@ -172,6 +236,7 @@ class ModernIndicator:
         self.ax = ax
         self.pos = pos
         self.size = size
+        self.estado = None
 
 
         # Crear indicador base
@@ -193,7 +258,26 @@ class ModernIndicator:
         self.ax.add_patch(gradient)
 
 
+        # Efectos de brillo y resplandor: se crean una vez y solo cambian de color
+        self.glow = Circle(pos, size*0.7, facecolor='gray', alpha=0.3, visible=False)
+        self.ax.add_patch(self.glow)
+        self.glows_outer = []
+        for i in range(3):
+            alpha = 0.1 - (i * 0.03)
+            size_mult = 0.8 + (i * 0.1)
+            glow_outer = Circle(pos, size*size_mult, facecolor='gray',
+                              alpha=alpha, visible=False)
+            self.ax.add_patch(glow_outer)
+            self.glows_outer.append(glow_outer)
+
+
     def actualizar(self, estado):
+        # Devuelve True si cambió el aspecto (el fondo cacheado deja de ser válido)
+        if estado == self.estado:
+            return False
+        self.estado = estado
+
+
         colors = {
             "Normal": INDUSTRIAL_COLORS['success'],
             "Advertencia": INDUSTRIAL_COLORS['warning'],
@@ -203,37 +287,43 @@ class ModernIndicator:
         self.led.set_facecolor(color)
 
 
-        # Efecto de brillo
-        glow = Circle(self.pos, self.size*0.7, facecolor=color, alpha=0.3)
-        self.ax.add_patch(glow)
+        for glow in [self.glow] + self.glows_outer:
+            glow.set_facecolor(color)
+            glow.set_visible(True)
+        return True
 
 
-        # Efecto de resplandor
-        for i in range(3):
-            alpha = 0.1 - (i * 0.03)
-            size_mult = 0.8 + (i * 0.1)
-            glow_outer = Circle(self.pos, self.size*size_mult,
-                              facecolor=color, alpha=alpha)
-            self.ax.add_patch(glow_outer)
-class ClienteModbus:
-    def __init__(self):
-        self.client = ModbusTcpClient('localhost', port=502)
+class ClienteModbus(MonitorModbus):
+    def __init__(self, host='localhost', port=502, historiador=None, ventana=60, reduccion='minmax',
+                 reglas=None, max_silencio=MAX_SILENCIO, captura=None, gateway=None, asincrono=False,
+                 capacidad_historial=CAPACIDAD_HISTORIAL):
+        super().__init__(host, port, historiador=historiador, reglas=reglas, max_silencio=max_silencio,
+                         captura=captura, gateway=gateway, asincrono=asincrono,
+                         capacidad_historial=capacidad_historial)
 
 
         # Configuración de datos
-        self.max_points = 50
-        self.datos_temperatura = []
-        self.datos_presion = []
-        self.datos_nivel = []
-        self.tiempos = []
-        self.timestamps = []
-
-
-        # Estados y alarmas
-        self.estado_sistema = "Normal"
-        self.alarmas = []
-        self.contador_lecturas = 0
-        self.tiempo_inicio = datetime.now()
+        self.ventana_segundos = ventana
+        self.reduccion = reduccion
+        self.valores_actuales = None
+
+
+        # El render consume el historial a su propio ritmo
+        self.periodo_cuadro = 0.1
+        self.version_dibujada = 0
+        self.contadores.update({
+            'cuadros': 0,
+            'cuadros_descartados': 0,
+            'redibujados_completos': 0,
+        })
+        self.metrica_cuadro = REGISTRO.histograma('scada_cuadro_segundos',
+                                                  "Duración de actualizar_graficos")
+        REGISTRO.exponer('scada_cuadros_total', "Cuadros dibujados",
+                         lambda: self.contadores['cuadros'], tipo='counter')
+        REGISTRO.exponer('scada_cuadros_descartados_total', "Cuadros saltados por falta de tiempo",
+                         lambda: self.contadores['cuadros_descartados'], tipo='counter')
+        REGISTRO.exponer('scada_redibujados_completos_total', "Cuadros que redibujaron la figura completa",
+                         lambda: self.contadores['redibujados_completos'], tipo='counter')
 
 
         # Símbolos industriales
@@ -241,10 +331,12 @@ class ClienteModbus:
 
 
         # Configuración visual
+        cargar_graficos()
         plt.ion()
         self.crear_figura()
         self.configurar_graficos()
-        self.crear_indicadores()
+        self.crear_panel_estado()
+        self.crear_panel_alarmas()
 
 
     def crear_figura(self):
@@ -252,6 +344,16 @@ class ClienteModbus:
         gs = GridSpec(3, 4, figure=self.fig)
 
 
+        # Blitting: fondos estáticos cacheados por eje y artistas que cambian en cada cuadro
+        self.usar_blit = self.fig.canvas.supports_blit
+        self.artistas_animados = {}
+        self.fondos = None
+        self.fondos_vencidos = set()
+        self.fig.canvas.mpl_connect('draw_event', self.al_dibujar)
+        self.fig.canvas.mpl_connect('resize_event', lambda evento: self.invalidar_fondo())
+        self.fig.canvas.mpl_connect('key_press_event', self.al_presionar_tecla)
+
+
         # Gráficos principales
         self.ax1 = self.fig.add_subplot(gs[0, :3])
         self.ax2 = self.fig.add_subplot(gs[1, :3])
@@ -295,6 +397,84 @@ class ClienteModbus:
                                         linewidth=2.5,
                                         path_effects=[PathEffects.withStroke(linewidth=4,
                                         foreground='#333333')])
+        self.animar(self.ax1, self.line_temp)
+        self.animar(self.ax2, self.line_pres)
+        self.animar(self.ax3, self.line_nivel)
+
+
+        # Cada ventana se reduce a unos dos puntos por píxel del eje antes de dibujarse
+        self.reductor = ReductorTendencias(self.historial.columnas,
+                                           puntos=max(int(self.ax1.bbox.width), 100),
+                                           metodo=self.reduccion)
+        self.reductor.configurar(self.ventana_segundos)
+
+
+    def animar(self, ax, *artistas):
+        # Sin soporte de blit los artistas se dibujan de forma normal. Sobre el fondo se
+        # dibujan en el orden de matplotlib: por zorder y, a igual zorder, por creación
+        for artista in artistas:
+            artista.set_animated(self.usar_blit)
+        animados = self.artistas_animados.setdefault(ax, [])
+        animados.extend(artista for artista in artistas if artista not in animados)
+        orden = {artista: i for i, artista in enumerate(ax.get_children())}
+        animados.sort(key=lambda artista: (artista.get_zorder(), orden.get(artista, len(orden))))
+
+
+    def invalidar_fondo(self, ax=None):
+        # Sin eje se redibuja la figura completa; con eje, solo el fondo de ese eje
+        if ax is None:
+            self.fondos = None
+        else:
+            self.fondos_vencidos.add(ax)
+
+
+    def redibujar_fondo(self, ax):
+        # El recuadro del eje se pinta con el color de la figura y se redibujan encima sus
+        # artistas estáticos: el resto de la figura y su fondo cacheado no se tocan
+        canvas = self.fig.canvas
+        renderer = canvas.get_renderer()
+        recuadro = patches.Rectangle((ax.bbox.x0, ax.bbox.y0), ax.bbox.width, ax.bbox.height,
+                                     transform=IdentityTransform(), facecolor=self.fig.get_facecolor(),
+                                     edgecolor='none')
+        recuadro.set_figure(self.fig)
+        recuadro.draw(renderer)
+        ax.draw(renderer)
+        self.fondos[ax] = canvas.copy_from_bbox(ax.bbox)
+
+
+    def al_dibujar(self, evento):
+        # Tras cada dibujado completo se capturan los fondos sin artistas animados
+        canvas = self.fig.canvas
+        self.fondos = {ax: canvas.copy_from_bbox(ax.bbox) for ax in self.artistas_animados}
+        self.fondos_vencidos.clear()
+        self.dibujar_animados()
+
+
+    def dibujar_animados(self):
+        for ax, artistas in self.artistas_animados.items():
+            for artista in artistas:
+                ax.draw_artist(artista)
+
+
+    def dibujar_cuadro(self):
+        canvas = self.fig.canvas
+        if not self.usar_blit:
+            canvas.draw_idle()
+        elif self.fondos is None:
+            # Redibujado completo: solo tras un cambio de zoom o de tamaño de la ventana
+            canvas.draw()
+            canvas.blit(self.fig.bbox)
+            self.contadores['redibujados_completos'] += 1
+        else:
+            for ax in self.fondos_vencidos:
+                self.redibujar_fondo(ax)
+            self.fondos_vencidos.clear()
+            for ax in self.artistas_animados:
+                canvas.restore_region(self.fondos[ax])
+            self.dibujar_animados()
+            for ax in self.artistas_animados:
+                canvas.blit(ax.bbox)
+        canvas.flush_events()
 
 
     def crear_indicadores(self):
@@ -305,9 +485,10 @@ class ClienteModbus:
 
 
         # Agregar símbolos industriales con efectos mejorados
-        self.symbols.draw_thermometer(self.ax_info, 0.7, 0.7, 50)
-        self.symbols.draw_pressure_gauge(self.ax_info, 0.8, 0.5, 5)
-        self.symbols.draw_tank(self.ax_info, 0.7, 0.1, 0.2, 0.2, 50)
+        self.termometro = self.symbols.draw_thermometer(self.ax_info, 0.7, 0.7, 50)
+        self.aguja_presion = self.symbols.draw_pressure_gauge(self.ax_info, 0.8, 0.5, 5)
+        self.liquido_tanque = self.symbols.draw_tank(self.ax_info, 0.7, 0.1, 0.2, 0.2, 50)
+        self.animar(self.ax_info, self.termometro, self.aguja_presion, self.liquido_tanque)
 
 
     def configurar_graficos(self):
@@ -360,12 +541,67 @@ class ClienteModbus:
             (self.ax3, 'Nivel (%)')
         ]:
             ax.set_ylabel(label, color=INDUSTRIAL_COLORS['text'], fontweight='bold')
-            ax.set_xlabel('Tiempo (s)', color=INDUSTRIAL_COLORS['text'], fontweight='bold')
+            ax.set_xlabel('Tiempo (s, 0 = última muestra)', color=INDUSTRIAL_COLORS['text'], fontweight='bold')
+        self.ajustar_eje_x()
+        self.mostrar_zoom()
+
+
+    def ajustar_eje_x(self):
+        # Eje fijo relativo a la última muestra: las líneas avanzan sobre el fondo cacheado y
+        # el eje solo cambia con el zoom
+        for ax in [self.ax1, self.ax2, self.ax3]:
+            ax.set_xlim(-self.ventana_segundos, self.ventana_segundos * 0.02)
+
+
+    def mostrar_zoom(self):
+        etiqueta = dict(ZOOMS).get(self.ventana_segundos, f"{self.ventana_segundos:g} s")
+        self.ax1.title.set_text(f'MONITOREO DE TEMPERATURA · {etiqueta}')
+
+
+    def al_presionar_tecla(self, evento):
+        if evento.key in ('+', '='):
+            self.cambiar_zoom(-1)
+        elif evento.key == '-':
+            self.cambiar_zoom(1)
+        elif evento.key == 'a':
+            self.alarmas.reconocer()
+
+
+    def cambiar_zoom(self, paso):
+        segundos = [segundos for segundos, _ in ZOOMS]
+        actual = min(range(len(segundos)), key=lambda i: abs(segundos[i] - self.ventana_segundos))
+        nuevo = min(max(actual + paso, 0), len(segundos) - 1)
+        if segundos[nuevo] == self.ventana_segundos:
+            return
+
+
+        # El reductor se vacía y el próximo cuadro resume la ventana nueva completa
+        self.ventana_segundos = segundos[nuevo]
+        self.reductor.configurar(self.ventana_segundos)
+        self.version_dibujada = -1
+        self.ajustar_eje_x()
+        self.mostrar_zoom()
+        self.invalidar_fondo()
+
+
+    def cargar_historico(self, t_inicio, t_fin):
+        # Parte de la ventana que ya no está en memoria; se lee por bloques del historiador
+        if self.historiador is None or t_inicio >= t_fin:
+            return
+
+
+        from Historiador import LectorHistorico
+        lector = LectorHistorico(self.historiador.directorio)
+        for bloque in lector.iterar(t_inicio, t_fin, self.historial.columnas):
+            self.reductor.agregar(bloque['t'], bloque)
+        lector.cerrar()
 
 
     def crear_panel_estado(self):
-        self.ax_info.clear()
+        # Los artistas del panel se crean una sola vez; cada cuadro solo los modifica
         self.ax_info.axis('off')
+        self.ax_info.set_xlim(0, 1)
+        self.ax_info.set_ylim(0, 1)
 
 
         # Panel industrial mejorado
@@ -391,19 +627,16 @@ class ClienteModbus:
 
 
         # Información del sistema con estilo industrial mejorado
-        self.mostrar_info_sistema()
-        self.mostrar_valores_actuales()
-        self.actualizar_simbolos_industriales()
+        self.crear_indicadores()
+        self.crear_info_sistema()
+        self.crear_valores_actuales()
 
 
-    def mostrar_info_sistema(self):
+    def crear_info_sistema(self):
+        self.textos_info = {}
         y_pos = 0.85
-        for etiqueta, valor in [
-            ('TIEMPO DE OPERACIÓN', self.obtener_tiempo_operacion()),
-            ('LECTURAS REALIZADAS', str(self.contador_lecturas)),
-            ('ESTADO DEL SISTEMA', self.estado_sistema),
-            ('ÚLTIMA ACTUALIZACIÓN', datetime.now().strftime('%H:%M:%S'))
-        ]:
+        for etiqueta in ['TIEMPO DE OPERACIÓN', 'LECTURAS REALIZADAS',
+                         'ESTADO DEL SISTEMA', 'ÚLTIMA ACTUALIZACIÓN']:
             # Marco metálico mejorado
             rect = FancyBboxPatch(
                 (0.05, y_pos-0.03), 0.9, 0.04,
@@ -420,7 +653,7 @@ class ClienteModbus:
             texto = self.ax_info.text(0.07, y_pos, f"{etiqueta}:",
                                     color=INDUSTRIAL_COLORS['text'],
                                     fontsize=9, fontweight='bold')
-            valor_texto = self.ax_info.text(0.93, y_pos, f"{valor}",
+            valor_texto = self.ax_info.text(0.93, y_pos, "",
                                           color=INDUSTRIAL_COLORS['info'],
                                           fontsize=9, ha='right',
                                           fontweight='bold')
@@ -434,38 +667,32 @@ class ClienteModbus:
                 ])
 
 
+            self.textos_info[etiqueta] = valor_texto
+            self.animar(self.ax_info, valor_texto)
             y_pos -= 0.06
 
 
-    def mostrar_valores_actuales(self):
-        if not self.datos_temperatura:
-            return
-
-
-        # Panel de valores actuales
-        valores_panel = FancyBboxPatch(
+    def crear_valores_actuales(self):
+        # Panel de valores actuales (oculto hasta recibir la primera muestra)
+        self.panel_valores = FancyBboxPatch(
             (0.05, 0.1), 0.9, 0.55,
             boxstyle="round,pad=0.02",
             fc=INDUSTRIAL_COLORS['panel'],
             ec=INDUSTRIAL_COLORS['success'],
             transform=self.ax_info.transAxes,
-            alpha=0.3
+            alpha=0.3,
+            visible=False
         )
-        self.ax_info.add_patch(valores_panel)
+        self.ax_info.add_patch(self.panel_valores)
 
 
         # Valores actuales con sus indicadores
-        valores = [
-            ('TEMPERATURA', self.datos_temperatura[-1], '°C', 0.85,
-             INDUSTRIAL_COLORS['success']),
-            ('PRESIÓN', self.datos_presion[-1], 'bar', 0.55,
-             INDUSTRIAL_COLORS['info']),
-            ('NIVEL', self.datos_nivel[-1], '%', 0.25,
-             INDUSTRIAL_COLORS['success'])
-        ]
-
-
-        for etiqueta, valor, unidad, y_pos, color in valores:
+        self.filas_valores = []
+        for nombre, unidad, y_pos, color, maximo in [
+            ('temperatura', '°C', 0.85, INDUSTRIAL_COLORS['success'], 100),
+            ('presion', 'bar', 0.55, INDUSTRIAL_COLORS['info'], 10),
+            ('nivel', '%', 0.25, INDUSTRIAL_COLORS['success'], 100)
+        ]:
             # Marco para el valor
             valor_rect = FancyBboxPatch(
                 (0.35, y_pos-0.03), 0.25, 0.04,
@@ -473,14 +700,14 @@ class ClienteModbus:
                 fc=INDUSTRIAL_COLORS['accent'],
                 ec=color,
                 alpha=0.3,
-                transform=self.ax_info.transAxes
+                transform=self.ax_info.transAxes,
+                visible=False
             )
             self.ax_info.add_patch(valor_rect)
 
 
             # Valor actual con efecto metálico
-            valor_texto = self.ax_info.text(0.47, y_pos,
-                                          f"{valor:.1f}{unidad}",
+            valor_texto = self.ax_info.text(0.47, y_pos, "",
                                           color=INDUSTRIAL_COLORS['text'],
                                           fontsize=10, ha='center',
                                           fontweight='bold')
@@ -490,26 +717,21 @@ class ClienteModbus:
             ])
 
 
-            # Estado
-            estado = self.evaluar_estado(valor, 0, 100 if unidad in ['°C', '%'] else 10)
-            estado_color = self.obtener_color_estado(estado)
-
-
             # Marco para el estado
             estado_rect = FancyBboxPatch(
                 (0.35, y_pos-0.08), 0.25, 0.04,
                 boxstyle="round,pad=0.01",
                 fc=INDUSTRIAL_COLORS['accent'],
-                ec=estado_color,
+                ec=INDUSTRIAL_COLORS['accent'],
                 alpha=0.3,
-                transform=self.ax_info.transAxes
+                transform=self.ax_info.transAxes,
+                visible=False
             )
             self.ax_info.add_patch(estado_rect)
 
 
             # Mostrar estado
-            estado_texto = self.ax_info.text(0.47, y_pos-0.05, estado,
-                                           color=estado_color,
+            estado_texto = self.ax_info.text(0.47, y_pos-0.05, "",
                                            fontsize=8, ha='center')
             estado_texto.set_path_effects([
                 PathEffects.withStroke(linewidth=1,
@@ -517,22 +739,72 @@ class ClienteModbus:
             ])
 
 
+            self.animar(self.ax_info, valor_texto, estado_rect, estado_texto)
+            self.filas_valores.append((nombre, unidad, maximo, valor_rect, valor_texto,
+                                       estado_rect, estado_texto))
+        self.estados_valores = {}
+
+
+    def actualizar_panel_estado(self):
+        self.mostrar_info_sistema()
+        self.mostrar_valores_actuales()
+        self.actualizar_simbolos_industriales()
+
+
+    def mostrar_info_sistema(self):
+        for etiqueta, valor in [
+            ('TIEMPO DE OPERACIÓN', self.obtener_tiempo_operacion()),
+            ('LECTURAS REALIZADAS', str(self.contador_lecturas)),
+            ('ESTADO DEL SISTEMA', self.estado_sistema),
+            ('ÚLTIMA ACTUALIZACIÓN', datetime.now().strftime('%H:%M:%S'))
+        ]:
+            self.textos_info[etiqueta].set_text(valor)
+
+
+    def mostrar_valores_actuales(self):
+        if self.valores_actuales is None:
+            return
+
+
+        if not self.panel_valores.get_visible():
+            self.panel_valores.set_visible(True)
+            self.invalidar_fondo(self.ax_info)
+
+
+        for (nombre, unidad, maximo, valor_rect, valor_texto,
+             estado_rect, estado_texto) in self.filas_valores:
+            valor = self.valores_actuales[nombre]
+            valor_rect.set_visible(True)
+            valor_texto.set_text(f"{valor:.1f}{unidad}")
+
+
+            # Estado: el texto y el color solo se actualizan cuando cambia
+            estado = self.evaluar_estado(valor, 0, maximo)
+            if self.estados_valores.get(nombre) == estado:
+                continue
+            self.estados_valores[nombre] = estado
+            estado_color = self.obtener_color_estado(estado)
+            estado_rect.set_visible(True)
+            estado_rect.set_edgecolor(estado_color)
+            estado_texto.set_text(estado)
+            estado_texto.set_color(estado_color)
+
+
     def actualizar_simbolos_industriales(self):
-        if not self.datos_temperatura:
+        if self.valores_actuales is None:
             return
 
 
-        # Actualizar símbolos con valores actuales y efectos mejorados
-        self.symbols.draw_thermometer(self.ax_info, 0.7, 0.7,
-                                    self.datos_temperatura[-1])
-        self.symbols.draw_pressure_gauge(self.ax_info, 0.8, 0.5,
-                                       self.datos_presion[-1])
-        self.symbols.draw_tank(self.ax_info, 0.7, 0.1, 0.2, 0.2,
-                             self.datos_nivel[-1])
+        # Actualizar símbolos con valores actuales
+        self.symbols.update_thermometer(self.termometro,
+                                      self.valores_actuales['temperatura'])
+        self.symbols.update_pressure_gauge(self.aguja_presion, 0.8, 0.5,
+                                         self.valores_actuales['presion'])
+        self.symbols.update_tank(self.liquido_tanque, 0.2,
+                               self.valores_actuales['nivel'])
 
 
-    def actualizar_alarmas(self):
-        self.ax_alarmas.clear()
+    def crear_panel_alarmas(self):
         self.ax_alarmas.axis('off')
 
 
@@ -559,23 +831,26 @@ class ClienteModbus:
         ])
 
 
-        # Mostrar alarmas con estilo industrial mejorado
+        # Tres filas fijas que se rellenan con las últimas alarmas
+        self.filas_alarmas = []
         y_pos = 0.7
-        for alarma in self.alarmas[-3:]:
+        for _ in range(3):
             rect = FancyBboxPatch(
                 (0.05, y_pos-0.03), 0.9, 0.04,
                 boxstyle="round,pad=0.01",
                 fc=INDUSTRIAL_COLORS['accent'],
                 ec=INDUSTRIAL_COLORS['danger'],
                 alpha=0.3,
-                transform=self.ax_alarmas.transAxes
+                transform=self.ax_alarmas.transAxes,
+                visible=False
             )
             self.ax_alarmas.add_patch(rect)
 
 
-            texto = self.ax_alarmas.text(0.07, y_pos, alarma,
+            texto = self.ax_alarmas.text(0.07, y_pos, "",
                                        color=INDUSTRIAL_COLORS['danger'],
-                                       fontsize=8, fontweight='bold')
+                                       fontsize=8, fontweight='bold',
+                                       clip_on=True)
             texto.set_path_effects([
                 PathEffects.withStroke(linewidth=1,
                                      foreground=INDUSTRIAL_COLORS['accent']),
@@ -583,7 +858,24 @@ class ClienteModbus:
             ])
 
 
+            self.animar(self.ax_alarmas, rect, texto)
+            self.filas_alarmas.append((rect, texto))
             y_pos -= 0.2
+        self.version_alarmas = -1
+
+
+    def actualizar_alarmas(self):
+        # Las filas solo se rehacen cuando el motor registra una transición o un reconocimiento
+        if self.alarmas.version == self.version_alarmas:
+            return
+        self.version_alarmas = self.alarmas.version
+        alarmas = self.alarmas.lineas(len(self.filas_alarmas))
+
+
+        for i, (rect, texto) in enumerate(self.filas_alarmas):
+            visible = i < len(alarmas)
+            rect.set_visible(visible)
+            texto.set_text(alarmas[i] if visible else "")
 
 
     def obtener_tiempo_operacion(self):
@@ -610,121 +902,214 @@ class ClienteModbus:
         }.get(estado, INDUSTRIAL_COLORS['danger'])
 
 
-    def verificar_alarmas(self, temp, pres, nivel):
-        timestamp = datetime.now().strftime('%H:%M:%S')
-        if temp > 90:
-            self.alarmas.append(f"{timestamp} - ¡Temperatura crítica! ({temp:.1f}°C)")
-        if pres > 8:
-            self.alarmas.append(f"{timestamp} - ¡Presión elevada! ({pres:.1f} bar)")
-        if nivel < 10:
-            self.alarmas.append(f"{timestamp} - ¡Nivel bajo! ({nivel:.1f}%)")
-
-
-        self.alarmas = self.alarmas[-10:]
-
-
-    def leer_datos(self):
-        try:
-            temp = self.client.read_holding_registers(0, 1, unit=1).registers[0] / 100.0
-            time.sleep(0.1)
-            pres = self.client.read_holding_registers(1, 1, unit=1).registers[0] / 100.0
-            time.sleep(0.1)
-            nivel = self.client.read_holding_registers(2, 1, unit=1).registers[0] / 100.0
-
-
-            self.contador_lecturas += 1
-            self.verificar_alarmas(temp, pres, nivel)
-
-
-            return temp, pres, nivel
-        except Exception as e:
-            logging.error(f"Error en lectura: {e}")
-            return None, None, None
-
-
     def actualizar_graficos(self):
-        if len(self.tiempos) > self.max_points:
-            self.tiempos.pop(0)
-            self.datos_temperatura.pop(0)
-            self.datos_presion.pop(0)
-            self.datos_nivel.pop(0)
-            self.timestamps.pop(0)
-
-
-        # Actualizar líneas con gradientes de color
-        if self.datos_temperatura:
-            temp_colors = self.temp_cmap(np.clip(np.array(self.datos_temperatura) / 100, 0, 1))
-            pres_colors = self.pres_cmap(np.clip(np.array(self.datos_presion) / 10, 0, 1))
-            level_colors = self.level_cmap(np.clip(np.array(self.datos_nivel) / 100, 0, 1))
-
-
-            self.line_temp.set_color(temp_colors[-1])
-            self.line_pres.set_color(pres_colors[-1])
-            self.line_nivel.set_color(level_colors[-1])
-
-
-        self.line_temp.set_data(self.tiempos, self.datos_temperatura)
-        self.line_pres.set_data(self.tiempos, self.datos_presion)
-        self.line_nivel.set_data(self.tiempos, self.datos_nivel)
-
-
-        if self.tiempos:
-            for ax in [self.ax1, self.ax2, self.ax3]:
-                ax.set_xlim(max(0, self.tiempos[-1] - self.max_points),
-                          self.tiempos[-1] + 2)
-
-
-        self.crear_panel_estado()
+        # Ventana recién configurada: lo anterior al buffer en memoria sale del historiador
+        if self.reductor.t_ultimo is None:
+            with self.bloqueo:
+                ultimo = self.historial.ultimo()
+                if ultimo is not None:
+                    t_fin = float(ultimo['t'])
+                    t_buffer = float(self.historial.ventana()['t'][0])
+            if ultimo is not None:
+                self.cargar_historico(t_fin - self.ventana_segundos, t_buffer)
+
+
+        # Solo las muestras nuevas pasan por el reductor
+        with self.bloqueo:
+            ultimo = self.historial.ultimo()
+            if ultimo is not None:
+                desde = self.reductor.t_ultimo
+                if desde is None:
+                    desde = float(ultimo['t']) - self.ventana_segundos
+                nuevas = self.historial.desde(desde)
+                self.reductor.agregar(nuevas['t'], nuevas)
+                self.valores_actuales = {columna: float(ultimo[columna])
+                                         for columna in self.historial.columnas}
+                t_ultimo = float(ultimo['t'])
+            self.version_dibujada = self.version_datos
+
+
+        # Color de cada línea según su último valor
+        if ultimo is not None:
+            self.line_temp.set_color(self.temp_cmap(np.clip(self.valores_actuales['temperatura'] / 100, 0, 1)))
+            self.line_pres.set_color(self.pres_cmap(np.clip(self.valores_actuales['presion'] / 10, 0, 1)))
+            self.line_nivel.set_color(self.level_cmap(np.clip(self.valores_actuales['nivel'] / 100, 0, 1)))
+
+
+        # Tiempos relativos a la última muestra sobre el eje fijo
+        if ultimo is not None:
+            for linea, columna in [(self.line_temp, 'temperatura'),
+                                   (self.line_pres, 'presion'),
+                                   (self.line_nivel, 'nivel')]:
+                tiempos, valores = self.reductor.serie(columna)
+                linea.set_data(tiempos - t_ultimo, valores)
+
+
+        self.actualizar_panel_estado()
         self.actualizar_alarmas()
 
 
-        if self.datos_temperatura:
-            self.indicador_temp.actualizar(
-                self.evaluar_estado(self.datos_temperatura[-1], 0, 100))
-            self.indicador_pres.actualizar(
-                self.evaluar_estado(self.datos_presion[-1], 0, 10))
-            self.indicador_nivel.actualizar(
-                self.evaluar_estado(self.datos_nivel[-1], 0, 100))
+        if self.valores_actuales is not None:
+            # Los indicadores quedan bajo el título y las etiquetas del panel: al cambiar de
+            # color se rehace el fondo de ese panel, no el de la figura
+            cambios = [
+                self.indicador_temp.actualizar(
+                    self.evaluar_estado(self.valores_actuales['temperatura'], 0, 100)),
+                self.indicador_pres.actualizar(
+                    self.evaluar_estado(self.valores_actuales['presion'], 0, 10)),
+                self.indicador_nivel.actualizar(
+                    self.evaluar_estado(self.valores_actuales['nivel'], 0, 100))
+            ]
+            if any(cambios):
+                self.invalidar_fondo(self.ax_info)
 
 
-        self.fig.canvas.draw()
-        self.fig.canvas.flush_events()
+        self.dibujar_cuadro()
 
 
     def iniciar(self):
-        if not self.client.connect():
-            logging.error("Error de conexión con el servidor Modbus")
-            return
+        self.conectar()
 
 
-        logging.info("Conexión establecida con el servidor Modbus")
-        tiempo_inicio = time.time()
+        # Adquisición en su propio hilo, render en el hilo principal
+        hilo_adquisicion = threading.Thread(target=self.bucle_adquisicion)
+        hilo_adquisicion.daemon = True
+        hilo_adquisicion.start()
 
 
         try:
+            siguiente = time.monotonic()
             while True:
-                temp, pres, nivel = self.leer_datos()
-                if temp is not None:
-                    tiempo_actual = int(time.time() - tiempo_inicio)
-                    self.tiempos.append(tiempo_actual)
-                    self.timestamps.append(datetime.now())
-                    self.datos_temperatura.append(temp)
-                    self.datos_presion.append(pres)
-                    self.datos_nivel.append(nivel)
+                if self.version_datos != self.version_dibujada:
+                    inicio = time.perf_counter()
                     self.actualizar_graficos()
-                time.sleep(1)
+                    self.metrica_cuadro.observar(time.perf_counter() - inicio)
+                    self.contadores['cuadros'] += 1
+
+
+                # Bajo carga se saltan cuadros, nunca muestras
+                siguiente += self.periodo_cuadro
+                ahora = time.monotonic()
+                if ahora > siguiente:
+                    saltados = int((ahora - siguiente) / self.periodo_cuadro) + 1
+                    self.contadores['cuadros_descartados'] += saltados
+                    siguiente += saltados * self.periodo_cuadro
+                self.fig.canvas.start_event_loop(siguiente - ahora)
 
 
         except KeyboardInterrupt:
             logging.info("Finalizando monitoreo...")
         finally:
-            self.client.close()
+            self.detener.set()
+            hilo_adquisicion.join(timeout=2)
+            logging.info("Contadores: %s", self.contadores)
+            self.cerrar()
             plt.ioff()
             plt.close()
 
 
-if __name__ == "__main__":
-    cliente = ClienteModbus()
+def perfil_arranque(cantidad=15):
+    # Equivalente a python -X importtime en un intérprete nuevo (sin módulos ya cargados):
+    # tiempo de importar este módulo, de cargar la pila gráfica y los módulos más lentos
+    import subprocess
+    script = ("import time; t0 = time.perf_counter(); import Cliente; t1 = time.perf_counter(); "
+              "Cliente.cargar_graficos(); print(t1 - t0, time.perf_counter() - t1)")
+    resultado = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], capture_output=True,
+                               text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               env=dict(os.environ, MPLBACKEND='Agg'))
+    if resultado.returncode != 0:
+        print(resultado.stderr)
+        return
+
+
+    # Cada línea: "import time: propio | acumulado | módulo", con dos espacios por nivel de anidación
+    modulos = []
+    for linea in resultado.stderr.splitlines():
+        campos = linea.split('|')
+        if len(campos) != 3 or not campos[1].strip().isdigit():
+            continue
+        nivel = (len(campos[2]) - len(campos[2].lstrip()) - 1) // 2
+        if nivel <= 1:
+            modulos.append((int(campos[1]), nivel, campos[2].strip()))
+
+
+    importar, graficos = (float(valor) for valor in resultado.stdout.split())
+    print(f"Importar Cliente.py (modo sin interfaz): {importar * 1000:.0f} ms")
+    print(f"Cargar matplotlib y el estilo (solo con interfaz): {graficos * 1000:.0f} ms")
+    print("Módulos más lentos (acumulado, -X importtime):")
+    for acumulado, nivel, modulo in sorted(modulos, reverse=True)[:cantidad]:
+        print(f"  {acumulado / 1000:8.1f} ms  {'  ' * nivel}{modulo}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cliente SCADA Modbus TCP")
+    parser.add_argument('--host', default='localhost', help="servidor Modbus")
+    parser.add_argument('--port', type=int, default=502, help="puerto Modbus")
+    parser.add_argument('--historiador', help="directorio del historiador (rellena las tendencias al iniciar)")
+    parser.add_argument('--ventana', type=float, default=60,
+                        help="segundos visibles en las tendencias (zoom con + y -, hasta 1 semana)")
+    parser.add_argument('--reduccion', choices=['minmax', 'lttb'], default='minmax',
+                        help="algoritmo para reducir la ventana al ancho del eje")
+    parser.add_argument('--capacidad-historial', type=int, default=CAPACIDAD_HISTORIAL,
+                        help="muestras del historial de tendencias en memoria; lo que no quepa se lee del "
+                             "historiador al ampliar la ventana")
+    parser.add_argument('--alarmas', help="archivo JSON con las reglas de alarma (tecla a: reconocer)")
+    parser.add_argument('--max-silencio', type=float, default=MAX_SILENCIO,
+                        help="segundos máximos sin redibujar ni registrar si los valores no cambian")
+    parser.add_argument('--captura', help="archivo donde grabar los registros recibidos (Captura.py los reproduce)")
+    parser.add_argument('--gateway', help="recibir las muestras de Gateway.py (unix:/ruta o tcp:host:puerto) "
+                                          "en lugar de sondear el equipo")
+    parser.add_argument('--dispositivo', help="equipo del gateway a mostrar (por defecto, el primero que llegue)")
+    parser.add_argument('--asincrono', action='store_true',
+                        help="sondear con el motor asyncio (MotorAdquisicion) en lugar de la sesión síncrona")
+    parser.add_argument('--headless', action='store_true',
+                        help="adquisición, alarmas e historiador sin interfaz gráfica (no importa matplotlib)")
+    parser.add_argument('--perfil-arranque', action='store_true',
+                        help="medir el tiempo de importación del cliente y de la pila gráfica y salir")
+    agregar_argumentos(parser)
+    args = parser.parse_args(argv)
+    if args.perfil_arranque:
+        perfil_arranque()
+        return
+    if args.capacidad_historial < 1:
+        parser.error("--capacidad-historial debe ser positiva")
+
+
+    # Las combinaciones inválidas se rechazan antes de abrir la captura o conectar al gateway
+    if args.captura and args.gateway:
+        parser.error("--captura graba lo leído del equipo; no está disponible con --gateway")
+    if args.asincrono and (args.captura or args.gateway):
+        parser.error("--asincrono no se combina con --captura ni con --gateway")
+    iniciar_exportacion(args)
+
+
+    captura = None
+    if args.captura:
+        from Captura import EscritorCaptura
+        captura = EscritorCaptura(args.captura)
+    gateway = None
+    if args.gateway:
+        from Gateway import SuscriptorGateway
+        gateway = SuscriptorGateway(args.gateway, args.dispositivo)
+    reglas = cargar_reglas(args.alarmas) if args.alarmas else REGLAS
+    if args.headless:
+        monitor = MonitorModbus(args.host, args.port, historiador=args.historiador, reglas=reglas,
+                                max_silencio=args.max_silencio, captura=captura, gateway=gateway,
+                                asincrono=args.asincrono, capacidad_historial=args.capacidad_historial)
+        monitor.iniciar()
+        return
+
+
+    cliente = ClienteModbus(args.host, args.port, historiador=args.historiador,
+                            ventana=args.ventana, reduccion=args.reduccion,
+                            reglas=reglas, max_silencio=args.max_silencio, captura=captura,
+                            gateway=gateway, asincrono=args.asincrono,
+                            capacidad_historial=args.capacidad_historial)
     cliente.iniciar()
 
 
+if __name__ == "__main__":
+    configurar_registro()
+    main()
+
+
@@ -0,0 +1,171 @@
+import logging
+import random
+import socket
+import threading
+import time
+
+
+from Metricas import REGISTRO
+
+
+# Los cortes se registran una vez desde EstadoConexion; pymodbus repetiría cada intento
+logging.getLogger('pymodbus.client.sync').setLevel(logging.CRITICAL)
+
+
+# Cortes de segundos a horas
+LIMITES_CORTE = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+class PoliticaReintento:
+    def __init__(self, base=0.5, maximo=30.0, factor=2.0):
+        self.base = base
+        self.maximo = maximo
+        self.factor = factor
+
+
+    def espera(self, intentos):
+        # Backoff exponencial con jitter completo: los clientes que perdieron el mismo
+        # equipo a la vez no vuelven a conectarse todos en el mismo instante
+        tope = min(self.maximo, self.base * self.factor ** max(intentos - 1, 0))
+        return random.uniform(0, tope)
+
+
+def configurar_socket(sock, inactividad=10, intervalo=5, sondeos=3):
+    # Sin Nagle (peticiones pequeñas) y keepalive para detectar un equipo caído sin RST
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for opcion, valor in (('TCP_KEEPIDLE', inactividad), ('TCP_KEEPINTVL', intervalo),
+                          ('TCP_KEEPCNT', sondeos)):
+        if hasattr(socket, opcion):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, opcion), valor)
+
+
+class EstadoConexion:
+    # Backoff, registro de cortes y métricas de una conexión (síncrona o asyncio)
+    def __init__(self, destino, politica=None):
+        self.destino = destino
+        self.politica = politica or PoliticaReintento()
+        self.intentos = 0
+        self.proximo_intento = 0.0
+        self.caida_desde = None
+
+
+        etiquetas = {'destino': destino}
+        self.metrica_conexion = REGISTRO.histograma('scada_conexion_segundos',
+                                                    "Duración de cada conexión exitosa", etiquetas)
+        self.metrica_corte = REGISTRO.histograma('scada_corte_segundos',
+                                                 "Duración de cada corte hasta reconectar",
+                                                 etiquetas, LIMITES_CORTE)
+        self.metrica_fallos = REGISTRO.contador('scada_conexiones_fallidas_total',
+                                                "Intentos de conexión fallidos", etiquetas)
+
+
+    def puede_intentar(self):
+        return time.monotonic() >= self.proximo_intento
+
+
+    def espera(self):
+        return max(0.0, self.proximo_intento - time.monotonic())
+
+
+    def conectada(self, duracion):
+        self.metrica_conexion.observar(duracion)
+        if self.caida_desde is not None:
+            corte = time.monotonic() - self.caida_desde
+            self.metrica_corte.observar(corte)
+            logging.info("Conexión con %s restablecida tras %.1f s (%d intentos)",
+                         self.destino, corte, self.intentos)
+        self.intentos = 0
+        self.caida_desde = None
+
+
+    def fallo(self, error):
+        # Solo se registra el comienzo del corte; los reintentos no repiten el log
+        if self.caida_desde is None:
+            self.caida_desde = time.monotonic()
+            logging.warning("Conexión con %s perdida: %s", self.destino, error)
+        self.metrica_fallos.incrementar()
+        self.intentos += 1
+        self.proximo_intento = time.monotonic() + self.politica.espera(self.intentos)
+
+
+class SesionModbus:
+    # Una sesión por equipo compartida por todos los sondeos del proceso: un reinicio del
+    # PLC cuesta una sola reconexión, no una por cada hilo que lo consulta
+    sesiones = {}
+    bloqueo_sesiones = threading.Lock()
+
+
+    @classmethod
+    def compartida(cls, host, port=502, timeout=1.0):
+        with cls.bloqueo_sesiones:
+            clave = (host, port)
+            if clave not in cls.sesiones:
+                cls.sesiones[clave] = cls(host, port, timeout)
+            sesion = cls.sesiones[clave]
+            sesion.referencias += 1
+            return sesion
+
+
+    def __init__(self, host, port=502, timeout=1.0, politica=None):
+        # pymodbus se importa con la primera sesión: el motor asíncrono y el panel
+        # alimentado por gateway no lo necesitan
+        from pymodbus.client.sync import ModbusTcpClient
+        from pymodbus.exceptions import ConnectionException
+        self.client = ModbusTcpClient(host, port=port, timeout=timeout)
+        self.errores_conexion = (ConnectionException, OSError)
+        self.estado = EstadoConexion(f"{host}:{port}", politica)
+        self.bloqueo = threading.Lock()
+        self.referencias = 0
+
+
+    def conectado(self):
+        return self.client.socket is not None
+
+
+    def asegurar(self):
+        # Durante el backoff se falla de inmediato en lugar de intentar otra conexión
+        if self.conectado():
+            return True
+        if not self.estado.puede_intentar():
+            return False
+
+
+        inicio = time.perf_counter()
+        if not self.client.connect():
+            self.estado.fallo("no se pudo conectar")
+            return False
+        configurar_socket(self.client.socket)
+        self.estado.conectada(time.perf_counter() - inicio)
+        return True
+
+
+    def conectar(self):
+        with self.bloqueo:
+            return self.asegurar()
+
+
+    def ejecutar(self, funcion):
+        # funcion(cliente) hace las peticiones; un error de E/S descarta el socket, porque
+        # una respuesta tardía desordenaría las transacciones siguientes
+        with self.bloqueo:
+            if not self.asegurar():
+                raise ConnectionError(f"Sin conexión con {self.estado.destino} "
+                                      f"(reintento en {self.estado.espera():.1f} s)")
+            try:
+                return funcion(self.client)
+            except self.errores_conexion as e:
+                self.client.close()
+                self.estado.fallo(e)
+                raise ConnectionError(f"Conexión con {self.estado.destino} interrumpida: {e}") from e
+
+
+    def liberar(self):
+        with SesionModbus.bloqueo_sesiones:
+            self.referencias -= 1
+            if self.referencias > 0:
+                return
+            SesionModbus.sesiones = {clave: sesion for clave, sesion in SesionModbus.sesiones.items()
+                                     if sesion is not self}
+        with self.bloqueo:
+            self.client.close()
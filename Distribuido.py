@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import socket
+import threading
+import time
+from multiprocessing import shared_memory
+
+
+import numpy as np
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
+from pymodbus.datastore.store import BaseModbusDataBlock
+from Bitacora import configurar_registro
+from Metricas import servir_http, volcar_periodicamente
+from Server import FUNCIONES_LECTURA, MAX_CACHE, ServidorModbus, SimuladorProceso, tamano_imagen
+
+
+# Intentos de un lector antes de dar por perdida una escritura a medias. Entre intentos cede
+# la CPU y luego espera cada vez más (hasta 1 ms): unos 1 s en total
+MAX_REINTENTOS_LECTURA = 1000
+
+
+# Espera máxima por el bloqueo de escritura de una unidad. Una escritura dura microsegundos:
+# un bloqueo que no se libera en este plazo lo dejó tomado un trabajador que murió
+TIMEOUT_BLOQUEO = 1.0
+
+
+class ImagenCompartida:
+    # Imagen de registros de todas las unidades en memoria compartida entre procesos.
+    # Cada unidad tiene un contador de secuencia (seqlock): el escritor lo deja impar mientras
+    # escribe y par al terminar, y el lector repite la copia si cambió en medio. Así los
+    # lectores de cualquier proceso nunca bloquean y siempre ven una publicación completa
+    def __init__(self, unidades, tamano, nombre=None):
+        self.unidades = unidades
+        self.tamano = tamano
+        bytes_secuencia = 8 * unidades
+        total = bytes_secuencia + 2 * unidades * tamano
+        self.memoria = shared_memory.SharedMemory(name=nombre, create=nombre is None, size=total)
+        self.nombre = self.memoria.name
+        self.secuencia = np.ndarray(unidades, dtype=np.uint64, buffer=self.memoria.buf)
+        self.registros = np.ndarray((unidades, tamano), dtype=np.uint16, buffer=self.memoria.buf,
+                                    offset=bytes_secuencia)
+
+
+    def version(self, fila):
+        return int(self.secuencia[fila])
+
+
+    def escribir(self, fila, inicio, valores, bloqueo):
+        # Un solo escritor por unidad a la vez (bloqueo entre procesos). Sin esperar indefinidamente:
+        # si el dueño murió, la escritura falla hasta que el supervisor libera el bloqueo.
+        # Se fuerza el valor impar por si un escritor anterior murió a mitad de escritura
+        if not bloqueo.acquire(timeout=TIMEOUT_BLOQUEO):
+            raise TimeoutError(f"El bloqueo de la unidad {fila + 1} no se liberó")
+        try:
+            self.secuencia[fila] |= np.uint64(1)
+            self.registros[fila, inicio:inicio + len(valores)] = valores
+            self.secuencia[fila] += np.uint64(1)
+        finally:
+            bloqueo.release()
+
+
+    def leer(self, fila, inicio, cantidad):
+        for intento in range(MAX_REINTENTOS_LECTURA):
+            antes = int(self.secuencia[fila])
+            if not antes & 1:
+                valores = self.registros[fila, inicio:inicio + cantidad].copy()
+                if int(self.secuencia[fila]) == antes:
+                    return valores
+            # El escritor puede estar en otro proceso en la misma CPU: sin espera no avanzaría
+            time.sleep(min(0.00001 * intento, 0.001))
+        raise TimeoutError(f"La unidad {fila + 1} no terminó de publicarse")
+
+
+    def cerrar(self):
+        # Las vistas NumPy sobre el buffer deben soltarse antes de cerrarlo
+        self.secuencia = None
+        self.registros = None
+        self.memoria.close()
+
+
+    def eliminar(self):
+        self.memoria.unlink()
+
+
+class BloqueCompartido(BaseModbusDataBlock):
+    # Holding registers de una unidad leídos de la imagen compartida, con la misma
+    # numeración que ModbusSequentialDataBlock(0, ...): la dirección 1 es el registro 0
+    def __init__(self, imagen, fila, bloqueo):
+        self.imagen = imagen
+        self.fila = fila
+        self.bloqueo = bloqueo
+        self.default_value = 0
+
+
+    def validate(self, address, count=1):
+        return 1 <= address and address - 1 + count <= self.imagen.tamano
+
+
+    def getValues(self, address, count=1):
+        return self.imagen.leer(self.fila, address - 1, count).tolist()
+
+
+    def setValues(self, address, values):
+        if not isinstance(values, list):
+            values = [values]
+        self.imagen.escribir(self.fila, address - 1, values, self.bloqueo)
+
+
+class ServidorFragmento(ServidorModbus):
+    # Proceso trabajador: simula sus unidades en una sola pasada NumPy, las publica en la
+    # imagen compartida y atiende peticiones para cualquier unidad
+    def __init__(self, indice, propias, definiciones, imagen, bloqueos, host='localhost', port=502,
+                 max_conexiones=10000, semilla=None, **kwargs):
+        self.indice = indice
+        self.propias = list(propias)
+
+
+        # Las etiquetas de todas las unidades propias en un único simulador
+        simulador = SimuladorProceso([dict(definicion, nombre=f"{definicion['nombre']}@{unidad}")
+                                      for unidad in self.propias for definicion in definiciones],
+                                     None if semilla is None else semilla + indice)
+        super().__init__(host, port, 'asyncio', max_conexiones, simulador, **kwargs)
+
+
+        self.compartida = imagen
+        self.bloqueos = bloqueos
+        self.direcciones_unidad = np.array([int(definicion['direccion']) for definicion in definiciones])
+        self.imagenes = np.zeros((len(self.propias), imagen.tamano), dtype=np.uint16)
+        self.ticks = np.zeros(len(self.propias), dtype=np.int64)
+        if self.propias:
+            self.imagen = self.imagenes[0]
+
+
+        # Contexto de pymodbus sobre la imagen compartida; los demás tipos de dato son mínimos
+        # para no reservar 65536 registros por unidad
+        esclavos = {}
+        for fila in range(imagen.unidades):
+            esclavos[fila + 1] = ModbusSlaveContext(
+                hr=BloqueCompartido(imagen, fila, bloqueos[fila]),
+                di=ModbusSequentialDataBlock(0, [0]), co=ModbusSequentialDataBlock(0, [0]),
+                ir=ModbusSequentialDataBlock(0, [0]))
+        self.context = ModbusServerContext(slaves=esclavos, single=False)
+
+
+    def publicar(self, registros, cambios):
+        # Solo las unidades con algún cambio avanzan su tick y se copian a la memoria compartida
+        registros = registros.reshape(len(self.propias), -1)
+        cambios = cambios.reshape(len(self.propias), -1)
+        filas = np.flatnonzero(cambios.any(axis=1))
+
+
+        bloque = self.imagenes[:, self.direcciones_unidad]
+        np.copyto(bloque, registros, where=cambios)
+        self.imagenes[:, self.direcciones_unidad] = bloque
+        self.ticks[filas] = self.ticks[filas] % 0xFFFF + 1
+        self.imagenes[filas, self.registro_tick] = self.ticks[filas]
+
+
+        for fila in filas:
+            unidad = self.propias[fila] - 1
+            try:
+                self.compartida.escribir(unidad, 0, self.imagenes[fila], self.bloqueos[unidad])
+            except TimeoutError as e:
+                # La unidad conserva su última imagen; se publica de nuevo en el siguiente cambio
+                self.limitador.registrar(logging.ERROR, ('bloqueo', unidad), "%s", e)
+        self.tick_publicado += 1
+
+
+    def procesar(self, unidad, pdu):
+        # Cada entrada de la caché guarda la versión de su unidad: cualquier publicación o
+        # escritura, venga del proceso que venga, la invalida
+        if not 1 <= unidad <= self.compartida.unidades:
+            return self.ejecutar(unidad, pdu)
+
+
+        version = self.compartida.version(unidad - 1)
+        lectura = pdu[0] in FUNCIONES_LECTURA
+        clave = (unidad, pdu)
+        if lectura:
+            entrada = self.cache.get(clave)
+            if entrada is not None and entrada[0] == version:
+                self.contadores['cache_aciertos'] += 1
+                return entrada[1]
+            self.contadores['cache_fallos'] += 1
+
+
+        respuesta = self.ejecutar(unidad, pdu)
+        if lectura and not respuesta[0] & 0x80 and (clave in self.cache or len(self.cache) < MAX_CACHE):
+            self.cache[clave] = (version, respuesta)
+        return respuesta
+
+
+    def iniciar(self):
+        if self.propias:
+            hilo = threading.Thread(target=self.actualizar_datos, daemon=True)
+            hilo.start()
+
+
+        logging.info("Trabajador %d: unidades %s en %s:%d", self.indice,
+                     rango_unidades(self.propias), self.host, self.port)
+        try:
+            asyncio.run(self.servir())
+        except KeyboardInterrupt:
+            pass
+
+
+def rango_unidades(unidades):
+    if not unidades:
+        return "ninguna (solo atiende peticiones)"
+    if len(unidades) > 2 and unidades == list(range(unidades[0], unidades[-1] + 1)):
+        return f"{unidades[0]}-{unidades[-1]}"
+    return ",".join(str(unidad) for unidad in unidades)
+
+
+def proceso_trabajador(indice, propias, definiciones, nombre_imagen, unidades, tamano, bloqueos,
+                       opciones):
+    configurar_registro(formato='%(asctime)s - %(processName)s - %(message)s', datefmt=None)
+    imagen = ImagenCompartida(unidades, tamano, nombre_imagen)
+    if opciones.get('metricas'):
+        servir_http(opciones['metricas'] + indice)
+    if opciones.get('metricas_archivo'):
+        # Cada trabajador tiene su propio registro: un archivo por proceso, como un puerto por proceso
+        volcar_periodicamente(f"{opciones['metricas_archivo']}.{indice}", opciones['metricas_intervalo'])
+
+
+    servidor = ServidorFragmento(indice, propias, definiciones, imagen, bloqueos,
+                                 opciones['host'], opciones['port'], opciones['max_conexiones'],
+                                 opciones['semilla'], registro_tick=opciones['registro_tick'],
+                                 periodo=opciones['periodo'], max_silencio=opciones['max_silencio'],
+                                 intervalo_log=opciones['intervalo_log'])
+    servidor.reutilizar_puerto = opciones['reutilizar_puerto']
+    try:
+        servidor.iniciar()
+    finally:
+        imagen.cerrar()
+
+
+def liberar_bloqueos(bloqueos, espera=TIMEOUT_BLOQUEO):
+    # Un trabajador que muere con el bloqueo de una unidad tomado lo dejaría tomado para siempre.
+    # El supervisor lo libera al reiniciarlo: un bloqueo que no se puede tomar en el plazo de
+    # los escritores es huérfano (un multiprocessing.Lock lo puede liberar cualquier proceso)
+    for unidad, bloqueo in enumerate(bloqueos):
+        if not bloqueo.acquire(timeout=espera):
+            logging.warning("Bloqueo de la unidad %d huérfano: liberado", unidad + 1)
+        bloqueo.release()
+
+
+def iniciar_supervisor(definiciones, procesos, unidades, host='localhost', port=502, puertos_separados=False,
+                       **opciones):
+    # Las unidades 1..N se reparten entre los procesos (cada uno simula las suyas) y todos
+    # escuchan el mismo puerto con SO_REUSEPORT; el núcleo reparte las conexiones entre ellos.
+    # Sin SO_REUSEPORT (o con puertos_separados) el proceso k escucha en port + k
+    reutilizar = hasattr(socket, 'SO_REUSEPORT') and not puertos_separados
+    registro_tick = opciones['registro_tick']
+    tamano = tamano_imagen(np.array([int(definicion['direccion']) for definicion in definiciones]),
+                           registro_tick)
+    imagen = ImagenCompartida(unidades, tamano)
+    bloqueos = [multiprocessing.Lock() for _ in range(unidades)]
+    reparto = [list(range(1, unidades + 1))[k::procesos] for k in range(procesos)]
+
+
+    def crear(indice):
+        configuracion = dict(opciones, host=host, port=port if reutilizar else port + indice,
+                             reutilizar_puerto=reutilizar or None)
+        proceso = multiprocessing.Process(target=proceso_trabajador, name=f"trabajador-{indice}",
+                                          args=(indice, reparto[indice], definiciones, imagen.nombre,
+                                                unidades, tamano, bloqueos, configuracion))
+        proceso.start()
+        return proceso
+
+
+    logging.info("Supervisor: %d unidades en %d procesos (%s)", unidades, procesos,
+                 f"SO_REUSEPORT en el puerto {port}" if reutilizar else f"puertos {port}-{port + procesos - 1}")
+    trabajadores = [crear(indice) for indice in range(procesos)]
+
+
+    # SIGTERM detiene el supervisor igual que Ctrl+C: termina los trabajadores y libera la memoria
+    def terminar(senal, marco):
+        raise KeyboardInterrupt
+
+
+    signal.signal(signal.SIGTERM, terminar)
+    try:
+        # Un trabajador caído se reinicia; sus unidades conservan la última imagen publicada
+        while True:
+            time.sleep(1.0)
+            for indice, proceso in enumerate(trabajadores):
+                if not proceso.is_alive():
+                    logging.error("Trabajador %d terminó (código %s); reiniciando", indice, proceso.exitcode)
+                    liberar_bloqueos(bloqueos)
+                    trabajadores[indice] = crear(indice)
+    except KeyboardInterrupt:
+        logging.info("Deteniendo trabajadores...")
+    finally:
+        # Ctrl+C llega también a los trabajadores; un segundo aviso no debe dejar la memoria
+        # compartida sin liberar
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for proceso in trabajadores:
+            proceso.terminate()
+        for proceso in trabajadores:
+            proceso.join(timeout=5)
+        imagen.cerrar()
+        imagen.eliminar()
@@ -0,0 +1,418 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import socket
+import struct
+import time
+
+
+import numpy as np
+from Adquisicion import ETIQUETAS, Dispositivo, MotorAdquisicion, cargar_etiquetas
+from Bitacora import LimitadorLog, configurar_registro
+from Conexion import EstadoConexion
+from Metricas import REGISTRO, agregar_argumentos, iniciar_exportacion
+from Protocolo import REGISTRO_TICK
+from Tendencias import MAX_SILENCIO, DetectorCambios
+
+
+# Tipos de trama: la instantánea lleva todas las etiquetas del equipo, el delta solo las que cambiaron
+INSTANTANEA = 'instantanea'
+DELTA = 'delta'
+
+
+# Bytes pendientes de enviar a un suscriptor antes de darlo por lento y desconectarlo;
+# al reconectar recibe una instantánea nueva
+LIMITE_PENDIENTE = 1 << 20
+
+
+# Apretón de manos WebSocket (RFC 6455)
+GUID_WEBSOCKET = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+ESCUCHA_POR_DEFECTO = 'tcp:127.0.0.1:5030'
+
+
+def a_json(valor):
+    # JSON no admite NaN: una etiqueta sin valor viaja como null
+    return None if math.isnan(valor) else valor
+
+
+class PublicadorDeltas:
+    # Estado publicado de un equipo y su secuencia de tramas. El estado se actualiza solo con
+    # lo que se envía, así instantánea + deltas reproducen exactamente lo que ve un suscriptor
+    def __init__(self, nombre, etiquetas, max_silencio=MAX_SILENCIO):
+        self.nombre = nombre
+        self.columnas = [etiqueta.nombre for etiqueta in etiquetas]
+        self.detector = DetectorCambios([etiqueta.banda_muerta for etiqueta in etiquetas], max_silencio)
+        self.valores = {}
+        self.marca_tiempo = None
+        self.secuencia = 0
+
+
+    def trama(self, tipo, valores):
+        return json.dumps({'tipo': tipo, 'dispositivo': self.nombre, 'seq': self.secuencia,
+                           't': self.marca_tiempo, 'valores': valores},
+                          ensure_ascii=False).encode('utf-8')
+
+
+    def muestra(self, valores, marca_tiempo):
+        # Trama delta con las etiquetas fuera de su banda muerta, o None si no cambió ninguna
+        vector = np.fromiter((valores.get(columna, np.nan) for columna in self.columnas), float,
+                             len(self.columnas))
+        cambios = np.flatnonzero(self.detector.cambios(vector, marca_tiempo))
+        if not len(cambios):
+            return None
+
+
+        delta = {self.columnas[i]: a_json(float(vector[i])) for i in cambios}
+        self.valores.update(delta)
+        self.marca_tiempo = marca_tiempo
+        self.secuencia += 1
+        return self.trama(DELTA, delta)
+
+
+    def instantanea(self):
+        if self.marca_tiempo is None:
+            return None
+        return self.trama(INSTANTANEA, self.valores)
+
+
+def trama_websocket(datos):
+    # Trama de texto final, sin máscara (el servidor nunca enmascara)
+    longitud = len(datos)
+    if longitud < 126:
+        cabecera = struct.pack('>BB', 0x81, longitud)
+    elif longitud < 1 << 16:
+        cabecera = struct.pack('>BBH', 0x81, 126, longitud)
+    else:
+        cabecera = struct.pack('>BBQ', 0x81, 127, longitud)
+    return cabecera + datos
+
+
+class Suscriptor:
+    def __init__(self, writer, origen, websocket=False):
+        self.writer = writer
+        self.origen = origen
+        self.websocket = websocket
+
+
+class Gateway:
+    # Un solo sondeo por equipo (MotorAdquisicion) y cualquier número de suscriptores: cada
+    # trama se codifica una vez y se copia a todos, así la carga del equipo no depende de
+    # cuántos paneles lo miran
+    def __init__(self, dispositivos, escuchas=(ESCUCHA_POR_DEFECTO,), timeout=1.0, max_en_vuelo=1,
+                 registro_tick=REGISTRO_TICK, max_silencio=MAX_SILENCIO, limite_pendiente=LIMITE_PENDIENTE):
+        self.dispositivos = dispositivos
+        self.escuchas = list(escuchas)
+        self.limite_pendiente = limite_pendiente
+        self.publicadores = {dispositivo.nombre: PublicadorDeltas(dispositivo.nombre, dispositivo.etiquetas,
+                                                                  max_silencio)
+                             for dispositivo in dispositivos}
+        self.motor = MotorAdquisicion(dispositivos, self.publicar, timeout=timeout,
+                                      max_en_vuelo=max_en_vuelo, registro_tick=registro_tick)
+        self.suscriptores = set()
+        self.limitador = LimitadorLog()
+
+
+        self.contadores = {'tramas': 0, 'bytes': 0, 'descartados': 0}
+        REGISTRO.exponer('gateway_suscriptores', "Suscriptores conectados", lambda: len(self.suscriptores))
+        REGISTRO.exponer('gateway_tramas_total', "Tramas publicadas (instantáneas y deltas)",
+                         lambda: self.contadores['tramas'], tipo='counter')
+        REGISTRO.exponer('gateway_bytes_total', "Bytes enviados a los suscriptores",
+                         lambda: self.contadores['bytes'], tipo='counter')
+        REGISTRO.exponer('gateway_suscriptores_descartados_total', "Suscriptores desconectados por lentos",
+                         lambda: self.contadores['descartados'], tipo='counter')
+
+
+    def publicar(self, dispositivo, valores, marca_tiempo):
+        # Lo llama el motor dentro del bucle asyncio, el mismo hilo que atiende a los suscriptores
+        datos = self.publicadores[dispositivo.nombre].muestra(valores, marca_tiempo)
+        if datos is None:
+            return
+        self.contadores['tramas'] += 1
+        linea = datos + b'\n'
+        websocket = None
+        for suscriptor in list(self.suscriptores):
+            if suscriptor.websocket:
+                websocket = websocket or trama_websocket(datos)
+                self.enviar(suscriptor, websocket)
+            else:
+                self.enviar(suscriptor, linea)
+
+
+    def enviar(self, suscriptor, datos):
+        transporte = suscriptor.writer.transport
+        if transporte.is_closing():
+            self.suscriptores.discard(suscriptor)
+            return
+        if transporte.get_write_buffer_size() > self.limite_pendiente:
+            # Un suscriptor que no lee no frena a los demás ni hace crecer la memoria
+            self.contadores['descartados'] += 1
+            self.limitador.registrar(logging.WARNING, 'lento', "Suscriptor %s desconectado: no lee sus tramas",
+                                     suscriptor.origen)
+            self.suscriptores.discard(suscriptor)
+            transporte.abort()
+            return
+        suscriptor.writer.write(datos)
+        self.contadores['bytes'] += len(datos)
+
+
+    def suscribir(self, suscriptor):
+        # La instantánea se escribe antes de agregarlo: ningún delta puede adelantarse
+        for publicador in self.publicadores.values():
+            datos = publicador.instantanea()
+            if datos is not None:
+                self.enviar(suscriptor, trama_websocket(datos) if suscriptor.websocket else datos + b'\n')
+        self.suscriptores.add(suscriptor)
+        logging.info("Suscriptor %s conectado (%d en total)", suscriptor.origen, len(self.suscriptores))
+
+
+    async def atender(self, reader, writer, websocket=False):
+        origen = writer.get_extra_info('peername') or 'unix'
+        if isinstance(origen, tuple):
+            origen = f"{origen[0]}:{origen[1]}"
+        suscriptor = None
+        try:
+            if websocket and not await self.aceptar_websocket(reader, writer):
+                return
+            suscriptor = Suscriptor(writer, origen, websocket)
+            self.suscribir(suscriptor)
+
+
+            # Los suscriptores no envían datos: solo se espera el cierre (o la trama de cierre WebSocket)
+            while True:
+                datos = await reader.read(4096)
+                if not datos or (websocket and datos[0] & 0x0F == 0x8):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            if suscriptor in self.suscriptores:
+                self.suscriptores.discard(suscriptor)
+                logging.info("Suscriptor %s desconectado (%d en total)", origen, len(self.suscriptores))
+            writer.close()
+
+
+    async def aceptar_websocket(self, reader, writer):
+        cabecera = await reader.readuntil(b'\r\n\r\n')
+        clave = None
+        for linea in cabecera.decode('latin-1').split('\r\n')[1:]:
+            nombre, _, valor = linea.partition(':')
+            if nombre.strip().lower() == 'sec-websocket-key':
+                clave = valor.strip()
+        if clave is None:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            return False
+
+
+        aceptacion = base64.b64encode(hashlib.sha1(clave.encode('ascii') + GUID_WEBSOCKET).digest())
+        writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Accept: ' + aceptacion + b'\r\n\r\n')
+        return True
+
+
+    async def escuchar(self, especificacion):
+        # Formatos: unix:/ruta/socket, tcp:[host:]puerto, ws:[host:]puerto
+        tipo, _, destino = especificacion.partition(':')
+        if tipo == 'unix':
+            if os.path.exists(destino):
+                os.unlink(destino)
+            return await asyncio.start_unix_server(self.atender, destino)
+        if tipo not in ('tcp', 'ws'):
+            raise ValueError(f"Escucha desconocida: {especificacion}")
+
+
+        host, _, port = destino.rpartition(':')
+        websocket = tipo == 'ws'
+
+
+        async def atender(reader, writer):
+            await self.atender(reader, writer, websocket)
+
+
+        servidor = await asyncio.start_server(atender, host or '127.0.0.1', int(port))
+        for sock in servidor.sockets:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return servidor
+
+
+    async def ejecutar(self):
+        servidores = [await self.escuchar(especificacion) for especificacion in self.escuchas]
+        logging.info("Gateway: %d equipos, suscriptores en %s", len(self.dispositivos), ', '.join(self.escuchas))
+        try:
+            await self.motor.ejecutar()
+        finally:
+            for servidor in servidores:
+                servidor.close()
+            for especificacion in self.escuchas:
+                tipo, _, destino = especificacion.partition(':')
+                if tipo == 'unix' and os.path.exists(destino):
+                    os.unlink(destino)
+
+
+    def iniciar(self):
+        try:
+            asyncio.run(self.ejecutar())
+        except KeyboardInterrupt:
+            logging.info("Gateway detenido. Contadores: %s", self.contadores)
+
+
+class SuscriptorGateway:
+    # Lado del panel: recibe la instantánea y los deltas de un equipo y entrega el estado
+    # completo tras cada trama. Se reconecta con el mismo backoff que las sesiones Modbus
+    def __init__(self, especificacion, dispositivo=None, timeout=1.0):
+        self.especificacion = especificacion
+        self.dispositivo = dispositivo
+        self.timeout = timeout
+        self.estado = EstadoConexion(f"gateway {especificacion}")
+        self.socket = None
+        self.pendiente = b''
+        self.valores = {}
+        self.ultima_marca = None
+        self.limitador = LimitadorLog()
+
+
+    def conectar(self):
+        tipo, _, destino = self.especificacion.partition(':')
+        if tipo == 'unix':
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            direccion = destino
+        elif tipo == 'tcp':
+            host, _, port = destino.rpartition(':')
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            direccion = (host or '127.0.0.1', int(port))
+        else:
+            raise ValueError(f"Gateway desconocido: {self.especificacion} (unix:/ruta o tcp:host:puerto)")
+
+
+        inicio = time.perf_counter()
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(direccion)
+        except OSError:
+            sock.close()
+            raise
+        self.socket = sock
+        self.pendiente = b''
+        self.estado.conectada(time.perf_counter() - inicio)
+
+
+    def cerrar(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+    def lineas(self):
+        try:
+            datos = self.socket.recv(65536)
+        except socket.timeout:
+            return []
+        if not datos:
+            raise ConnectionError("el gateway cerró la conexión")
+        *lineas, self.pendiente = (self.pendiente + datos).split(b'\n')
+        return lineas
+
+
+    def aplicar(self, trama):
+        # La primera trama de cada conexión es la instantánea: reemplaza el estado anterior
+        if trama['tipo'] == INSTANTANEA:
+            self.valores = {}
+        self.valores.update({nombre: np.nan if valor is None else valor
+                             for nombre, valor in trama['valores'].items()})
+
+
+    def muestras(self, detener):
+        # (marca_tiempo, valores) del equipo elegido (o del primero que llegue) hasta que se active detener
+        while not detener.is_set():
+            if self.socket is None:
+                if not self.estado.puede_intentar():
+                    detener.wait(min(self.estado.espera(), 1.0))
+                    continue
+                try:
+                    self.conectar()
+                except OSError as e:
+                    self.estado.fallo(e)
+                    continue
+
+
+            try:
+                lineas = self.lineas()
+            except (ConnectionError, OSError) as e:
+                self.cerrar()
+                self.estado.fallo(e)
+                continue
+
+
+            for linea in lineas:
+                try:
+                    trama = json.loads(linea)
+                    if self.dispositivo is None:
+                        self.dispositivo = trama['dispositivo']
+                    if trama['dispositivo'] != self.dispositivo:
+                        continue
+                    marca_tiempo = float(trama['t'])
+                    self.aplicar(trama)
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    # Una línea corrupta se descarta sin detener la adquisición del panel
+                    self.limitador.registrar(logging.WARNING, 'trama', "Trama del gateway descartada (%r): %s",
+                                             linea[:80], e)
+                    continue
+
+
+                # Tras una reconexión la instantánea repite la última muestra ya entregada:
+                # actualiza el estado, pero solo se entregan marcas de tiempo crecientes
+                if self.ultima_marca is not None and marca_tiempo <= self.ultima_marca:
+                    continue
+                self.ultima_marca = marca_tiempo
+                yield marca_tiempo, dict(self.valores)
+        self.cerrar()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gateway: un sondeo por equipo, tramas delta para muchos suscriptores")
+    parser.add_argument('--host', default='localhost', help="servidor Modbus (sin --dispositivo)")
+    parser.add_argument('--port', type=int, default=502, help="puerto Modbus (sin --dispositivo)")
+    parser.add_argument('--unidad', type=int, default=1, help="unidad Modbus (sin --dispositivo)")
+    parser.add_argument('--dispositivo', action='append', default=[],
+                        help="nombre=host:puerto/unidad (se puede repetir)")
+    parser.add_argument('--etiquetas', help="archivo JSON con el mapa de etiquetas")
+    parser.add_argument('--escuchar', action='append', default=[],
+                        help=f"unix:/ruta/socket, tcp:[host:]puerto o ws:[host:]puerto para WebSocket "
+                             f"(se puede repetir; por defecto {ESCUCHA_POR_DEFECTO})")
+    parser.add_argument('--max-silencio', type=float, default=MAX_SILENCIO,
+                        help="segundos máximos sin reenviar una etiqueta dentro de su banda muerta")
+    parser.add_argument('--periodo', type=float, default=1.0, help="periodo de sondeo en segundos")
+    parser.add_argument('--timeout', type=float, default=1.0, help="timeout por petición en segundos")
+    parser.add_argument('--max-en-vuelo', type=int, default=1, help="peticiones simultáneas por equipo")
+    parser.add_argument('--registro-tick', type=int, default=REGISTRO_TICK,
+                        help="registro con el contador de ticks del servidor")
+    parser.add_argument('--sin-tick', action='store_true',
+                        help="no leer el tick (servidores que no lo publican)")
+    agregar_argumentos(parser)
+    args = parser.parse_args(argv)
+    iniciar_exportacion(args)
+
+
+    etiquetas = cargar_etiquetas(args.etiquetas) if args.etiquetas else ETIQUETAS
+    if args.dispositivo:
+        dispositivos = [Dispositivo.desde_texto(texto, etiquetas=etiquetas, periodo=args.periodo)
+                        for texto in args.dispositivo]
+    else:
+        dispositivos = [Dispositivo(f"{args.host}:{args.port}/{args.unidad}", args.host, args.port,
+                                    args.unidad, etiquetas, args.periodo)]
+
+
+    gateway = Gateway(dispositivos, args.escuchar or [ESCUCHA_POR_DEFECTO], args.timeout, args.max_en_vuelo,
+                      None if args.sin_tick else args.registro_tick, args.max_silencio)
+    gateway.iniciar()
+
+
+if __name__ == "__main__":
+    configurar_registro()
+    main()
@@ -0,0 +1,292 @@
+import argparse
+import bisect
+import glob
+import json
+import logging
+import math
+import os
+from datetime import datetime
+
+
+import numpy as np
+
+
+# Cabecera fija de cada segmento; el resto del bloque guarda los nombres de columna en JSON.
+# El bloque ocupa TAM_CABECERA bytes o el múltiplo que haga falta si hay muchas columnas
+CABECERA = np.dtype([
+    ('magico', 'S4'),
+    ('version', '<u4'),
+    ('columnas', '<u4'),
+    ('tam_cabecera', '<u4'),
+    ('capacidad', '<u8'),
+    ('cantidad', '<u8'),
+    ('t0', '<f8'),
+    ('duracion', '<f8'),
+])
+TAM_CABECERA = 4096
+MAGICO = b'HIST'
+
+
+class Segmento:
+    # Archivo de ancho fijo: columna de tiempos (f8) seguida de una columna f4 por etiqueta
+    def __init__(self, ruta, modo='r'):
+        self.ruta = ruta
+        self.mapa = np.memmap(ruta, dtype=np.uint8, mode=modo)
+        self.cabecera = np.ndarray((), dtype=CABECERA, buffer=self.mapa, offset=0)
+        if bytes(self.cabecera['magico']) != MAGICO:
+            raise ValueError(f"{ruta} no es un segmento del historiador")
+
+
+        tam_cabecera = int(self.cabecera['tam_cabecera'])
+        if tam_cabecera < CABECERA.itemsize:
+            raise ValueError(f"{ruta}: tamaño de cabecera inválido ({tam_cabecera})")
+        nombres = bytes(self.mapa[CABECERA.itemsize:tam_cabecera]).rstrip(b'\0')
+        self.nombres = json.loads(nombres.decode('utf-8'))
+        self.capacidad = int(self.cabecera['capacidad'])
+        self.t0 = float(self.cabecera['t0'])
+        self.duracion = float(self.cabecera['duracion'])
+
+
+        inicio = tam_cabecera
+        self.tiempos = self.mapa[inicio:inicio + 8 * self.capacidad].view('<f8')
+        inicio += 8 * self.capacidad
+        self.columnas = {}
+        for nombre in self.nombres:
+            self.columnas[nombre] = self.mapa[inicio:inicio + 4 * self.capacidad].view('<f4')
+            inicio += 4 * self.capacidad
+
+
+    @classmethod
+    def crear(cls, ruta, nombres, capacidad, t0, duracion):
+        nombres_json = json.dumps(nombres).encode('utf-8')
+        tam_cabecera = -(-(CABECERA.itemsize + len(nombres_json)) // TAM_CABECERA) * TAM_CABECERA
+
+
+        # El archivo se reserva completo (disperso en disco hasta que se escribe) y se
+        # publica con un rename atómico para que ningún lector vea un segmento a medias
+        tamano = tam_cabecera + capacidad * (8 + 4 * len(nombres))
+        temporal = ruta + '.tmp'
+        with open(temporal, 'wb') as archivo:
+            cabecera = np.zeros((), dtype=CABECERA)
+            cabecera['magico'] = MAGICO
+            cabecera['version'] = 1
+            cabecera['columnas'] = len(nombres)
+            cabecera['tam_cabecera'] = tam_cabecera
+            cabecera['capacidad'] = capacidad
+            cabecera['t0'] = t0
+            cabecera['duracion'] = duracion
+            archivo.write(cabecera.tobytes())
+            archivo.write(nombres_json)
+            archivo.truncate(tamano)
+        os.replace(temporal, ruta)
+        return cls(ruta, 'r+')
+
+
+    def cantidad(self):
+        return int(self.cabecera['cantidad'])
+
+
+    def lleno(self):
+        return self.cantidad() >= self.capacidad
+
+
+    def agregar(self, marca_tiempo, valores):
+        i = self.cantidad()
+        self.tiempos[i] = marca_tiempo
+        for nombre, columna in self.columnas.items():
+            columna[i] = valores.get(nombre, math.nan)
+
+
+        # La cantidad se publica después de los datos: los lectores nunca ven filas a medias
+        self.cabecera['cantidad'] = i + 1
+
+
+    def agregar_bloque(self, marcas_tiempo, columnas):
+        i = self.cantidad()
+        cantidad = len(marcas_tiempo)
+        self.tiempos[i:i + cantidad] = marcas_tiempo
+        for nombre, columna in self.columnas.items():
+            columna[i:i + cantidad] = columnas[nombre] if nombre in columnas else math.nan
+        self.cabecera['cantidad'] = i + cantidad
+
+
+    def rango(self, t_inicio, t_fin):
+        cantidad = self.cantidad()
+        tiempos = self.tiempos[:cantidad]
+        return (int(np.searchsorted(tiempos, t_inicio, 'left')),
+                int(np.searchsorted(tiempos, t_fin, 'right')))
+
+
+    def cerrar(self):
+        # El mapa se libera cuando no quedan vistas que lo referencien
+        if self.mapa.mode == 'r+':
+            self.mapa.flush()
+
+
+def nombre_segmento(t0):
+    return f"seg_{int(t0 * 1000):016d}.dat"
+
+
+class Historiador:
+    # Escritor: admite la misma interfaz que las salidas (escribir / cerrar)
+    def __init__(self, directorio, columnas, duracion=3600.0, capacidad=36000):
+        self.directorio = directorio
+        self.columnas = list(columnas)
+        self.duracion = duracion
+        self.capacidad = capacidad
+        self.segmento = None
+        os.makedirs(directorio, exist_ok=True)
+
+
+    def abrir_segmento(self, marca_tiempo):
+        if self.segmento is not None:
+            self.segmento.cerrar()
+
+
+        # Segmentos alineados al periodo; si el del periodo ya existe (reinicio) se continúa
+        t0 = math.floor(marca_tiempo / self.duracion) * self.duracion
+        duracion = self.duracion
+        ruta = os.path.join(self.directorio, nombre_segmento(t0))
+        if os.path.exists(ruta):
+            segmento = Segmento(ruta, 'r+')
+            if segmento.nombres == self.columnas and not segmento.lleno():
+                self.segmento = segmento
+                return
+            segmento.cerrar()
+
+
+            # Columnas distintas o segmento lleno: uno nuevo que empieza en esta muestra y
+            # termina en el límite del periodo, así nunca se solapa con el siguiente alineado
+            duracion = t0 + self.duracion - marca_tiempo
+            t0 = marca_tiempo
+            ruta = os.path.join(self.directorio, nombre_segmento(t0))
+
+
+        self.segmento = Segmento.crear(ruta, self.columnas, self.capacidad, t0, duracion)
+        logging.info("Historiador: nuevo segmento %s", ruta)
+
+
+    def escribir(self, marca_tiempo, valores):
+        if (self.segmento is None or self.segmento.lleno() or
+                marca_tiempo >= self.segmento.t0 + self.segmento.duracion):
+            self.abrir_segmento(marca_tiempo)
+        self.segmento.agregar(marca_tiempo, valores)
+
+
+    def escribir_bloque(self, marcas_tiempo, columnas):
+        # Carga masiva (avance rápido del simulador): un slice por columna y segmento
+        inicio = 0
+        while inicio < len(marcas_tiempo):
+            marca_tiempo = marcas_tiempo[inicio]
+            if (self.segmento is None or self.segmento.lleno() or
+                    marca_tiempo >= self.segmento.t0 + self.segmento.duracion):
+                self.abrir_segmento(marca_tiempo)
+
+
+            fin = min(int(np.searchsorted(marcas_tiempo, self.segmento.t0 + self.segmento.duracion)),
+                      inicio + self.segmento.capacidad - self.segmento.cantidad())
+            self.segmento.agregar_bloque(marcas_tiempo[inicio:fin],
+                                         {nombre: valores[inicio:fin] for nombre, valores in columnas.items()})
+            inicio = fin
+
+
+    def cerrar(self):
+        if self.segmento is not None:
+            self.segmento.cerrar()
+            self.segmento = None
+
+
+class LectorHistorico:
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self.abiertos = {}
+
+
+    def indice(self):
+        # Índice temporal: inicio de cada segmento a partir del nombre del archivo
+        rutas = sorted(glob.glob(os.path.join(self.directorio, 'seg_*.dat')))
+        inicios = [int(os.path.basename(ruta)[4:-4]) / 1000 for ruta in rutas]
+        return inicios, rutas
+
+
+    def abrir(self, ruta):
+        if ruta not in self.abiertos:
+            self.abiertos[ruta] = Segmento(ruta, 'r')
+        return self.abiertos[ruta]
+
+
+    def iterar(self, t_inicio, t_fin, columnas=None):
+        # Recorre el rango segmento a segmento con vistas sobre el mapa en memoria
+        inicios, rutas = self.indice()
+        primero = max(0, bisect.bisect_right(inicios, t_inicio) - 1)
+        for inicio, ruta in zip(inicios[primero:], rutas[primero:]):
+            if inicio > t_fin:
+                break
+
+
+            segmento = self.abrir(ruta)
+            desde, hasta = segmento.rango(t_inicio, t_fin)
+            if desde >= hasta:
+                continue
+
+
+            bloque = {'t': segmento.tiempos[desde:hasta]}
+            for nombre in columnas or segmento.nombres:
+                if nombre in segmento.columnas:
+                    bloque[nombre] = segmento.columnas[nombre][desde:hasta]
+                else:
+                    bloque[nombre] = np.full(hasta - desde, np.nan, dtype='<f4')
+            yield bloque
+
+
+    def leer(self, t_inicio, t_fin, columnas=None):
+        bloques = list(self.iterar(t_inicio, t_fin, columnas))
+        if not bloques:
+            return {'t': np.empty(0), **{nombre: np.empty(0, dtype='<f4') for nombre in columnas or []}}
+        return {nombre: np.concatenate([bloque[nombre] for bloque in bloques])
+                for nombre in bloques[0]}
+
+
+    def cerrar(self):
+        for segmento in self.abiertos.values():
+            segmento.cerrar()
+        self.abiertos.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resumen de un rango del historiador")
+    parser.add_argument('directorio')
+    parser.add_argument('--desde', help="fecha ISO de inicio (por defecto, todo)")
+    parser.add_argument('--hasta', help="fecha ISO de fin (por defecto, ahora)")
+    args = parser.parse_args(argv)
+
+
+    t_inicio = datetime.fromisoformat(args.desde).timestamp() if args.desde else 0.0
+    t_fin = datetime.fromisoformat(args.hasta).timestamp() if args.hasta else datetime.now().timestamp()
+
+
+    # Agregados incrementales: nunca se carga el rango completo en memoria
+    lector = LectorHistorico(args.directorio)
+    resumen = {}
+    for bloque in lector.iterar(t_inicio, t_fin):
+        for nombre, valores in bloque.items():
+            if nombre == 't':
+                continue
+            valores = valores[~np.isnan(valores)]
+            if not len(valores):
+                continue
+            actual = resumen.setdefault(nombre, [0, math.inf, -math.inf, 0.0])
+            actual[0] += len(valores)
+            actual[1] = min(actual[1], float(np.nanmin(valores)))
+            actual[2] = max(actual[2], float(np.nanmax(valores)))
+            actual[3] += float(np.nansum(valores))
+    lector.cerrar()
+
+
+    for nombre, (cantidad, minimo, maximo, suma) in resumen.items():
+        print(f"{nombre}: {cantidad} muestras, min {minimo:.2f}, max {maximo:.2f}, "
+              f"media {suma / cantidad:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import bisect
+import logging
+import os
+import threading
+import time
+import weakref
+
+
+# Límites por defecto de los histogramas de tiempo (segundos): de 50 µs a 10 s
+LIMITES_TIEMPO = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                  0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def formatear_etiquetas(etiquetas, extra=None):
+    pares = list(etiquetas.items()) + (list(extra.items()) if extra else [])
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{clave}="{valor}"' for clave, valor in pares) + '}'
+
+
+class MetricaPorHilo:
+    # Cada hilo acumula en su propio fragmento: el camino caliente no toma ningún bloqueo
+    # y solo el hilo dueño escribe en él. La exportación suma los fragmentos al leerlos
+    def __init__(self, nombre, ayuda, etiquetas, tamano):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.tamano = tamano
+        self.locales = threading.local()
+        self.fragmentos = []
+        self.base = [0] * tamano
+        self.bloqueo = threading.Lock()
+
+
+    def fragmento(self):
+        try:
+            return self.locales.fragmento
+        except AttributeError:
+            # Solo la primera vez en cada hilo
+            fragmento = [0] * self.tamano
+            with self.bloqueo:
+                self.depurar()
+                self.fragmentos.append((weakref.ref(threading.current_thread()), fragmento))
+            self.locales.fragmento = fragmento
+            return fragmento
+
+
+    def depurar(self):
+        # Un hilo terminado ya no escribe: su fragmento se suma a la base y se descarta, así
+        # con un hilo por conexión la lista no crece sin límite. Quien llama tiene el bloqueo
+        vivos = []
+        for referencia, fragmento in self.fragmentos:
+            hilo = referencia()
+            if hilo is not None and hilo.is_alive():
+                vivos.append((referencia, fragmento))
+                continue
+            for i, valor in enumerate(fragmento):
+                self.base[i] += valor
+        self.fragmentos = vivos
+
+
+    def sumar_fragmentos(self):
+        with self.bloqueo:
+            self.depurar()
+            fragmentos = [fragmento for _, fragmento in self.fragmentos]
+            total = list(self.base)
+        for fragmento in fragmentos:
+            for i, valor in enumerate(fragmento):
+                total[i] += valor
+        return total
+
+
+class Contador(MetricaPorHilo):
+    tipo = 'counter'
+
+
+    def __init__(self, nombre, ayuda, etiquetas):
+        super().__init__(nombre, ayuda, etiquetas, 1)
+
+
+    def incrementar(self, cantidad=1):
+        self.fragmento()[0] += cantidad
+
+
+    def muestras(self):
+        yield self.nombre, self.etiquetas, self.sumar_fragmentos()[0]
+
+
+class Histograma(MetricaPorHilo):
+    tipo = 'histogram'
+
+
+    def __init__(self, nombre, ayuda, etiquetas, limites=LIMITES_TIEMPO):
+        # Una cubeta por límite, la de +Inf y la suma de las observaciones
+        self.limites = tuple(limites)
+        super().__init__(nombre, ayuda, etiquetas, len(self.limites) + 2)
+
+
+    def observar(self, valor):
+        fragmento = self.fragmento()
+        fragmento[bisect.bisect_left(self.limites, valor)] += 1
+        fragmento[-1] += valor
+
+
+    def muestras(self):
+        total = self.sumar_fragmentos()
+        acumulado = 0
+        for limite, cantidad in zip(self.limites + ('+Inf',), total[:-1]):
+            acumulado += cantidad
+            yield self.nombre + '_bucket', dict(self.etiquetas, le=limite), acumulado
+        yield self.nombre + '_sum', self.etiquetas, total[-1]
+        yield self.nombre + '_count', self.etiquetas, acumulado
+
+
+class Funcion:
+    # Valor calculado al exportar (contadores que ya existen, conexiones activas...)
+    def __init__(self, nombre, ayuda, etiquetas, funcion, tipo='gauge'):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.funcion = funcion
+        self.tipo = tipo
+
+
+    def muestras(self):
+        yield self.nombre, self.etiquetas, self.funcion()
+
+
+class Registro:
+    def __init__(self):
+        self.metricas = {}
+        self.bloqueo = threading.Lock()
+
+
+    def obtener(self, clase, nombre, ayuda, etiquetas=None, **kwargs):
+        # Misma métrica para el mismo nombre y etiquetas: se puede pedir desde varios sitios
+        etiquetas = etiquetas or {}
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self.bloqueo:
+            if clave not in self.metricas:
+                self.metricas[clave] = clase(nombre, ayuda, etiquetas, **kwargs)
+            return self.metricas[clave]
+
+
+    def contador(self, nombre, ayuda, etiquetas=None):
+        return self.obtener(Contador, nombre, ayuda, etiquetas)
+
+
+    def histograma(self, nombre, ayuda, etiquetas=None, limites=LIMITES_TIEMPO):
+        return self.obtener(Histograma, nombre, ayuda, etiquetas, limites=limites)
+
+
+    def exponer(self, nombre, ayuda, funcion, etiquetas=None, tipo='gauge'):
+        etiquetas = etiquetas or {}
+        with self.bloqueo:
+            self.metricas[(nombre, tuple(sorted(etiquetas.items())))] = Funcion(
+                nombre, ayuda, etiquetas, funcion, tipo)
+
+
+    def texto(self):
+        # Formato de exposición de texto de Prometheus
+        with self.bloqueo:
+            metricas = sorted(self.metricas.items(), key=lambda elemento: elemento[0])
+        lineas = []
+        anterior = None
+        for (nombre, _), metrica in metricas:
+            if nombre != anterior:
+                lineas.append(f"# HELP {nombre} {metrica.ayuda}")
+                lineas.append(f"# TYPE {nombre} {metrica.tipo}")
+                anterior = nombre
+            try:
+                for serie, etiquetas, valor in metrica.muestras():
+                    lineas.append(f"{serie}{formatear_etiquetas(etiquetas)} {valor}")
+            except Exception as e:
+                logging.debug("Métrica %s no disponible: %s", nombre, e)
+        return '\n'.join(lineas) + '\n'
+
+
+# Registro del proceso: cada módulo registra aquí sus métricas
+REGISTRO = Registro()
+
+
+def servir_http(puerto, host='127.0.0.1', registro=REGISTRO):
+    # http.server se importa solo al exportar métricas: no retrasa el arranque del resto
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+    class ManejadorMetricas(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+
+
+            cuerpo = registro.texto().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+
+        def log_message(self, formato, *args):
+            pass
+
+
+    servidor = ThreadingHTTPServer((host, puerto), ManejadorMetricas)
+    servidor.daemon_threads = True
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    logging.info("Métricas en http://%s:%d/metrics", host, puerto)
+    return servidor
+
+
+def volcar_periodicamente(ruta, intervalo=10.0, registro=REGISTRO):
+    # Escritura atómica: quien lea el archivo nunca ve un volcado a medias
+    def volcar():
+        while True:
+            time.sleep(intervalo)
+            try:
+                temporal = ruta + '.tmp'
+                with open(temporal, 'w', encoding='utf-8') as archivo:
+                    archivo.write(registro.texto())
+                os.replace(temporal, ruta)
+            except OSError as e:
+                logging.error("No se pudieron volcar las métricas a %s: %s", ruta, e)
+
+
+    hilo = threading.Thread(target=volcar, daemon=True)
+    hilo.start()
+    return hilo
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--metricas', type=int, metavar='PUERTO',
+                        help="exponer métricas Prometheus en http://127.0.0.1:PUERTO/metrics")
+    parser.add_argument('--metricas-archivo', help="volcar las métricas periódicamente a este archivo")
+    parser.add_argument('--metricas-intervalo', type=float, default=10.0,
+                        help="segundos entre volcados del archivo de métricas")
+
+
+def iniciar_exportacion(args):
+    if args.metricas:
+        servir_http(args.metricas)
+    if args.metricas_archivo:
+        volcar_periodicamente(args.metricas_archivo, args.metricas_intervalo)
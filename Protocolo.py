@@ -0,0 +1,225 @@
+import json
+import struct
+import time
+
+
+from Conexion import EstadoConexion, configurar_socket
+
+
+# Cabecera MBAP: transacción, protocolo, longitud y unidad
+CABECERA = struct.Struct('>HHHB')
+LECTURA = struct.Struct('>BHH')
+
+
+# Longitud máxima del PDU según el protocolo (256 - dirección - CRC)
+MAX_PDU = 253
+
+
+# Timeouts seguidos tras los que la conexión se da por muerta aunque el socket siga abierto
+MAX_TIMEOUTS_SEGUIDOS = 3
+
+
+# Límite del protocolo Modbus para una lectura de holding registers (FC 3)
+MAX_REGISTROS_LECTURA = 125
+
+
+# Registros vacíos que se aceptan leer de más para unir dos bloques
+TOLERANCIA_HUECO = 8
+
+
+# Registro reservado donde Server.py publica el contador de ticks (0 = sin contador)
+REGISTRO_TICK = 3
+
+
+# Buffers por conexión de los servidores asyncio: una trama Modbus TCP ocupa como mucho 260 bytes
+LIMITE_LECTURA = 1024
+LIMITE_ESCRITURA = 4096
+
+
+class ErrorProtocolo(Exception):
+    pass
+
+
+class ErrorModbus(Exception):
+    def __init__(self, funcion, codigo):
+        super().__init__(f"Excepción Modbus {codigo} en función {funcion}")
+        self.funcion = funcion
+        self.codigo = codigo
+
+
+def leer_definiciones(ruta):
+    # Mapa de etiquetas en JSON, común al simulador y a los clientes. Una entrada con
+    # "cantidad" genera N etiquetas nombre_0, nombre_1... en direcciones consecutivas
+    with open(ruta, encoding='utf-8') as archivo:
+        entradas = json.load(archivo)
+
+
+    definiciones = []
+    for entrada in entradas:
+        cantidad = entrada.get('cantidad')
+        if cantidad is None:
+            definiciones.append(entrada)
+            continue
+        for i in range(int(cantidad)):
+            definiciones.append(dict(entrada, nombre=f"{entrada['nombre']}_{i}",
+                                     direccion=int(entrada['direccion']) + i))
+    return definiciones
+
+
+def construir_trama(transaccion, unidad, pdu):
+    return CABECERA.pack(transaccion, 0, len(pdu) + 1, unidad) + pdu
+
+
+async def leer_trama(reader):
+    cabecera = await reader.readexactly(CABECERA.size)
+    transaccion, protocolo, longitud, unidad = CABECERA.unpack(cabecera)
+    if protocolo != 0 or not 2 <= longitud <= MAX_PDU + 1:
+        raise ErrorProtocolo(f"Cabecera MBAP inválida (protocolo={protocolo}, longitud={longitud})")
+
+
+    pdu = await reader.readexactly(longitud - 1)
+    return transaccion, unidad, pdu
+
+
+def pdu_lectura(funcion, direccion, cantidad):
+    return LECTURA.pack(funcion, direccion, cantidad)
+
+
+def decodificar_registros(pdu):
+    if pdu[0] & 0x80:
+        raise ErrorModbus(pdu[0] & 0x7F, pdu[1])
+
+
+    cantidad = pdu[1] // 2
+    return list(struct.unpack_from(f'>{cantidad}H', pdu, 2))
+
+
+# asyncio se importa dentro del cliente asíncrono: los planificadores y el modo de sondeo
+# síncrono solo usan las constantes de este módulo y no deben cargarlo al arrancar
+class ClienteModbusAsync:
+    def __init__(self, host, port=502, timeout=1.0, max_en_vuelo=1):
+        import asyncio
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+
+        # Limita las peticiones simultáneas contra este equipo
+        self.limite = asyncio.Semaphore(max_en_vuelo)
+        self.bloqueo_conexion = asyncio.Lock()
+
+
+        self.reader = None
+        self.writer = None
+        self.tarea_recepcion = None
+        self.pendientes = {}
+        self.transaccion = 0
+
+
+        # Backoff con jitter y métricas de reconexión compartidos con las sesiones síncronas
+        self.estado = EstadoConexion(f"{host}:{port}")
+        self.timeouts_seguidos = 0
+
+
+    def conectado(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+
+    async def conectar(self):
+        import asyncio
+        async with self.bloqueo_conexion:
+            if self.conectado():
+                return
+            if not self.estado.puede_intentar():
+                raise ConnectionError(f"Sin conexión con {self.host}:{self.port} "
+                                      f"(reintento en {self.estado.espera():.1f} s)")
+
+
+            inicio = time.perf_counter()
+            try:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                self.estado.fallo(e)
+                raise ConnectionError(f"No se pudo conectar con {self.host}:{self.port}: {e!r}") from e
+
+
+            configurar_socket(self.writer.get_extra_info('socket'))
+            self.estado.conectada(time.perf_counter() - inicio)
+            self.timeouts_seguidos = 0
+            self.tarea_recepcion = asyncio.create_task(self.recibir(self.reader))
+
+
+    async def recibir(self, reader):
+        # Reparte cada respuesta a la petición que la espera según su transacción
+        import asyncio
+        try:
+            while True:
+                transaccion, _, pdu = await leer_trama(reader)
+                futuro = self.pendientes.pop(transaccion, None)
+                if futuro is not None and not futuro.done():
+                    futuro.set_result(pdu)
+        except (asyncio.IncompleteReadError, ErrorProtocolo, OSError) as e:
+            if reader is self.reader:
+                error = ConnectionError(f"Conexión perdida con {self.host}:{self.port}: {e}")
+                self.estado.fallo(error)
+                self.descartar(error)
+
+
+    def descartar(self, error):
+        for futuro in self.pendientes.values():
+            if not futuro.done():
+                futuro.set_exception(error)
+        self.pendientes.clear()
+
+
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+
+    async def ejecutar(self, unidad, pdu):
+        import asyncio
+        async with self.limite:
+            await self.conectar()
+
+
+            self.transaccion = (self.transaccion + 1) & 0xFFFF
+            transaccion = self.transaccion
+            futuro = asyncio.get_running_loop().create_future()
+            self.pendientes[transaccion] = futuro
+
+
+            try:
+                self.writer.write(construir_trama(transaccion, unidad, pdu))
+                respuesta = await asyncio.wait_for(futuro, self.timeout)
+                self.timeouts_seguidos = 0
+                return respuesta
+            except asyncio.TimeoutError:
+                # Un equipo que acepta la conexión pero ya no responde se reconecta
+                self.timeouts_seguidos += 1
+                if self.timeouts_seguidos >= MAX_TIMEOUTS_SEGUIDOS and self.writer is not None:
+                    error = ConnectionError(f"{self.host}:{self.port} no responde")
+                    self.estado.fallo(error)
+                    self.descartar(error)
+                raise
+            finally:
+                self.pendientes.pop(transaccion, None)
+
+
+    async def leer_registros(self, unidad, direccion, cantidad, funcion=3):
+        pdu = await self.ejecutar(unidad, pdu_lectura(funcion, direccion, cantidad))
+        return decodificar_registros(pdu)
+
+
+    async def cerrar(self):
+        if self.tarea_recepcion is not None:
+            self.tarea_recepcion.cancel()
+        if self.writer is not None:
+            writer = self.writer
+            self.descartar(ConnectionError("Cliente cerrado"))
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
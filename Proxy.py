@@ -0,0 +1,400 @@
+import argparse
+import asyncio
+import logging
+import struct
+import time
+
+
+import numpy as np
+from Bitacora import LimitadorLog, configurar_registro
+from Metricas import REGISTRO, agregar_argumentos, iniciar_exportacion
+from Protocolo import (LIMITE_ESCRITURA, LIMITE_LECTURA, MAX_REGISTROS_LECTURA, TOLERANCIA_HUECO,
+                       ClienteModbusAsync, ErrorModbus, ErrorProtocolo, construir_trama, leer_trama, pdu_lectura)
+
+
+# Lecturas de registros que se agrupan y se sirven desde la caché (holding e input registers)
+FUNCIONES_CACHE = {3, 4}
+
+
+# Escrituras que invalidan registros de la caché de holding registers: función -> posición de
+# (dirección, cantidad) en el PDU; sin cantidad se invalida un solo registro
+ESCRITURAS = {6: (1, None), 16: (1, 3), 22: (1, None), 23: (5, 7)}
+
+
+# Funciones que no modifican registros (lecturas, bits y diagnóstico); cualquier otra invalida la caché
+SIN_ESCRITURA_REGISTROS = {1, 2, 3, 4, 5, 7, 8, 11, 12, 15, 17, 43}
+
+
+# Excepciones que devuelve el proxy cuando el equipo no contesta (códigos de pasarela Modbus)
+PASARELA_SIN_CAMINO = 0x0A
+PASARELA_SIN_RESPUESTA = 0x0B
+
+
+# La caché se reserva por bloques de registros a medida que se leen, no por unidad entera
+TAM_BLOQUE_CACHE = 256
+
+
+# Cachés (unidad, función) que se conservan; la unidad la elige el cliente, así que sin
+# límite un cliente que recorre unidades haría crecer la memoria. Se descarta la menos usada
+MAX_CACHES = 64
+
+
+class CacheRegistros:
+    # Registros de una unidad y función, guardados ya en el orden de bytes de Modbus: una
+    # respuesta es una concatenación de slices sin conversión. Cada registro recuerda cuándo se
+    # leyó. Solo existen los bloques de TAM_BLOQUE_CACHE registros que alguna vez se leyeron
+    def __init__(self):
+        self.bloques = {}
+        self.generacion = 0
+
+
+    def tramos(self, inicio, cantidad):
+        # (bloque, desde, hasta) de cada bloque que toca el rango
+        fin = min(inicio + cantidad, 65536)
+        while inicio < fin:
+            numero, desde = divmod(inicio, TAM_BLOQUE_CACHE)
+            hasta = min(TAM_BLOQUE_CACHE, desde + fin - inicio)
+            yield numero, desde, hasta
+            inicio += hasta - desde
+
+
+    def fresco(self, inicio, cantidad, limite):
+        for numero, desde, hasta in self.tramos(inicio, cantidad):
+            bloque = self.bloques.get(numero)
+            if bloque is None or bloque[1][desde:hasta].min() < limite:
+                return False
+        return True
+
+
+    def guardar(self, inicio, registros, marca, generacion):
+        # Una lectura que empezó antes de una escritura no debe volver a llenar lo invalidado
+        if generacion != self.generacion:
+            return
+        posicion = 0
+        for numero, desde, hasta in self.tramos(inicio, len(registros)):
+            bloque = self.bloques.get(numero)
+            if bloque is None:
+                bloque = self.bloques[numero] = (np.zeros(TAM_BLOQUE_CACHE, dtype='>u2'),
+                                                 np.full(TAM_BLOQUE_CACHE, -np.inf))
+            bloque[0][desde:hasta] = registros[posicion:posicion + hasta - desde]
+            bloque[1][desde:hasta] = marca
+            posicion += hasta - desde
+
+
+    def invalidar(self, inicio=0, cantidad=65536):
+        for numero, desde, hasta in self.tramos(inicio, cantidad):
+            bloque = self.bloques.get(numero)
+            if bloque is not None:
+                bloque[1][desde:hasta] = -np.inf
+        self.generacion += 1
+
+
+    def respuesta(self, funcion, inicio, cantidad):
+        return bytes([funcion, 2 * cantidad]) + b''.join(self.bloques[numero][0][desde:hasta].tobytes()
+                                                         for numero, desde, hasta in self.tramos(inicio, cantidad))
+
+
+class LecturaDividida(Exception):
+    # Una lectura agrupada se repitió por partes: quien esperaba por ella busca la parte que lo cubre
+    pass
+
+
+def agrupar(peticiones, tolerancia_hueco=TOLERANCIA_HUECO, max_registros=MAX_REGISTROS_LECTURA):
+    # peticiones: (inicio, fin, futuro). Rangos iguales o solapados (o separados por un hueco
+    # tolerable) se unen en una sola lectura sin superar el límite del protocolo
+    rangos = []
+    for inicio, fin, futuro in sorted(peticiones, key=lambda peticion: peticion[0]):
+        if rangos:
+            rango = rangos[-1]
+            if inicio - rango[1] <= tolerancia_hueco and max(fin, rango[1]) - rango[0] <= max_registros:
+                rango[1] = max(fin, rango[1])
+                rango[2].append((inicio, fin, futuro))
+                continue
+        rangos.append([inicio, fin, [(inicio, fin, futuro)]])
+    return rangos
+
+
+class ProxyModbus:
+    # Modbus TCP delante de un equipo lento: las lecturas de registros concurrentes para la
+    # misma unidad se agrupan en una sola petición al equipo, las repetidas dentro de la
+    # ventana de frescura se responden desde la caché y todo lo demás pasa directo
+    def __init__(self, equipo, host='localhost', port=502, frescura=0.5, espera_agrupado=0.0,
+                 max_conexiones=10000, tolerancia_hueco=TOLERANCIA_HUECO):
+        self.equipo = equipo
+        self.host = host
+        self.port = port
+        self.frescura = frescura
+        self.espera_agrupado = espera_agrupado
+        self.max_conexiones = max_conexiones
+        self.tolerancia_hueco = tolerancia_hueco
+        self.conexiones = 0
+        self.limitador = LimitadorLog()
+
+
+        # Por (unidad, función): caché, peticiones esperando a agruparse y lecturas en curso
+        self.caches = {}
+        self.cola = {}
+        self.en_vuelo = {}
+
+
+        destino = {'destino': f"{equipo.host}:{equipo.port}"}
+        self.metricas = {resultado: REGISTRO.contador('proxy_peticiones_total', "Peticiones de clientes atendidas",
+                                                      dict(destino, resultado=resultado))
+                         for resultado in ('cache', 'agrupada', 'equipo', 'directa', 'error')}
+        self.metrica_lecturas = REGISTRO.contador('proxy_lecturas_equipo_total',
+                                                  "Lecturas de registros enviadas al equipo", destino)
+        self.metrica_respuesta = REGISTRO.histograma('proxy_respuesta_segundos',
+                                                     "Tiempo de respuesta a los clientes", destino)
+        REGISTRO.exponer('proxy_conexiones_activas', "Conexiones de clientes abiertas",
+                         lambda: self.conexiones, destino)
+
+
+    def cache(self, clave):
+        # El diccionario queda ordenado por uso: la primera clave es la menos usada
+        cache = self.caches.pop(clave, None)
+        if cache is None:
+            cache = CacheRegistros()
+            if len(self.caches) >= MAX_CACHES:
+                del self.caches[next(iter(self.caches))]
+        self.caches[clave] = cache
+        return cache
+
+
+    async def procesar(self, unidad, pdu):
+        funcion = pdu[0]
+        try:
+            if funcion in FUNCIONES_CACHE and len(pdu) == 5:
+                inicio, cantidad = struct.unpack_from('>HH', pdu, 1)
+                if 1 <= cantidad <= MAX_REGISTROS_LECTURA and inicio + cantidad <= 65536:
+                    return await self.leer(unidad, funcion, inicio, cantidad)
+
+
+            # Escrituras y demás funciones: directo al equipo; lo escrito deja de estar en caché
+            self.invalidar(unidad, pdu)
+            respuesta = await self.equipo.ejecutar(unidad, pdu)
+            self.invalidar(unidad, pdu)
+            self.metricas['directa'].incrementar()
+            return respuesta
+        except ErrorModbus as e:
+            self.metricas['error'].incrementar()
+            return bytes([funcion | 0x80, e.codigo])
+        except asyncio.TimeoutError:
+            self.metricas['error'].incrementar()
+            return bytes([funcion | 0x80, PASARELA_SIN_RESPUESTA])
+        except (ConnectionError, OSError) as e:
+            self.metricas['error'].incrementar()
+            self.limitador.registrar(logging.WARNING, 'equipo', "Equipo no disponible: %s", e)
+            return bytes([funcion | 0x80, PASARELA_SIN_CAMINO])
+
+
+    def invalidar(self, unidad, pdu):
+        funcion = pdu[0]
+        if funcion in SIN_ESCRITURA_REGISTROS:
+            return
+        # Una función desconocida (o una trama corta) puede escribir cualquier registro
+        inicio, cantidad = 0, 65536
+        if funcion in ESCRITURAS and len(pdu) >= 5:
+            posicion, posicion_cantidad = ESCRITURAS[funcion]
+            inicio = struct.unpack_from('>H', pdu, posicion)[0]
+            cantidad = 1
+            if posicion_cantidad is not None and len(pdu) >= posicion_cantidad + 2:
+                cantidad = struct.unpack_from('>H', pdu, posicion_cantidad)[0]
+
+
+        clave = (unidad, 3)
+        cache = self.caches.get(clave)
+        if cache is not None:
+            cache.invalidar(inicio, cantidad)
+
+
+        # Las lecturas en curso que tocan lo escrito pueden traer el valor anterior: se sacan
+        # de en_vuelo para que ninguna petición posterior se sume a ellas. Quien ya esperaba
+        # recibe su resultado igual (su petición llegó antes de terminar la escritura)
+        fin = inicio + cantidad
+        en_vuelo = self.en_vuelo.get(clave)
+        if en_vuelo:
+            en_vuelo[:] = [entrada for entrada in en_vuelo if entrada[1] <= inicio or fin <= entrada[0]]
+
+
+    async def leer(self, unidad, funcion, inicio, cantidad):
+        clave = (unidad, funcion)
+        cache = self.cache(clave)
+        fin = inicio + cantidad
+        loop = asyncio.get_running_loop()
+        if cache.fresco(inicio, cantidad, loop.time() - self.frescura):
+            self.metricas['cache'].incrementar()
+            return cache.respuesta(funcion, inicio, cantidad)
+
+
+        # Una lectura en curso que ya cubre el rango sirve también para esta petición. Si se
+        # divide por una dirección que el equipo no tiene, se busca entre las que la reemplazan
+        encontrada = self.en_curso(clave, inicio, fin)
+        while encontrada is not None:
+            desde, futuro = encontrada
+            try:
+                registros = await asyncio.shield(futuro)
+            except LecturaDividida:
+                encontrada = self.en_curso(clave, inicio, fin)
+                continue
+            self.metricas['agrupada'].incrementar()
+            return self.recortar(registros, desde, funcion, inicio, cantidad)
+
+
+        # Si no, se espera a la siguiente vuelta del bucle (o espera_agrupado) para juntarla
+        # con las demás lecturas que lleguen para la misma unidad y función
+        futuro = loop.create_future()
+        cola = self.cola.setdefault(clave, [])
+        cola.append((inicio, fin, futuro))
+        if len(cola) == 1:
+            loop.call_later(self.espera_agrupado, self.vaciar, clave)
+        return await futuro
+
+
+    def en_curso(self, clave, inicio, fin):
+        for desde, hasta, futuro in self.en_vuelo.get(clave, ()):
+            if desde <= inicio and fin <= hasta:
+                return desde, futuro
+        return None
+
+
+    def recortar(self, registros, desde, funcion, inicio, cantidad):
+        return bytes([funcion, 2 * cantidad]) + registros[inicio - desde:inicio - desde + cantidad].tobytes()
+
+
+    def vaciar(self, clave):
+        peticiones = self.cola.pop(clave, [])
+        for desde, hasta, grupo in agrupar(peticiones, self.tolerancia_hueco):
+            futuro = asyncio.get_running_loop().create_future()
+            self.en_vuelo.setdefault(clave, []).append((desde, hasta, futuro))
+            asyncio.create_task(self.leer_equipo(clave, desde, hasta, grupo, futuro))
+
+
+    async def leer_equipo(self, clave, desde, hasta, grupo, futuro):
+        unidad, funcion = clave
+        cache = self.cache(clave)
+        marca = asyncio.get_running_loop().time()
+        generacion = cache.generacion
+        try:
+            self.metrica_lecturas.incrementar()
+            pdu = await self.equipo.ejecutar(unidad, pdu_lectura(funcion, desde, hasta - desde))
+            if pdu[0] & 0x80 and len(pdu) >= 2:
+                raise ErrorModbus(pdu[0] & 0x7F, pdu[1])
+            if pdu[0] != funcion or len(pdu) != 2 + 2 * (hasta - desde) or pdu[1] != 2 * (hasta - desde):
+                # Una respuesta corta o de otra función no se sirve: para el cliente el equipo no respondió
+                raise ErrorModbus(funcion, PASARELA_SIN_RESPUESTA)
+            registros = np.frombuffer(pdu, dtype='>u2', count=hasta - desde, offset=2)
+        except ErrorModbus as e:
+            if len(grupo) > 1 and e.codigo == 2:
+                # La unión cruzó direcciones que el equipo no tiene: cada petición por separado
+                for inicio, fin, original in grupo:
+                    self.reintentar(clave, inicio, fin, original)
+                futuro.set_exception(LecturaDividida())
+                futuro.exception()
+                return
+            self.terminar(futuro, grupo, e)
+            return
+        except Exception as e:
+            self.terminar(futuro, grupo, e)
+            return
+        finally:
+            # Una escritura pudo haberla retirado ya de en_vuelo
+            en_vuelo = self.en_vuelo[clave]
+            if (desde, hasta, futuro) in en_vuelo:
+                en_vuelo.remove((desde, hasta, futuro))
+
+
+        cache.guardar(desde, registros, marca, generacion)
+        futuro.set_result(registros)
+        for inicio, fin, original in grupo:
+            if not original.done():
+                original.set_result(self.recortar(registros, desde, funcion, inicio, fin - inicio))
+        self.metricas['equipo'].incrementar()
+        if len(grupo) > 1:
+            self.metricas['agrupada'].incrementar(len(grupo) - 1)
+
+
+    def reintentar(self, clave, inicio, fin, original):
+        futuro = asyncio.get_running_loop().create_future()
+        self.en_vuelo.setdefault(clave, []).append((inicio, fin, futuro))
+        asyncio.create_task(self.leer_equipo(clave, inicio, fin, [(inicio, fin, original)], futuro))
+
+
+    def terminar(self, futuro, grupo, error):
+        # El error llega a cada petición del grupo y a las que esperaban la lectura en curso
+        futuro.set_exception(error)
+        futuro.exception()
+        for _, _, original in grupo:
+            if not original.done():
+                original.set_exception(error)
+
+
+    async def atender(self, reader, writer):
+        if self.conexiones >= self.max_conexiones:
+            logging.warning("Conexión rechazada: límite de %d conexiones", self.max_conexiones)
+            writer.close()
+            return
+
+
+        self.conexiones += 1
+        writer.transport.set_write_buffer_limits(high=LIMITE_ESCRITURA)
+        try:
+            while True:
+                transaccion, unidad, pdu = await leer_trama(reader)
+                inicio = time.perf_counter()
+                respuesta = await self.procesar(unidad, pdu)
+                self.metrica_respuesta.observar(time.perf_counter() - inicio)
+                writer.write(construir_trama(transaccion, unidad, respuesta))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ErrorProtocolo, ConnectionError):
+            pass
+        finally:
+            self.conexiones -= 1
+            writer.close()
+
+
+    async def servir(self):
+        servidor = await asyncio.start_server(self.atender, self.host, self.port,
+                                              limit=LIMITE_LECTURA, backlog=1024)
+        async with servidor:
+            try:
+                await servidor.serve_forever()
+            finally:
+                await self.equipo.cerrar()
+
+
+    def iniciar(self):
+        logging.info("Proxy Modbus TCP en %s:%d -> %s:%d (frescura %g s)", self.host, self.port,
+                     self.equipo.host, self.equipo.port, self.frescura)
+        try:
+            asyncio.run(self.servir())
+        except KeyboardInterrupt:
+            logging.info("Proxy detenido")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Proxy Modbus TCP con caché y agrupación de lecturas")
+    parser.add_argument('equipo', help="equipo protegido, host[:puerto]")
+    parser.add_argument('--host', default='localhost', help="dirección de escucha")
+    parser.add_argument('--port', type=int, default=502, help="puerto de escucha")
+    parser.add_argument('--frescura', type=float, default=0.5,
+                        help="segundos durante los que un registro leído se sirve desde la caché (0 = solo agrupar)")
+    parser.add_argument('--espera-agrupado', type=float, default=0.0,
+                        help="segundos que una lectura espera a otras para agruparse (0 = la misma vuelta del bucle)")
+    parser.add_argument('--timeout', type=float, default=1.0, help="timeout por petición al equipo en segundos")
+    parser.add_argument('--max-en-vuelo', type=int, default=1,
+                        help="peticiones simultáneas al equipo")
+    parser.add_argument('--max-conexiones', type=int, default=10000, help="conexiones de clientes admitidas")
+    agregar_argumentos(parser)
+    args = parser.parse_args(argv)
+
+
+    host, _, port = args.equipo.partition(':')
+    equipo = ClienteModbusAsync(host, int(port or 502), args.timeout, args.max_en_vuelo)
+    proxy = ProxyModbus(equipo, args.host, args.port, args.frescura, args.espera_agrupado, args.max_conexiones)
+    iniciar_exportacion(args)
+    proxy.iniciar()
+
+
+if __name__ == "__main__":
+    configurar_registro(formato='%(asctime)s - %(message)s', datefmt=None)
+    main()
@@ -0,0 +1,159 @@
+import csv
+import json
+import logging
+import os
+import socket
+import sys
+import time
+
+
+class Salida:
+    def __init__(self, tam_lote=100, intervalo=1.0):
+        # Las muestras se acumulan y se escriben por lotes
+        self.tam_lote = tam_lote
+        self.intervalo = intervalo
+        self.pendientes = []
+        self.ultimo_vaciado = time.monotonic()
+
+
+    def escribir(self, marca_tiempo, valores):
+        self.pendientes.append((marca_tiempo, valores))
+        if (len(self.pendientes) >= self.tam_lote or
+                time.monotonic() - self.ultimo_vaciado >= self.intervalo):
+            self.vaciar()
+
+
+    def vaciar(self):
+        self.ultimo_vaciado = time.monotonic()
+        if not self.pendientes:
+            return
+
+
+        lote = self.pendientes
+        self.pendientes = []
+        try:
+            self.escribir_lote(lote)
+        except OSError as e:
+            logging.error("Error en salida %s: %s", self.__class__.__name__, e)
+
+
+    def escribir_lote(self, lote):
+        raise NotImplementedError
+
+
+    def cerrar(self):
+        self.vaciar()
+
+
+def a_jsonl(lote):
+    return "".join(json.dumps({'t': marca_tiempo, **valores}, ensure_ascii=False) + "\n"
+                   for marca_tiempo, valores in lote)
+
+
+class SalidaJsonl(Salida):
+    def __init__(self, ruta=None, **kwargs):
+        super().__init__(**kwargs)
+        self.archivo = sys.stdout if ruta in (None, '-') else open(ruta, 'a', encoding='utf-8')
+
+
+    def escribir_lote(self, lote):
+        self.archivo.write(a_jsonl(lote))
+        self.archivo.flush()
+
+
+    def cerrar(self):
+        super().cerrar()
+        if self.archivo is not sys.stdout:
+            self.archivo.close()
+
+
+class SalidaCsvRotativa(Salida):
+    def __init__(self, ruta, max_bytes=10 * 1024 * 1024, copias=5, **kwargs):
+        super().__init__(**kwargs)
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self.copias = copias
+        self.columnas = None
+        self.archivo = None
+
+
+    def abrir(self):
+        self.archivo = open(self.ruta, 'a', newline='', encoding='utf-8')
+        self.escritor = csv.writer(self.archivo)
+        if self.archivo.tell() == 0:
+            self.escritor.writerow(['t'] + self.columnas)
+
+
+    def rotar(self):
+        # ruta -> ruta.1 -> ruta.2 ... igual que RotatingFileHandler
+        self.archivo.close()
+        for i in range(self.copias - 1, 0, -1):
+            if os.path.exists(f"{self.ruta}.{i}"):
+                os.replace(f"{self.ruta}.{i}", f"{self.ruta}.{i + 1}")
+        os.replace(self.ruta, f"{self.ruta}.1")
+        self.abrir()
+
+
+    def escribir_lote(self, lote):
+        if self.columnas is None:
+            self.columnas = list(lote[0][1])
+        if self.archivo is None:
+            self.abrir()
+
+
+        self.escritor.writerows([marca_tiempo] + [valores.get(columna, '') for columna in self.columnas]
+                                for marca_tiempo, valores in lote)
+        self.archivo.flush()
+        if self.archivo.tell() >= self.max_bytes:
+            self.rotar()
+
+
+    def cerrar(self):
+        super().cerrar()
+        if self.archivo is not None:
+            self.archivo.close()
+
+
+class SalidaSocketUnix(Salida):
+    def __init__(self, ruta, **kwargs):
+        super().__init__(**kwargs)
+        self.ruta = ruta
+        self.socket = None
+        self.avisado = False
+
+
+    def escribir_lote(self, lote):
+        datos = a_jsonl(lote).encode('utf-8')
+        try:
+            if self.socket is None:
+                self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.socket.settimeout(1.0)
+                self.socket.connect(self.ruta)
+                self.avisado = False
+            self.socket.sendall(datos)
+        except OSError as e:
+            # Sin lector conectado el lote se descarta y se reintenta en el siguiente
+            if self.socket is not None:
+                self.socket.close()
+                self.socket = None
+            if not self.avisado:
+                logging.warning("Socket %s no disponible: %s", self.ruta, e)
+                self.avisado = True
+
+
+    def cerrar(self):
+        super().cerrar()
+        if self.socket is not None:
+            self.socket.close()
+
+
+def crear_salida(especificacion):
+    # Formatos: jsonl, jsonl:archivo, csv:archivo, unix:/ruta/socket
+    tipo, _, destino = especificacion.partition(':')
+    if tipo == 'jsonl':
+        return SalidaJsonl(destino or None)
+    if tipo == 'csv':
+        return SalidaCsvRotativa(destino or 'muestras.csv')
+    if tipo == 'unix':
+        return SalidaSocketUnix(destino)
+    raise ValueError(f"Salida desconocida: {especificacion}")
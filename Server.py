@@ -1,75 +1,262 @@
 from pymodbus.server.sync import StartTcpServer
 from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
+from pymodbus.exceptions import NoSuchSlaveException
+from pymodbus.factory import ServerDecoder
+from pymodbus.pdu import ModbusExceptions
+from Bitacora import LimitadorLog, ResumenPeriodico, configurar_registro
+from Historiador import Historiador
+from Metricas import REGISTRO, agregar_argumentos, iniciar_exportacion
+from Protocolo import (LIMITE_ESCRITURA, LIMITE_LECTURA, REGISTRO_TICK, ErrorProtocolo, construir_trama,
+                       leer_definiciones, leer_trama)
+from Tendencias import MAX_SILENCIO, DetectorCambios
+import argparse
+import asyncio
+import struct
 import threading
 import time
-import random
 import logging
+from datetime import datetime
+import numpy as np
 
 
-# Configurar logging para ver la actividad del servidor
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+# Caché de respuestas del modo asyncio: funciones de lectura y entradas por tick
+FUNCIONES_LECTURA = {1, 2, 3, 4}
+MAX_CACHE = 4096
+
+
+# Proceso por defecto: las tres variables que muestra el cliente gráfico
+ETIQUETAS_SIMULADAS = [
+    {'nombre': 'temperatura', 'direccion': 0, 'escala': 100, 'unidad': '°C',
+     'minimo': 20, 'maximo': 100, 'inicial': 25.0, 'ruido': 2.0},
+    {'nombre': 'presion', 'direccion': 1, 'escala': 100, 'unidad': 'bar',
+     'minimo': 0, 'maximo': 10, 'inicial': 1.0, 'ruido': 0.5},
+    {'nombre': 'nivel', 'direccion': 2, 'escala': 100, 'unidad': '%',
+     'minimo': 0, 'maximo': 100, 'inicial': 50.0, 'ruido': 3.0},
+]
 
 
 class SimuladorProceso:
-    def __init__(self):
-        self.temperatura = 25.0
-        self.presion = 1.0
-        self.nivel = 50.0
+    def __init__(self, definiciones=None, semilla=None):
+        definiciones = definiciones if definiciones is not None else ETIQUETAS_SIMULADAS
+        self.nombres = [d['nombre'] for d in definiciones]
+        self.unidades = [d.get('unidad', '') for d in definiciones]
+        self.direcciones = np.array([int(d['direccion']) for d in definiciones])
+
+
+        # Un vector por parámetro: cada tick avanza todas las etiquetas en una sola pasada
+        def columna(campo, defecto=np.nan):
+            return np.array([float(d.get(campo, defecto)) for d in definiciones])
+
+
+        self.minimo = columna('minimo', 0.0)
+        self.maximo = columna('maximo', 100.0)
+        self.escala = columna('escala', 1.0)
+        self.ruido = columna('ruido', 0.0)
+        self.deriva = columna('deriva', 0.0)
+        self.tau = columna('tau', 0.0)
+        self.banda_muerta = columna('banda_muerta', 0.0)
+
+
+        # Sin valor inicial se arranca a mitad de rango; sin objetivo, se tiende al inicial
+        inicial = columna('inicial')
+        self.valores = np.where(np.isnan(inicial), (self.minimo + self.maximo) / 2, inicial)
+        objetivo = columna('objetivo')
+        self.objetivo = np.where(np.isnan(objetivo), self.valores, objetivo)
+        # Generador propio: con la misma semilla y configuración, la misma secuencia
+        self.rng = np.random.default_rng(semilla)
+
+
+    @classmethod
+    def desde_archivo(cls, ruta, semilla=None):
+        # Campos por etiqueta: minimo, maximo, inicial, ruido (amplitud por tick), deriva
+        # (unidades por segundo), tau (constante de tiempo de primer orden), objetivo
+        # y banda_muerta (cambio mínimo que se publica)
+        return cls(leer_definiciones(ruta), semilla)
 
 
-    def simular_cambios(self):
-        # Simular cambios más notables para mejor visualización
-        self.temperatura += random.uniform(-2, 2)
-        self.presion += random.uniform(-0.5, 0.5)
-        self.nivel += random.uniform(-3, 3)
+    def simular_cambios(self, dt=1.0):
+        # Primer orden hacia el objetivo (solo donde tau > 0), deriva y ruido uniforme
+        with np.errstate(divide='ignore'):
+            factor = np.where(self.tau > 0, np.minimum(dt / self.tau, 1.0), 0.0)
+        self.valores += (self.objetivo - self.valores) * factor
+        self.valores += self.deriva * dt
+        self.valores += self.ruido * self.rng.uniform(-1.0, 1.0, len(self.valores))
 
 
         # Mantener valores en rangos realistas
-        self.temperatura = max(20, min(100, self.temperatura))
-        self.presion = max(0, min(10, self.presion))
-        self.nivel = max(0, min(100, self.nivel))
+        np.clip(self.valores, self.minimo, self.maximo, out=self.valores)
+
+
+        # Valores escalados a registros de 16 bits
+        return np.clip(self.valores * self.escala, 0, 0xFFFF).astype(np.uint16)
+
+
+def avance_rapido(simulador, horas, periodo, historiador, inicio=None, tam_lote=1000):
+    # Genera horas de proceso tan rápido como da la CPU y las guarda en el historiador.
+    # El tiempo simulado avanza exactamente un periodo por tick, sin reloj de pared
+    ticks = int(horas * 3600 / periodo)
+    inicio = inicio if inicio is not None else time.time() - ticks * periodo
+    matriz = np.empty((tam_lote, len(simulador.nombres)), dtype=np.float32)
+
+
+    for desde in range(0, ticks, tam_lote):
+        cantidad = min(tam_lote, ticks - desde)
+        for fila in range(cantidad):
+            # Lo mismo que leería un cliente: el registro de 16 bits dividido por su escala
+            matriz[fila] = simulador.simular_cambios(periodo) / simulador.escala
+        marcas_tiempo = inicio + (desde + np.arange(cantidad)) * periodo
+        historiador.escribir_bloque(marcas_tiempo, {nombre: matriz[:cantidad, j]
+                                                    for j, nombre in enumerate(simulador.nombres)})
+    return ticks
+
+
+class AlmacenMedido(ModbusSlaveContext):
+    # En modo hilos las peticiones las atiende pymodbus: se cuentan los accesos al almacén
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrica_peticiones = REGISTRO.contador('modbus_peticiones_total', "Peticiones atendidas")
+
 
+    def getValues(self, fx, address, count=1):
+        self.metrica_peticiones.incrementar()
+        return super().getValues(fx, address, count)
 
-        return {
-            'temperatura': int(self.temperatura * 100),
-            'presion': int(self.presion * 100),
-            'nivel': int(self.nivel * 100)
-        }
+
+def tamano_imagen(direcciones, registro_tick):
+    # Registros de la imagen de una unidad: las etiquetas, el tick y al menos 99
+    return max(99, int(direcciones.max(initial=0)) + 1, registro_tick + 1)
 
 
 class ServidorModbus:
-    def __init__(self):
+    def __init__(self, host='localhost', port=502, modo='hilos', max_conexiones=10000, simulador=None,
+                 registro_tick=REGISTRO_TICK, periodo=1.0, max_silencio=MAX_SILENCIO, intervalo_log=10.0):
+        self.host = host
+        self.port = port
+        self.modo = modo
+        self.max_conexiones = max_conexiones
+        self.conexiones = 0
+        self.reutilizar_puerto = None
+        self.decodificador = ServerDecoder()
+
+
+        # Reloj del simulador: plazos fijos sobre time.monotonic, sin deriva acumulada
+        self.simulador = simulador if simulador is not None else SimuladorProceso()
+        self.periodo = periodo
+        self.detener = threading.Event()
+        self.ticks_atrasados = 0
+
+
+        # Informe por excepción: solo se publican las etiquetas que superan su banda muerta
+        # (en unidades de registro); un tick sin cambios no publica ni invalida la caché
+        self.detector = DetectorCambios(self.simulador.banda_muerta * self.simulador.escala, max_silencio)
+
+
+        # El bucle no escribe una línea por tick: acumula un resumen de los valores publicados
+        # y limita los errores repetidos
+        self.resumen = ResumenPeriodico(self.simulador.nombres, self.simulador.unidades, intervalo_log)
+        self.limitador = LimitadorLog(intervalo_log)
+
+
+        # Respuestas ya codificadas por (unidad, PDU de la petición), válidas durante un tick
+        self.tick_publicado = 0
+        self.cache = {}
+        self.tick_cache = 0
+        self.contadores = {'cache_aciertos': 0, 'cache_fallos': 0, 'ticks_sin_cambios': 0}
+
+
+        # Captura opcional (Captura.EscritorCaptura): cada imagen publicada y, en modo asyncio,
+        # cada petición con su respuesta
+        self.captura = None
+
+
+        # Métricas: peticiones y su tiempo de proceso en el propio hilo, el resto se lee al exportar
+        self.metrica_peticiones = REGISTRO.contador('modbus_peticiones_total', "Peticiones atendidas")
+        self.metrica_proceso = REGISTRO.histograma('modbus_proceso_segundos',
+                                                   "Tiempo de proceso de cada petición (modo asyncio)")
+        REGISTRO.exponer('modbus_conexiones_activas', "Conexiones abiertas (modo asyncio)",
+                         lambda: self.conexiones)
+        REGISTRO.exponer('modbus_cache_total', "Consultas a la caché de respuestas",
+                         lambda: self.contadores['cache_aciertos'], {'resultado': 'acierto'}, 'counter')
+        REGISTRO.exponer('modbus_cache_total', "Consultas a la caché de respuestas",
+                         lambda: self.contadores['cache_fallos'], {'resultado': 'fallo'}, 'counter')
+        REGISTRO.exponer('modbus_tick', "Último tick publicado", lambda: self.tick_publicado)
+        REGISTRO.exponer('modbus_ticks_atrasados_total', "Ticks del simulador fuera de plazo",
+                         lambda: self.ticks_atrasados, tipo='counter')
+        REGISTRO.exponer('modbus_ticks_sin_cambios_total', "Ticks del simulador sin nada que publicar",
+                         lambda: self.contadores['ticks_sin_cambios'], tipo='counter')
+
+
+        # Contador de publicaciones en un registro reservado (vuelve a 1, nunca vale 0)
+        if registro_tick in self.simulador.direcciones:
+            raise ValueError(f"La dirección {registro_tick} del tick está ocupada por una etiqueta")
+        self.registro_tick = registro_tick
+        self.tick = 0
+
+
+        # Imagen de los holding registers: el simulador la rellena y se publica de una vez
+        # (ModbusSlaveContext suma 1 a cada dirección, de ahí el registro extra)
+        tamano = tamano_imagen(self.simulador.direcciones, registro_tick) + 1
+        self.imagen = np.zeros(tamano - 1, dtype=np.uint16)
+
+
         # Crear almacén de datos Modbus para pymodbus 2.x
-        self.store = ModbusSlaveContext(
-            hr=ModbusSequentialDataBlock(0, [0] * 100),
+        almacen = AlmacenMedido if modo == 'hilos' else ModbusSlaveContext
+        self.store = almacen(
+            hr=ModbusSequentialDataBlock(0, [0] * tamano),
         )
         self.context = ModbusServerContext(slaves=self.store, single=True)
-        self.simulador = SimuladorProceso()
 
 
-    def actualizar_datos(self):
-        while True:
-            try:
-                # Obtener nuevos valores del simulador
-                valores = self.simulador.simular_cambios()
+    def avanzar(self):
+        # Obtener nuevos valores del simulador
+        registros = self.simulador.simular_cambios(self.periodo)
+        cambios = self.detector.cambios(registros, time.monotonic())
+        if not cambios.any():
+            self.contadores['ticks_sin_cambios'] += 1
+            return
+
+
+        self.publicar(registros, cambios)
+        mostradas = len(self.resumen.sumas)
+        self.resumen.agregar(self.imagen[self.simulador.direcciones[:mostradas]] /
+                             self.simulador.escala[:mostradas])
 
 
-                # Actualizar registros Modbus
-                self.store.setValues(3, 0, [valores['temperatura']])
-                self.store.setValues(3, 1, [valores['presion']])
-                self.store.setValues(3, 2, [valores['nivel']])
+    def publicar(self, registros, cambios):
+        self.tick = self.tick % 0xFFFF + 1
+        self.imagen[self.simulador.direcciones[cambios]] = registros[cambios]
+        self.imagen[self.registro_tick] = self.tick
 
 
-                # Mostrar valores actuales
-                logging.info(f"Servidor - Temperatura: {valores['temperatura']/100:.2f}°C, "
-                           f"Presión: {valores['presion']/100:.2f} bar, "
-                           f"Nivel: {valores['nivel']/100:.2f}%")
+        # Publicar la imagen completa con una sola escritura: el bloque se reemplaza
+        # con una asignación de slice que ocurre bajo el GIL, así que una lectura
+        # concurrente ve el tick anterior con sus datos o el nuevo con los suyos
+        self.store.setValues(3, 0, self.imagen.tolist())
+        self.tick_publicado = self.tick
+        if self.captura is not None:
+            # La imagen vale para cualquier unidad (contexto single): unidad 0
+            self.captura.imagen(0, 0, self.imagen)
 
 
-                time.sleep(1)
+    def actualizar_datos(self):
+        siguiente = time.monotonic()
+        while not self.detener.is_set():
+            try:
+                self.avanzar()
+                if self.resumen.vencido():
+                    self.resumen.emitir("Servidor")
             except Exception as e:
-                logging.error(f"Error en actualización: {e}")
-                time.sleep(1)
+                self.limitador.registrar(logging.ERROR, type(e), "Error en actualización: %s", e)
+
+
+            # Si un tick llega tarde se descartan los plazos perdidos en vez de recuperarlos de golpe
+            siguiente += self.periodo
+            espera = siguiente - time.monotonic()
+            if espera < 0:
+                self.ticks_atrasados += 1
+                siguiente = time.monotonic()
+                espera = 0
+            self.detener.wait(espera)
 
 
     def iniciar(self):
@@ -80,10 +267,189 @@ class ServidorModbus:
 
 
         # Iniciar servidor Modbus
-        logging.info("Iniciando servidor Modbus TCP en localhost:5020...")
-        StartTcpServer(self.context, address=("localhost", 502))
+        logging.info("Iniciando servidor Modbus TCP en %s:%d (modo %s)...", self.host, self.port, self.modo)
+        if self.modo == 'asyncio':
+            try:
+                asyncio.run(self.servir())
+            except KeyboardInterrupt:
+                logging.info("Servidor detenido. Contadores: %s", self.contadores)
+        else:
+            StartTcpServer(self.context, address=(self.host, self.port))
+
+
+    async def servir(self):
+        # Todas las conexiones en un solo hilo; sin hilo ni pila por cliente
+        servidor = await asyncio.start_server(self.atender, self.host, self.port,
+                                              limit=LIMITE_LECTURA, backlog=1024,
+                                              reuse_port=self.reutilizar_puerto)
+        async with servidor:
+            await servidor.serve_forever()
+
+
+    async def atender(self, reader, writer):
+        if self.conexiones >= self.max_conexiones:
+            logging.warning("Conexión rechazada: límite de %d conexiones", self.max_conexiones)
+            writer.close()
+            return
+
+
+        # Con drain() un cliente que no lee sus respuestas no hace crecer la memoria
+        self.conexiones += 1
+        writer.transport.set_write_buffer_limits(high=LIMITE_ESCRITURA)
+        try:
+            while True:
+                transaccion, unidad, pdu = await leer_trama(reader)
+                inicio = time.perf_counter()
+                respuesta = self.procesar(unidad, pdu)
+                self.metrica_proceso.observar(time.perf_counter() - inicio)
+                self.metrica_peticiones.incrementar()
+                trama = construir_trama(transaccion, unidad, respuesta)
+                if self.captura is not None:
+                    self.captura.peticion(construir_trama(transaccion, unidad, pdu))
+                    self.captura.respuesta(trama)
+                writer.write(trama)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ErrorProtocolo, ConnectionError):
+            pass
+        finally:
+            self.conexiones -= 1
+            writer.close()
+
+
+    def procesar(self, unidad, pdu):
+        # Las lecturas repetidas dentro de un mismo tick no vuelven a pasar por pymodbus.
+        # El tick se toma antes de ejecutar: si se publica otro durante la lectura, la
+        # entrada queda con datos más nuevos y se descarta en la siguiente petición
+        tick = self.tick_publicado
+        if tick != self.tick_cache:
+            self.cache.clear()
+            self.tick_cache = tick
+
+
+        lectura = pdu[0] in FUNCIONES_LECTURA
+        clave = (unidad, pdu)
+        if lectura:
+            respuesta = self.cache.get(clave)
+            if respuesta is not None:
+                self.contadores['cache_aciertos'] += 1
+                return respuesta
+            self.contadores['cache_fallos'] += 1
+
+
+        respuesta = self.ejecutar(unidad, pdu)
+        if not lectura:
+            # Una escritura de un cliente cambia registros sin pasar por el tick
+            self.cache.clear()
+        elif not respuesta[0] & 0x80 and len(self.cache) < MAX_CACHE:
+            self.cache[clave] = respuesta
+        return respuesta
+
+
+    def ejecutar(self, unidad, pdu):
+        # Mismo contexto y misma lógica de peticiones que el servidor de pymodbus. Una función
+        # desconocida se decodifica como IllegalFunctionRequest; una trama corta hace fallar
+        # el decode de la petición y se contesta con excepción sin cortar la conexión
+        try:
+            peticion = self.decodificador.decode(pdu)
+        except (struct.error, IndexError, ValueError):
+            peticion = None
+        if peticion is None:
+            return bytes([pdu[0] | 0x80, ModbusExceptions.IllegalValue])
+
+
+        try:
+            respuesta = peticion.execute(self.context[unidad])
+        except NoSuchSlaveException:
+            respuesta = peticion.doException(ModbusExceptions.GatewayNoResponse)
+        except Exception as e:
+            self.limitador.registrar(logging.ERROR, ('funcion', pdu[0]), "Error atendiendo la función %d: %s",
+                                     pdu[0], e)
+            respuesta = peticion.doException(ModbusExceptions.SlaveFailure)
+        return bytes([respuesta.function_code]) + respuesta.encode()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor Modbus TCP con proceso simulado")
+    parser.add_argument('--host', default='localhost', help="dirección de escucha")
+    parser.add_argument('--port', type=int, default=502, help="puerto de escucha")
+    parser.add_argument('--modo', choices=['hilos', 'asyncio'], default='hilos',
+                        help="un hilo por cliente (pymodbus) o todas las conexiones en un bucle asyncio")
+    parser.add_argument('--max-conexiones', type=int, default=10000,
+                        help="conexiones simultáneas admitidas en modo asyncio")
+    parser.add_argument('--simulador', help="archivo JSON con las etiquetas a simular")
+    parser.add_argument('--registro-tick', type=int, default=REGISTRO_TICK,
+                        help="registro reservado para el contador de publicaciones")
+    parser.add_argument('--procesos', type=int, default=1,
+                        help="procesos trabajadores (modo asyncio); las unidades se reparten entre ellos")
+    parser.add_argument('--unidades', type=int, default=1,
+                        help="unidades Modbus simuladas (1..N), cada una con su propio proceso simulado")
+    parser.add_argument('--puertos-separados', action='store_true',
+                        help="el trabajador k escucha en puerto + k en lugar de compartir el puerto")
+    parser.add_argument('--semilla', type=int, help="semilla del simulador (datos reproducibles)")
+    parser.add_argument('--periodo', type=float, default=1.0,
+                        help="segundos entre actualizaciones (admite milisegundos, p. ej. 0.005)")
+    parser.add_argument('--max-silencio', type=float, default=MAX_SILENCIO,
+                        help="segundos máximos sin publicar una etiqueta dentro de su banda muerta "
+                             "(0 = publicar cada tick)")
+    parser.add_argument('--intervalo-log', type=float, default=10.0,
+                        help="segundos entre resúmenes (mínimo, máximo y media) de los valores publicados")
+    parser.add_argument('--captura', help="archivo donde grabar las imágenes publicadas y las tramas "
+                                          "(modo asyncio) para reproducirlas con Captura.py")
+    parser.add_argument('--avance-rapido', type=float, metavar='HORAS',
+                        help="generar HORAS de datos en el historiador lo más rápido posible y salir")
+    parser.add_argument('--historiador', help="directorio del historiador para --avance-rapido")
+    parser.add_argument('--desde', help="fecha ISO de inicio del avance rápido (por defecto, termina ahora)")
+    agregar_argumentos(parser)
+    args = parser.parse_args(argv)
+
+
+    if args.simulador:
+        simulador = SimuladorProceso.desde_archivo(args.simulador, args.semilla)
+    else:
+        simulador = SimuladorProceso(semilla=args.semilla)
+
+
+    if args.avance_rapido is not None:
+        if not args.historiador:
+            parser.error("--avance-rapido requiere --historiador")
+        inicio = datetime.fromisoformat(args.desde).timestamp() if args.desde else None
+        historiador = Historiador(args.historiador, simulador.nombres)
+        comienzo = time.perf_counter()
+        ticks = avance_rapido(simulador, args.avance_rapido, args.periodo, historiador, inicio)
+        historiador.cerrar()
+        logging.info("Avance rápido: %d ticks (%g h) en %.1f s -> %s", ticks, args.avance_rapido,
+                     time.perf_counter() - comienzo, args.historiador)
+        return
+
+
+    if args.procesos > 1 or args.unidades > 1:
+        if args.captura:
+            parser.error("--captura no está disponible con varios procesos o unidades")
+        # Supervisor multiproceso con la imagen de registros en memoria compartida
+        from Distribuido import iniciar_supervisor
+        definiciones = leer_definiciones(args.simulador) if args.simulador else ETIQUETAS_SIMULADAS
+        iniciar_supervisor(definiciones, args.procesos, args.unidades, args.host, args.port,
+                           args.puertos_separados, max_conexiones=args.max_conexiones,
+                           semilla=args.semilla, registro_tick=args.registro_tick, periodo=args.periodo,
+                           max_silencio=args.max_silencio, intervalo_log=args.intervalo_log,
+                           metricas=args.metricas, metricas_archivo=args.metricas_archivo,
+                           metricas_intervalo=args.metricas_intervalo)
+        return
+
+
+    servidor = ServidorModbus(args.host, args.port, args.modo, args.max_conexiones, simulador,
+                              args.registro_tick, args.periodo, args.max_silencio, args.intervalo_log)
+    if args.captura:
+        from Captura import EscritorCaptura
+        servidor.captura = EscritorCaptura(args.captura)
+    iniciar_exportacion(args)
+    try:
+        servidor.iniciar()
+    finally:
+        if servidor.captura is not None:
+            servidor.captura.cerrar()
 
 
 if __name__ == "__main__":
-    servidor = ServidorModbus()
-    servidor.iniciar()
+    configurar_registro(formato='%(asctime)s - %(message)s', datefmt=None)
+    main()
@@ -0,0 +1,292 @@
+import math
+
+
+import numpy as np
+
+
+# Segundos máximos sin informar de una etiqueta aunque no cambie
+MAX_SILENCIO = 10.0
+
+
+# Muestras que guarda en memoria el historial de tendencias (10 h a 1 s por muestra)
+CAPACIDAD_HISTORIAL = 36000
+
+
+class DetectorCambios:
+    # Informe por excepción: una etiqueta se informa cuando se aleja de su último valor
+    # informado más que su banda muerta, o cuando lleva max_silencio segundos sin informarse
+    def __init__(self, banda=0.0, max_silencio=MAX_SILENCIO):
+        self.banda = np.asarray(banda, dtype=float)
+        self.max_silencio = max_silencio
+        self.informado = None
+        self.ultimo_informe = None
+
+
+    def comparar(self, valores, marca_tiempo):
+        if self.informado is None:
+            return np.ones(len(valores), dtype=bool)
+
+
+        # Un valor que aparece o desaparece (NaN) también es un cambio
+        with np.errstate(invalid='ignore'):
+            cambio = np.abs(valores - self.informado) > self.banda
+        cambio |= np.isnan(valores) != np.isnan(self.informado)
+        if self.max_silencio is not None:
+            cambio |= marca_tiempo - self.ultimo_informe >= self.max_silencio
+        return cambio
+
+
+    def cambios(self, valores, marca_tiempo):
+        # Por etiqueta: máscara de las que hay que informar; solo esas cuentan como informadas
+        valores = np.asarray(valores, dtype=float)
+        cambio = self.comparar(valores, marca_tiempo)
+        if self.informado is None:
+            self.informado = valores.copy()
+            self.ultimo_informe = np.full(len(valores), float(marca_tiempo))
+        else:
+            self.informado[cambio] = valores[cambio]
+            self.ultimo_informe[cambio] = marca_tiempo
+        return cambio
+
+
+    def hay_cambios(self, valores, marca_tiempo):
+        # Por muestra: si cambió alguna etiqueta se informa la fila completa
+        valores = np.asarray(valores, dtype=float)
+        if not self.comparar(valores, marca_tiempo).any():
+            return False
+        self.informado = valores.copy()
+        self.ultimo_informe = np.full(len(valores), float(marca_tiempo))
+        return True
+
+
+class BufferTendencias:
+    def __init__(self, columnas, capacidad=CAPACIDAD_HISTORIAL):
+        self.columnas = list(columnas)
+        self.capacidad = capacidad
+        self.tipo = np.dtype([('t', 'f8')] + [(columna, 'f8') for columna in self.columnas])
+
+
+        # Cada muestra se escribe dos veces (pos y pos + capacidad) para que
+        # cualquier ventana sea un tramo contiguo y se pueda devolver sin copiar
+        self.datos = np.zeros(2 * capacidad, dtype=self.tipo)
+        self.total = 0
+
+
+    def __len__(self):
+        return min(self.total, self.capacidad)
+
+
+    def agregar(self, marca_tiempo, valores):
+        fila = (marca_tiempo,) + tuple(valores[columna] for columna in self.columnas)
+        posicion = self.total % self.capacidad
+        self.datos[posicion] = fila
+        self.datos[posicion + self.capacidad] = fila
+
+
+        # El total se publica al final: un lector nunca ve una fila a medio escribir
+        self.total += 1
+
+
+    def extender(self, marcas_tiempo, columnas):
+        # Carga masiva (p. ej. desde el historiador) sin recorrer las muestras en Python
+        marcas_tiempo = np.asarray(marcas_tiempo)[-self.capacidad:]
+        cantidad = len(marcas_tiempo)
+        if cantidad == 0:
+            return
+
+
+        posiciones = (self.total + np.arange(cantidad)) % self.capacidad
+        for nombre in self.tipo.names:
+            if nombre == 't':
+                valores = marcas_tiempo
+            elif nombre in columnas:
+                valores = np.asarray(columnas[nombre])[-cantidad:]
+            else:
+                valores = np.nan
+            self.datos[nombre][posiciones] = valores
+            self.datos[nombre][posiciones + self.capacidad] = valores
+        self.total += cantidad
+
+
+    def fin(self):
+        return (self.total - 1) % self.capacidad + self.capacidad + 1
+
+
+    def ventana(self, cantidad=None):
+        # Vista (sin copia) de las últimas muestras, de la más antigua a la más nueva.
+        # Si la ventana ocupa toda la capacidad, su primera fila puede ser
+        # sobrescrita por el productor mientras se lee.
+        disponibles = len(self)
+        if disponibles == 0:
+            return self.datos[:0]
+
+
+        cantidad = disponibles if cantidad is None else min(cantidad, disponibles)
+        fin = self.fin()
+        return self.datos[fin - cantidad:fin]
+
+
+    def desde(self, marca_tiempo):
+        vista = self.ventana()
+        inicio = np.searchsorted(vista['t'], marca_tiempo)
+        return vista[inicio:]
+
+
+    def ultimo(self):
+        if self.total == 0:
+            return None
+        return self.datos[self.fin() - 1]
+
+
+def extremos_por_cubeta(tiempos, valores, ancho):
+    # Mínimo y máximo (con su instante) de cada cubeta de tiempo alineada a múltiplos de ancho
+    validos = ~np.isnan(valores)
+    tiempos = tiempos[validos]
+    valores = valores[validos]
+    if not len(tiempos):
+        vacio = np.empty(0)
+        return np.empty(0, dtype=np.int64), vacio, vacio, vacio, vacio
+
+
+    # Los tiempos vienen ordenados, así que cada cubeta es un tramo contiguo
+    cubetas = np.floor(tiempos / ancho).astype(np.int64)
+    primeros = np.flatnonzero(np.r_[True, cubetas[1:] != cubetas[:-1]])
+    tamanos = np.diff(np.r_[primeros, len(cubetas)])
+    posiciones = np.arange(len(valores))
+    minimos = np.minimum.reduceat(valores, primeros)
+    maximos = np.maximum.reduceat(valores, primeros)
+    i_min = np.maximum.reduceat(np.where(valores == np.repeat(minimos, tamanos), posiciones, -1), primeros)
+    i_max = np.maximum.reduceat(np.where(valores == np.repeat(maximos, tamanos), posiciones, -1), primeros)
+    return cubetas[primeros], tiempos[i_min], valores[i_min], tiempos[i_max], valores[i_max]
+
+
+def intercalar_extremos(t_min, y_min, t_max, y_max):
+    # Dos puntos por cubeta, en el orden en que ocurrieron
+    primero_min = t_min <= t_max
+    tiempos = np.empty(2 * len(t_min))
+    valores = np.empty(2 * len(t_min))
+    tiempos[0::2] = np.where(primero_min, t_min, t_max)
+    tiempos[1::2] = np.where(primero_min, t_max, t_min)
+    valores[0::2] = np.where(primero_min, y_min, y_max)
+    valores[1::2] = np.where(primero_min, y_max, y_min)
+    return tiempos, valores
+
+
+def reducir_minmax(tiempos, valores, puntos):
+    if len(tiempos) <= puntos:
+        return tiempos, valores
+
+
+    ancho = max(tiempos[-1] - tiempos[0], 1e-9) / max(puntos // 2, 1) * (1 + 1e-9)
+    _, t_min, y_min, t_max, y_max = extremos_por_cubeta(tiempos - tiempos[0], valores, ancho)
+    tiempos_reducidos, valores_reducidos = intercalar_extremos(t_min, y_min, t_max, y_max)
+    return tiempos_reducidos + tiempos[0], valores_reducidos
+
+
+def reducir_lttb(tiempos, valores, puntos):
+    # Largest-Triangle-Three-Buckets: se conservan el primer y el último punto y de cada
+    # cubeta intermedia el que forma el triángulo de mayor área con el punto elegido
+    # en la cubeta anterior y el promedio de la siguiente
+    validos = ~np.isnan(valores)
+    tiempos = np.asarray(tiempos, dtype=float)[validos]
+    valores = np.asarray(valores, dtype=float)[validos]
+    cantidad = len(tiempos)
+    if cantidad <= puntos or puntos < 3:
+        return tiempos, valores
+
+
+    limites = np.linspace(1, cantidad - 1, puntos - 1).astype(np.int64)
+    inicios = limites[:-1]
+    tamanos = np.diff(limites)
+
+
+    # Promedios de todas las cubetas de una vez; la última "siguiente" es el punto final
+    promedio_t = np.add.reduceat(tiempos[1:-1], inicios - 1) / tamanos
+    promedio_y = np.add.reduceat(valores[1:-1], inicios - 1) / tamanos
+    siguiente_t = np.r_[promedio_t[1:], tiempos[-1]]
+    siguiente_y = np.r_[promedio_y[1:], valores[-1]]
+
+
+    # Candidatas en una matriz (cubeta x posición) rellenada con el último índice válido
+    ancho = tamanos.max()
+    indices = inicios[:, None] + np.arange(ancho)
+    indices = np.minimum(indices, (inicios + tamanos - 1)[:, None])
+    candidatos = np.stack([tiempos[indices], valores[indices], np.ones(indices.shape)], axis=-1)
+    siguiente_t = siguiente_t.tolist()
+    siguiente_y = siguiente_y.tolist()
+
+
+    # La dependencia con el punto anterior obliga a recorrer las cubetas en orden,
+    # pero cada paso es un único producto vectorial sobre sus candidatas: el área
+    # del triángulo (a, candidata, siguiente) es lineal en (t, y, 1)
+    elegidos = np.empty(puntos, dtype=np.int64)
+    elegidos[0] = 0
+    elegidos[-1] = cantidad - 1
+    a_t = float(tiempos[0])
+    a_y = float(valores[0])
+    for i in range(len(inicios)):
+        dt = a_t - siguiente_t[i]
+        dy = siguiente_y[i] - a_y
+        k = int(np.abs(candidatos[i] @ (dy, dt, -dt * a_y - a_t * dy)).argmax())
+        a_t, a_y = candidatos[i, k, 0], candidatos[i, k, 1]
+        elegidos[i + 1] = indices[i, k]
+    return tiempos[elegidos], valores[elegidos]
+
+
+class ReductorTendencias:
+    # Resumen min/max de una ventana deslizante en cubetas de ancho fijo (una por
+    # punto de pantalla). Las cubetas cerradas se conservan entre cuadros y solo se
+    # agregan las muestras nuevas, así el coste por cuadro no depende del largo de la ventana
+    def __init__(self, columnas, puntos=800, metodo='minmax'):
+        if metodo not in ('minmax', 'lttb'):
+            raise ValueError(f"Método de reducción desconocido: {metodo}")
+        self.columnas = list(columnas)
+        self.puntos = puntos
+        self.metodo = metodo
+        self.configurar(60.0)
+
+
+    def configurar(self, ventana):
+        self.ventana = ventana
+        self.ancho = ventana / self.puntos
+        self.t_ultimo = None
+        self.resumen = {columna: [np.empty(0, dtype=np.int64)] + [np.empty(0)] * 4
+                        for columna in self.columnas}
+
+
+    def agregar(self, tiempos, columnas):
+        # Las muestras deben llegar en orden; repetir las ya agregadas no altera el resumen
+        if not len(tiempos):
+            return
+
+
+        for columna in self.columnas:
+            nuevo = extremos_por_cubeta(tiempos, np.asarray(columnas[columna], dtype=float), self.ancho)
+            actual = self.resumen[columna]
+            if len(nuevo[0]) and len(actual[0]) and actual[0][-1] == nuevo[0][0]:
+                # La cubeta abierta se combina con su parte ya resumida
+                cubeta, t_min, y_min, t_max, y_max = (campo[-1] for campo in actual)
+                if y_min < nuevo[2][0]:
+                    nuevo[1][0], nuevo[2][0] = t_min, y_min
+                if y_max > nuevo[4][0]:
+                    nuevo[3][0], nuevo[4][0] = t_max, y_max
+                actual = [campo[:-1] for campo in actual]
+            self.resumen[columna] = [np.concatenate([viejo, agregado])
+                                     for viejo, agregado in zip(actual, nuevo)]
+        self.t_ultimo = float(tiempos[-1])
+
+
+        # Se descartan las cubetas que ya salieron de la ventana
+        primera = math.floor((self.t_ultimo - self.ventana) / self.ancho)
+        for columna, campos in self.resumen.items():
+            inicio = np.searchsorted(campos[0], primera)
+            if inicio:
+                self.resumen[columna] = [campo[inicio:] for campo in campos]
+
+
+    def serie(self, columna):
+        _, t_min, y_min, t_max, y_max = self.resumen[columna]
+        tiempos, valores = intercalar_extremos(t_min, y_min, t_max, y_max)
+        if self.metodo == 'lttb':
+            return reducir_lttb(tiempos, valores, self.puntos)
+        return tiempos, valores
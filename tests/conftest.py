@@ -0,0 +1,6 @@
+import os
+import sys
+
+
+# Los módulos del proyecto están en la raíz del repositorio, sin paquete
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
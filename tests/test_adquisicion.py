@@ -0,0 +1,66 @@
+import pytest
+
+
+from Adquisicion import ETIQUETA_TICK, Etiqueta, LecturaInconsistente, PlanificadorLecturas
+
+
+def etiquetas(*direcciones):
+    return [Etiqueta(f"e{direccion}", direccion) for direccion in direcciones]
+
+
+def rangos(planificador):
+    return [(bloque.inicio, bloque.cantidad) for bloque in planificador.bloques]
+
+
+def test_une_direcciones_con_hueco_tolerable():
+    planificador = PlanificadorLecturas(etiquetas(0, 1, 5, 20), tolerancia_hueco=3)
+    assert rangos(planificador) == [(0, 6), (20, 1)]
+
+
+def test_divide_por_el_limite_de_registros():
+    planificador = PlanificadorLecturas(etiquetas(*range(0, 300, 2)), tolerancia_hueco=8, max_registros=125)
+    assert rangos(planificador) == [(0, 125), (126, 125), (252, 47)]
+    assert all(bloque.cantidad <= 125 for bloque in planificador.bloques)
+
+
+def test_ordena_las_etiquetas_por_direccion():
+    planificador = PlanificadorLecturas(etiquetas(40, 2, 0, 41), tolerancia_hueco=0)
+    assert rangos(planificador) == [(0, 1), (2, 1), (40, 2)]
+    assert [e.nombre for e in planificador.bloques[2].etiquetas] == ['e40', 'e41']
+
+
+def test_decodifica_cada_bloque():
+    planificador = PlanificadorLecturas(etiquetas(0, 3), tolerancia_hueco=8)
+    assert planificador.bloques[0].decodificar([100, 0, 0, 250]) == {'e0': 1.0, 'e3': 2.5}
+
+
+def test_max_registros_fuera_del_protocolo():
+    with pytest.raises(ValueError):
+        PlanificadorLecturas(etiquetas(0), max_registros=126)
+
+
+def test_el_bloque_del_tick_se_lee_primero():
+    planificador = PlanificadorLecturas(etiquetas(0, 1, 100), tolerancia_hueco=2, registro_tick=99)
+    assert rangos(planificador) == [(99, 2), (0, 2)]
+    assert ETIQUETA_TICK in [e.nombre for e in planificador.bloques[0].etiquetas]
+
+
+def test_tick_en_una_direccion_ocupada():
+    with pytest.raises(ValueError):
+        PlanificadorLecturas(etiquetas(0, 3), registro_tick=3)
+
+
+def test_tick_cambiado_durante_el_barrido():
+    planificador = PlanificadorLecturas(etiquetas(0, 200), registro_tick=3)
+    planificador.comprobar_tick({ETIQUETA_TICK: 7}, 7)
+    with pytest.raises(LecturaInconsistente):
+        planificador.comprobar_tick({ETIQUETA_TICK: 7}, 8)
+
+
+def test_lectura_repetida_sin_publicacion_nueva():
+    planificador = PlanificadorLecturas(etiquetas(0), registro_tick=3)
+    assert not planificador.es_repetida({'e0': 1.0, ETIQUETA_TICK: 5})
+    valores = {'e0': 1.0, ETIQUETA_TICK: 5}
+    assert planificador.es_repetida(valores)
+    assert ETIQUETA_TICK not in valores
+    assert not planificador.es_repetida({'e0': 1.0, ETIQUETA_TICK: 6})
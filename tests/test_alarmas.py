@@ -0,0 +1,87 @@
+from Alarmas import ACTIVADA, NORMALIZADA, MotorAlarmas, ReglaAlarma
+
+
+def motor(**kwargs):
+    return MotorAlarmas([ReglaAlarma('temperatura', 'alto', limite=80.0, **kwargs)], ['temperatura', 'nivel'])
+
+
+def evaluar(alarmas, valor, marca_tiempo):
+    alarmas.evaluar({'temperatura': valor, 'nivel': 50.0}, marca_tiempo)
+    return bool(alarmas.activa[0])
+
+
+def eventos(alarmas):
+    return alarmas.diario.de_regla(0)['evento'].tolist()
+
+
+def test_histeresis():
+    alarmas = motor(histeresis=5.0)
+    assert not evaluar(alarmas, 80.0, 0)
+    assert evaluar(alarmas, 81.0, 1)
+    # Dentro de la banda de histéresis sigue activa
+    assert evaluar(alarmas, 76.0, 2)
+    assert not evaluar(alarmas, 74.9, 3)
+    assert not evaluar(alarmas, 79.0, 4)
+    assert eventos(alarmas) == [ACTIVADA, NORMALIZADA]
+
+
+def test_regla_baja():
+    alarmas = MotorAlarmas([ReglaAlarma('nivel', 'bajo', limite=10.0, histeresis=2.0)], ['nivel'])
+    alarmas.evaluar({'nivel': 9.0}, 0)
+    assert alarmas.activa[0]
+    alarmas.evaluar({'nivel': 11.0}, 1)
+    assert alarmas.activa[0]
+    alarmas.evaluar({'nivel': 12.5}, 2)
+    assert not alarmas.activa[0]
+
+
+def test_retardo_de_activacion():
+    alarmas = motor(retardo_activacion=5.0)
+    assert not evaluar(alarmas, 90.0, 0)
+    assert not evaluar(alarmas, 90.0, 4.9)
+    assert evaluar(alarmas, 90.0, 5.0)
+    assert alarmas.activa_desde[0] == 5.0
+
+
+def test_retardo_se_reinicia_si_la_condicion_desaparece():
+    alarmas = motor(retardo_activacion=5.0)
+    evaluar(alarmas, 90.0, 0)
+    evaluar(alarmas, 70.0, 3)
+    assert not evaluar(alarmas, 90.0, 6)
+    assert not evaluar(alarmas, 90.0, 10)
+    assert evaluar(alarmas, 90.0, 11)
+
+
+def test_retardo_de_normalizacion():
+    alarmas = motor(retardo_normalizacion=3.0)
+    assert evaluar(alarmas, 90.0, 0)
+    assert evaluar(alarmas, 70.0, 1)
+    assert evaluar(alarmas, 70.0, 3.9)
+    assert not evaluar(alarmas, 70.0, 4)
+
+
+def test_valor_ausente_conserva_el_estado():
+    alarmas = motor()
+    assert evaluar(alarmas, 90.0, 0)
+    assert evaluar(alarmas, float('nan'), 1)
+    assert alarmas.valor[0] == 90.0
+
+
+def test_reconocer_y_normalizada_sin_reconocer():
+    alarmas = motor()
+    evaluar(alarmas, 90.0, 0)
+    assert alarmas.estado(0) == 'activa'
+    evaluar(alarmas, 70.0, 1)
+    assert alarmas.estado(0) == 'normalizada'
+    assert alarmas.visibles().tolist() == [0]
+    assert alarmas.reconocer(marca_tiempo=2) == 1
+    assert alarmas.estado(0) == 'normal'
+    assert len(alarmas.visibles()) == 0
+    assert alarmas.reconocer(marca_tiempo=3) == 0
+
+
+def test_comodines_en_la_etiqueta():
+    alarmas = MotorAlarmas([ReglaAlarma('t*', 'alto', limite=1.0)], ['t1', 't2', 'nivel'])
+    assert [regla.etiqueta for regla in alarmas.reglas] == ['t1', 't2']
+    alarmas.evaluar({'t1': 0.0, 't2': 2.0, 'nivel': 5.0}, 0)
+    assert alarmas.activas().tolist() == [1]
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+
+from Captura import IMAGEN, PETICION, RESPUESTA, EscritorCaptura, LectorCaptura
+from Protocolo import construir_trama, pdu_lectura
+
+
+def escribir(ruta, *registros):
+    escritor = EscritorCaptura(str(ruta))
+    for metodo, argumentos in registros:
+        getattr(escritor, metodo)(*argumentos)
+    escritor.cerrar()
+
+
+def test_ida_y_vuelta_de_imagenes(tmp_path):
+    ruta = tmp_path / 'captura.scap'
+    escribir(ruta, ('imagen', (1, 10, [1, 2, 65535], 100.0)), ('imagen', (2, 0, [7], 101.0)))
+    lector = LectorCaptura(str(ruta))
+    assert len(lector) == 2
+    assert lector.tipos.tolist() == [IMAGEN, IMAGEN]
+    imagenes = list(lector.imagenes())
+    assert [(t, unidad, inicio) for t, unidad, inicio, _ in imagenes] == [(100.0, 1, 10), (101.0, 2, 0)]
+    assert imagenes[0][3].tolist() == [1, 2, 65535]
+    lector.cerrar()
+
+
+def test_imagenes_reconstruidas_de_las_tramas(tmp_path):
+    ruta = tmp_path / 'tramas.scap'
+    registros = np.array([100, 200, 300], dtype='>u2')
+    peticion = construir_trama(5, 1, pdu_lectura(3, 20, 3))
+    respuesta = construir_trama(5, 1, bytes([3, 6]) + registros.tobytes())
+    escritura = construir_trama(6, 1, bytes([6, 0, 21, 0x01, 0x02]))
+    escribir(ruta, ('peticion', (peticion, 1.0)), ('respuesta', (respuesta, 1.1)),
+             ('peticion', (escritura, 2.0)), ('respuesta', (escritura, 2.1)))
+    lector = LectorCaptura(str(ruta))
+    assert lector.tipos.tolist() == [PETICION, RESPUESTA, PETICION, RESPUESTA]
+    imagenes = [(t, unidad, inicio, valores.tolist()) for t, unidad, inicio, valores in lector.imagenes()]
+    assert imagenes == [(1.1, 1, 20, [100, 200, 300]), (2.1, 1, 21, [0x0102])]
+    lector.cerrar()
+
+
+def test_captura_cortada_se_lee_hasta_el_ultimo_registro(tmp_path):
+    ruta = tmp_path / 'cortada.scap'
+    escribir(ruta, ('imagen', (1, 0, [1, 2], 1.0)), ('imagen', (1, 0, [3, 4], 2.0)))
+    with open(ruta, 'r+b') as archivo:
+        archivo.truncate(ruta.stat().st_size - 1)
+    lector = LectorCaptura(str(ruta))
+    assert len(lector) == 1
+    assert [valores.tolist() for _, _, _, valores in lector.imagenes()] == [[1, 2]]
+    lector.cerrar()
+
+
+def test_continuar_una_captura_existente(tmp_path):
+    ruta = tmp_path / 'continuada.scap'
+    escribir(ruta, ('imagen', (1, 0, [1], 1.0)))
+    escribir(ruta, ('imagen', (1, 0, [2], 2.0)))
+    lector = LectorCaptura(str(ruta))
+    assert lector.tiempos.tolist() == [1.0, 2.0]
+    lector.cerrar()
+
+
+def test_archivo_que_no_es_una_captura(tmp_path):
+    ruta = tmp_path / 'otro.bin'
+    ruta.write_bytes(b'no es una captura')
+    with pytest.raises(ValueError):
+        LectorCaptura(str(ruta))
@@ -0,0 +1,99 @@
+import os
+
+
+import numpy as np
+import pytest
+
+
+from Historiador import Historiador, LectorHistorico, Segmento, nombre_segmento
+
+
+def segmentos(directorio):
+    return sorted(nombre for nombre in os.listdir(directorio) if nombre.endswith('.dat'))
+
+
+def test_un_segmento_por_periodo(tmp_path):
+    historiador = Historiador(str(tmp_path), ['a'], duracion=10.0, capacidad=100)
+    for t in np.arange(0.0, 30.0, 1.0):
+        historiador.escribir(t, {'a': t})
+    historiador.cerrar()
+    assert segmentos(tmp_path) == [nombre_segmento(0.0), nombre_segmento(10.0), nombre_segmento(20.0)]
+
+
+def test_segmento_lleno_termina_en_el_limite_del_periodo(tmp_path):
+    historiador = Historiador(str(tmp_path), ['a'], duracion=10.0, capacidad=4)
+    for t in np.arange(0.0, 10.0, 1.0):
+        historiador.escribir(t, {'a': t})
+    historiador.cerrar()
+    assert segmentos(tmp_path) == [nombre_segmento(0.0), nombre_segmento(4.0), nombre_segmento(8.0)]
+    segmento = Segmento(str(tmp_path / nombre_segmento(4.0)))
+    assert segmento.t0 == 4.0 and segmento.t0 + segmento.duracion == 10.0
+
+
+def test_reinicio_continua_el_segmento_del_periodo(tmp_path):
+    historiador = Historiador(str(tmp_path), ['a'], duracion=10.0, capacidad=100)
+    historiador.escribir(1.0, {'a': 1.0})
+    historiador.cerrar()
+    historiador = Historiador(str(tmp_path), ['a'], duracion=10.0, capacidad=100)
+    historiador.escribir(2.0, {'a': 2.0})
+    historiador.cerrar()
+    assert segmentos(tmp_path) == [nombre_segmento(0.0)]
+    assert Segmento(str(tmp_path / nombre_segmento(0.0))).cantidad() == 2
+
+
+def test_escribir_bloque_igual_que_muestra_a_muestra(tmp_path):
+    tiempos = np.arange(0.0, 25.0, 0.5)
+    historiador = Historiador(str(tmp_path / 'bloque'), ['a'], duracion=10.0, capacidad=7)
+    historiador.escribir_bloque(tiempos, {'a': tiempos * 2})
+    historiador.cerrar()
+    una_a_una = Historiador(str(tmp_path / 'muestras'), ['a'], duracion=10.0, capacidad=7)
+    for t in tiempos:
+        una_a_una.escribir(t, {'a': t * 2})
+    una_a_una.cerrar()
+    assert segmentos(tmp_path / 'bloque') == segmentos(tmp_path / 'muestras')
+
+
+def test_rango_del_segmento(tmp_path):
+    historiador = Historiador(str(tmp_path), ['a'], duracion=100.0, capacidad=100)
+    for t in (1.0, 2.0, 2.0, 3.0, 5.0):
+        historiador.escribir(t, {'a': t})
+    segmento = historiador.segmento
+    assert segmento.rango(2.0, 3.0) == (1, 4)
+    assert segmento.rango(3.5, 4.5) == (4, 4)
+    assert segmento.rango(0.0, 100.0) == (0, 5)
+    historiador.cerrar()
+
+
+def test_leer_un_rango_que_cruza_segmentos(tmp_path):
+    historiador = Historiador(str(tmp_path), ['a', 'b'], duracion=10.0, capacidad=100)
+    for t in np.arange(0.0, 40.0, 1.0):
+        historiador.escribir(t, {'a': t, 'b': -t})
+    historiador.cerrar()
+    lector = LectorHistorico(str(tmp_path))
+    datos = lector.leer(8.0, 23.0, ['a', 'c'])
+    assert datos['t'].tolist() == list(np.arange(8.0, 24.0))
+    assert datos['a'].tolist() == list(np.arange(8.0, 24.0))
+    assert np.isnan(datos['c']).all()
+    assert len(list(lector.iterar(8.0, 23.0))) == 3
+    assert len(lector.leer(100.0, 200.0, ['a'])['t']) == 0
+    lector.cerrar()
+
+
+def test_columnas_distintas_abren_otro_segmento(tmp_path):
+    historiador = Historiador(str(tmp_path), ['a'], duracion=10.0, capacidad=100)
+    historiador.escribir(1.0, {'a': 1.0})
+    historiador.cerrar()
+    historiador = Historiador(str(tmp_path), ['a', 'b'], duracion=10.0, capacidad=100)
+    historiador.escribir(3.0, {'a': 3.0, 'b': 30.0})
+    historiador.cerrar()
+    assert segmentos(tmp_path) == [nombre_segmento(0.0), nombre_segmento(3.0)]
+    datos = LectorHistorico(str(tmp_path)).leer(0.0, 10.0, ['b'])
+    assert datos['t'].tolist() == [1.0, 3.0]
+    assert np.isnan(datos['b'][0]) and datos['b'][1] == 30.0
+
+
+def test_archivo_que_no_es_un_segmento(tmp_path):
+    ruta = tmp_path / nombre_segmento(0.0)
+    ruta.write_bytes(b'\0' * 8192)
+    with pytest.raises(ValueError):
+        Segmento(str(ruta))
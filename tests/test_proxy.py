@@ -0,0 +1,157 @@
+import asyncio
+import struct
+
+
+import numpy as np
+
+
+from Protocolo import pdu_lectura
+from Proxy import ProxyModbus, agrupar
+
+
+class EquipoFalso:
+    # Unidad con 1000 holding registers (registro i = i) que anota cada PDU recibido
+    def __init__(self, demora=0.01):
+        self.host = 'equipo'
+        self.port = 502
+        self.demora = demora
+        self.registros = np.arange(1000, dtype='>u2')
+        self.peticiones = []
+
+
+    async def ejecutar(self, unidad, pdu):
+        self.peticiones.append(pdu)
+        await asyncio.sleep(self.demora)
+        funcion = pdu[0]
+        if funcion == 3:
+            inicio, cantidad = struct.unpack_from('>HH', pdu, 1)
+            return bytes([3, 2 * cantidad]) + self.registros[inicio:inicio + cantidad].tobytes()
+        if funcion == 6:
+            direccion, valor = struct.unpack_from('>HH', pdu, 1)
+            self.registros[direccion] = valor
+            return pdu
+        return bytes([funcion | 0x80, 1])
+
+
+    async def cerrar(self):
+        pass
+
+
+def registros(respuesta):
+    return np.frombuffer(respuesta, dtype='>u2', offset=2).tolist()
+
+
+def lecturas(equipo):
+    return [struct.unpack_from('>HH', pdu, 1) for pdu in equipo.peticiones if pdu[0] == 3]
+
+
+def escritura(direccion, valor):
+    return struct.pack('>BHH', 6, direccion, valor)
+
+
+def test_agrupar_rangos():
+    rangos = agrupar([(10, 20, 'a'), (0, 5, 'b'), (22, 30, 'c'), (200, 210, 'd')], tolerancia_hueco=8)
+    assert [(desde, hasta, len(grupo)) for desde, hasta, grupo in rangos] == [(0, 30, 3), (200, 210, 1)]
+    rangos = agrupar([(0, 100, 'a'), (100, 200, 'b')], tolerancia_hueco=8, max_registros=125)
+    assert [(desde, hasta) for desde, hasta, _ in rangos] == [(0, 100), (100, 200)]
+
+
+def test_lecturas_concurrentes_en_una_sola_peticion():
+    equipo = EquipoFalso()
+    proxy = ProxyModbus(equipo, frescura=1.0)
+
+
+    async def probar():
+        return await asyncio.gather(proxy.procesar(1, pdu_lectura(3, 0, 10)),
+                                    proxy.procesar(1, pdu_lectura(3, 5, 10)),
+                                    proxy.procesar(1, pdu_lectura(3, 18, 2)))
+
+
+    respuestas = asyncio.run(probar())
+    assert lecturas(equipo) == [(0, 20)]
+    assert registros(respuestas[0]) == list(range(10))
+    assert registros(respuestas[1]) == list(range(5, 15))
+    assert registros(respuestas[2]) == [18, 19]
+
+
+def test_lectura_en_curso_sirve_a_las_que_llegan_despues():
+    equipo = EquipoFalso(demora=0.05)
+    proxy = ProxyModbus(equipo, frescura=0.0)
+
+
+    async def probar():
+        primera = asyncio.ensure_future(proxy.procesar(1, pdu_lectura(3, 0, 50)))
+        await asyncio.sleep(0.01)
+        segunda = await proxy.procesar(1, pdu_lectura(3, 10, 5))
+        return await primera, segunda
+
+
+    primera, segunda = asyncio.run(probar())
+    assert lecturas(equipo) == [(0, 50)]
+    assert registros(segunda) == list(range(10, 15))
+
+
+def test_cache_dentro_de_la_frescura():
+    equipo = EquipoFalso(demora=0.0)
+    proxy = ProxyModbus(equipo, frescura=10.0)
+
+
+    async def probar():
+        await proxy.procesar(1, pdu_lectura(3, 0, 10))
+        return await proxy.procesar(1, pdu_lectura(3, 2, 3))
+
+
+    assert registros(asyncio.run(probar())) == [2, 3, 4]
+    assert lecturas(equipo) == [(0, 10)]
+
+
+def test_escritura_invalida_la_cache():
+    equipo = EquipoFalso(demora=0.0)
+    proxy = ProxyModbus(equipo, frescura=10.0)
+
+
+    async def probar():
+        await proxy.procesar(1, pdu_lectura(3, 0, 10))
+        await proxy.procesar(1, escritura(3, 999))
+        fuera = await proxy.procesar(1, pdu_lectura(3, 5, 5))
+        dentro = await proxy.procesar(1, pdu_lectura(3, 0, 5))
+        return fuera, dentro
+
+
+    fuera, dentro = asyncio.run(probar())
+    # Solo se vuelve a leer el rango que contiene el registro escrito
+    assert lecturas(equipo) == [(0, 10), (0, 5)]
+    assert registros(fuera) == [5, 6, 7, 8, 9]
+    assert registros(dentro) == [0, 1, 2, 999, 4]
+
+
+def test_escritura_durante_una_lectura_no_rellena_la_cache():
+    equipo = EquipoFalso(demora=0.05)
+    proxy = ProxyModbus(equipo, frescura=10.0)
+
+
+    async def probar():
+        lectura = asyncio.ensure_future(proxy.procesar(1, pdu_lectura(3, 0, 10)))
+        await asyncio.sleep(0.01)
+        await proxy.procesar(1, escritura(3, 999))
+        await lectura
+        return await proxy.procesar(1, pdu_lectura(3, 0, 10))
+
+
+    respuesta = asyncio.run(probar())
+    assert lecturas(equipo) == [(0, 10), (0, 10)]
+    assert registros(respuesta)[3] == 999
+
+
+def test_unidades_con_caches_separadas():
+    equipo = EquipoFalso(demora=0.0)
+    proxy = ProxyModbus(equipo, frescura=10.0)
+
+
+    async def probar():
+        await proxy.procesar(1, pdu_lectura(3, 0, 10))
+        await proxy.procesar(2, pdu_lectura(3, 0, 10))
+
+
+    asyncio.run(probar())
+    assert len(lecturas(equipo)) == 2
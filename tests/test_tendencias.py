@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+
+from Tendencias import BufferTendencias, ReductorTendencias, reducir_lttb, reducir_minmax
+
+
+def llenar(buffer, cantidad, desde=0):
+    for i in range(desde, desde + cantidad):
+        buffer.agregar(float(i), {'a': i * 10.0})
+
+
+def test_ventana_antes_de_llenar():
+    buffer = BufferTendencias(['a'], capacidad=5)
+    assert len(buffer.ventana()) == 0
+    assert buffer.ultimo() is None
+    llenar(buffer, 3)
+    assert len(buffer) == 3
+    assert buffer.ventana()['t'].tolist() == [0.0, 1.0, 2.0]
+
+
+def test_ventana_contigua_al_dar_la_vuelta():
+    buffer = BufferTendencias(['a'], capacidad=5)
+    llenar(buffer, 12)
+    ventana = buffer.ventana()
+    assert len(buffer) == 5
+    assert ventana['t'].tolist() == [7.0, 8.0, 9.0, 10.0, 11.0]
+    assert ventana['a'].tolist() == [70.0, 80.0, 90.0, 100.0, 110.0]
+    assert buffer.ventana(2)['t'].tolist() == [10.0, 11.0]
+    assert buffer.ultimo()['t'] == 11.0
+
+
+def test_ventana_es_una_vista_sin_copia():
+    buffer = BufferTendencias(['a'], capacidad=4)
+    llenar(buffer, 6)
+    assert np.shares_memory(buffer.ventana(), buffer.datos)
+
+
+def test_desde_una_marca_de_tiempo():
+    buffer = BufferTendencias(['a'], capacidad=5)
+    llenar(buffer, 9)
+    assert buffer.desde(6.5)['t'].tolist() == [7.0, 8.0]
+    assert buffer.desde(0.0)['t'].tolist() == [4.0, 5.0, 6.0, 7.0, 8.0]
+
+
+def test_extender_conserva_las_ultimas_y_rellena_columnas_ausentes():
+    buffer = BufferTendencias(['a', 'b'], capacidad=4)
+    buffer.extender(np.arange(6.0), {'a': np.arange(6.0) * 2})
+    ventana = buffer.ventana()
+    assert ventana['t'].tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert ventana['a'].tolist() == [4.0, 6.0, 8.0, 10.0]
+    assert np.isnan(ventana['b']).all()
+    buffer.agregar(6.0, {'a': 12.0, 'b': 1.0})
+    assert buffer.ventana()['t'].tolist() == [3.0, 4.0, 5.0, 6.0]
+
+
+def test_minmax_conserva_los_extremos():
+    tiempos = np.arange(1000.0)
+    valores = np.sin(tiempos / 50)
+    valores[321] = 5.0
+    valores[654] = -5.0
+    t, v = reducir_minmax(tiempos, valores, 100)
+    assert len(t) <= 100
+    assert np.all(np.diff(t) >= 0)
+    assert v.max() == 5.0 and t[v.argmax()] == 321.0
+    assert v.min() == -5.0 and t[v.argmin()] == 654.0
+
+
+def test_minmax_sin_reducir_si_caben():
+    tiempos = np.arange(10.0)
+    t, v = reducir_minmax(tiempos, tiempos * 2, 20)
+    assert t is tiempos
+
+
+def test_lttb_conserva_extremos_y_puntos_pedidos():
+    tiempos = np.arange(500.0)
+    valores = np.zeros(500)
+    valores[250] = 10.0
+    t, v = reducir_lttb(tiempos, valores, 50)
+    assert len(t) == 50
+    assert t[0] == 0.0 and t[-1] == 499.0
+    assert 250.0 in t
+    assert np.all(np.diff(t) > 0)
+
+
+def test_lttb_descarta_los_nan():
+    tiempos = np.arange(100.0)
+    valores = np.arange(100.0)
+    valores[::3] = np.nan
+    t, v = reducir_lttb(tiempos, valores, 20)
+    assert not np.isnan(v).any()
+    assert len(t) == 20
+
+
+def test_reductor_incremental_igual_que_de_una_vez():
+    tiempos = np.arange(0.0, 120.0, 0.25)
+    valores = np.cos(tiempos)
+    de_una_vez = ReductorTendencias(['a'], puntos=40)
+    de_una_vez.configurar(60.0)
+    de_una_vez.agregar(tiempos, {'a': valores})
+    por_partes = ReductorTendencias(['a'], puntos=40)
+    por_partes.configurar(60.0)
+    for inicio in range(0, len(tiempos), 7):
+        por_partes.agregar(tiempos[inicio:inicio + 7], {'a': valores[inicio:inicio + 7]})
+    for esperado, obtenido in zip(de_una_vez.serie('a'), por_partes.serie('a')):
+        np.testing.assert_array_equal(esperado, obtenido)
+
+
+def test_reductor_descarta_lo_que_sale_de_la_ventana():
+    reductor = ReductorTendencias(['a'], puntos=10)
+    reductor.configurar(10.0)
+    tiempos = np.arange(0.0, 100.0, 0.5)
+    reductor.agregar(tiempos, {'a': tiempos})
+    t, _ = reductor.serie('a')
+    assert t.min() >= 89.0
+
+
+def test_reductor_metodo_desconocido():
+    with pytest.raises(ValueError):
+        ReductorTendencias(['a'], metodo='media')